@@ -0,0 +1,12 @@
+"""
+    Benchmarks
+    ~~~~~~~~~~
+
+    Reproducible performance benchmarks for the wiki. The
+    :mod:`benchmarks.generator` module builds synthetic content
+    directories and :mod:`benchmarks.suite` times the core, git and web
+    layers on top of them. Run it with::
+
+        python -m benchmarks run --pages 500 --output results.json
+        python -m benchmarks compare old.json results.json
+"""
@@ -0,0 +1,115 @@
+"""
+    Benchmark CLI
+    ~~~~~~~~~~~~~
+"""
+from io import open
+import json
+
+import click
+
+from benchmarks import stress as stress_test
+from benchmarks import suite
+
+
+@click.group()
+def main():
+    """
+        Wiki performance benchmarks.
+    """
+
+
+@main.command()
+@click.option('--pages', default=200, help='Number of pages.')
+@click.option('--paragraphs', default=8, help='Paragraphs per page.')
+@click.option('--words', default=60, help='Words per paragraph.')
+@click.option('--link-density', default=1.0, help='Wikilinks per paragraph.')
+@click.option('--tags', default=20, help='Size of the tag vocabulary.')
+@click.option('--code-blocks', default=1, help='Code blocks per page.')
+@click.option('--namespaces', default=5, help='Number of top level folders.')
+@click.option('--history', default=20, help='Additional git commits.')
+@click.option('--git/--no-git', default=True, help='Create a git repository.')
+@click.option('--maintenance/--no-maintenance', default=False,
+              help='Maintain the git repository before the benchmarks.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--repeat', default=5, help='Timed runs per benchmark.')
+@click.option('--select', default=None,
+              help='Comma separated benchmark name prefixes to run.')
+@click.option('--output', type=click.Path(), default=None,
+              help='Write the JSON results to this file.')
+def run(pages, paragraphs, words, link_density, tags, code_blocks,
+        namespaces, history, git, maintenance, seed, repeat, select,
+        output):
+    """
+        Generate a synthetic wiki and time it.
+    """
+    spec = suite.WikiSpec(
+        pages=pages, paragraphs=paragraphs, words=words,
+        link_density=link_density, tags=tags, code_blocks=code_blocks,
+        namespaces=namespaces, history=history, git=git, seed=seed)
+    results = suite.run(
+        spec, repeat=repeat, select=select, maintain=maintenance,
+        progress=lambda name: click.echo(name, err=True))
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(u'{0}\n'.format(data))
+    else:
+        click.echo(data)
+
+
+@main.command()
+@click.argument('old', type=click.File('r'))
+@click.argument('new', type=click.File('r'))
+def compare(old, new):
+    """
+        Compare the medians of two JSON result files.
+    """
+    for name, before, after, ratio in suite.compare(
+            json.load(old), json.load(new)):
+        if name.startswith('memory.'):
+            click.echo(u'{0:<24} {1:>9.0f}KiB {2:>9.0f}KiB {3:>7.2f}x'.format(
+                name, before / 1024, after / 1024, ratio))
+            continue
+        click.echo(u'{0:<24} {1:>10.2f}ms {2:>10.2f}ms {3:>7.2f}x'.format(
+            name, before * 1000, after * 1000, ratio))
+
+
+@main.command()
+@click.option('--pages', default=100, help='Number of pages.')
+@click.option('--processes', default=4, help='Concurrent processes.')
+@click.option('--operations', default=100, help='Operations per process.')
+@click.option('--git/--no-git', default=True, help='Create a git repository.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--output', type=click.Path(), default=None,
+              help='Write the JSON report to this file.')
+@click.pass_context
+def stress(ctx, pages, processes, operations, git, seed, output):
+    """
+        Write concurrently and check nothing got lost.
+    """
+    report = stress_test.run(
+        suite.WikiSpec(pages=pages, git=git, seed=seed),
+        processes=processes, operations=operations, seed=seed)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(u'{0}\n'.format(json.dumps(report, indent=2,
+                                                 sort_keys=True)))
+    click.echo(u'{0:.1f} operations/s'.format(report['throughput']))
+    click.echo(u'{0:<14} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        u'operation', u'count', u'p50', u'p99', u'lock p50', u'lock p99'))
+    for name in sorted(report['latency']):
+        latency = report['latency'][name]
+        wait = report['lock_wait'][name]
+        click.echo(u'{0:<14} {1:>6} {2:>8.2f}ms {3:>8.2f}ms {4:>8.2f}ms '
+                   u'{5:>8.2f}ms'.format(
+                       name, latency['count'], latency['p50'] * 1000,
+                       latency['p99'] * 1000, wait['p50'] * 1000,
+                       wait['p99'] * 1000))
+    for problem in report['problems']:
+        click.echo(u'PROBLEM: {0}'.format(problem), err=True)
+    if report['problems']:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+    Synthetic wiki generator
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Builds content directories with a configurable number of pages,
+    page size, wikilink density, tags, code blocks and git history
+    depth. The output only depends on the given options, so two runs
+    with the same seed produce byte-identical wikis.
+"""
+from io import open
+import os
+import random
+import subprocess
+
+
+WORDS = (
+    u'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu '
+    u'nu xi omicron pi rho sigma tau upsilon phi chi psi omega server '
+    u'deploy restart backup network storage cluster database replica '
+    u'index cache queue worker request response latency throughput '
+    u'monitor alert runbook incident rollback release branch commit '
+    u'config secret token user group permission audit report migrate'
+).split()
+
+CODE_SNIPPETS = (
+    (u'python', u'def handler(event):\n'
+                u'    for record in event["records"]:\n'
+                u'        process(record)\n'
+                u'    return {"status": 200}\n'),
+    (u'bash', u'#!/bin/sh\n'
+              u'set -e\n'
+              u'systemctl restart wiki\n'
+              u'journalctl -u wiki --since "10 min ago"\n'),
+    (u'sql', u'SELECT url, title\n'
+             u'  FROM pages\n'
+             u' WHERE tags LIKE \'%runbook%\'\n'
+             u' ORDER BY title;\n'),
+)
+
+CONFIG = u"""\
+SECRET_KEY = 'benchmark'
+TITLE = 'benchmark'
+PRIVATE = False
+USE_GIT = {use_git}
+WTF_CSRF_ENABLED = False
+"""
+
+
+class WikiSpec(object):
+    """
+        Describes the synthetic wiki to generate.
+
+        :param int pages: number of pages.
+        :param int paragraphs: number of paragraphs per page.
+        :param int words: number of words per paragraph.
+        :param float link_density: wikilinks per paragraph.
+        :param int tags: size of the tag vocabulary, every page gets
+            up to three of them.
+        :param int code_blocks: fenced code blocks per page.
+        :param int namespaces: number of top level folders pages are
+            spread over, ``0`` keeps all pages in the root.
+        :param int history: number of additional commits that edit
+            random pages, only used together with ``git``.
+        :param bool git: whether to create a git repository.
+        :param int seed: the random seed.
+    """
+
+    def __init__(self, pages=100, paragraphs=8, words=60, link_density=1.0,
+                 tags=20, code_blocks=1, namespaces=5, history=0, git=False,
+                 seed=0):
+        self.pages = pages
+        self.paragraphs = paragraphs
+        self.words = words
+        self.link_density = link_density
+        self.tags = tags
+        self.code_blocks = code_blocks
+        self.namespaces = namespaces
+        self.history = history
+        self.git = git
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def page_urls(spec):
+    """
+        Returns the urls of all pages described by ``spec``.
+    """
+    urls = []
+    for i in range(spec.pages):
+        if spec.namespaces:
+            urls.append(u'ns{0}/page{1}'.format(i % spec.namespaces, i))
+        else:
+            urls.append(u'page{0}'.format(i))
+    return urls
+
+
+def page_content(spec, rnd, urls, index, revision=0):
+    """
+        Builds the raw file content of one page.
+    """
+    tags = sorted(set(
+        u'tag{0}'.format(rnd.randrange(spec.tags))
+        for _ in range(rnd.randint(1, 3))
+    )) if spec.tags else []
+    lines = [
+        u'title: Page {0} {1}'.format(index, rnd.choice(WORDS).title()),
+        u'tags: {0}'.format(u', '.join(tags)),
+        u'',
+    ]
+    code_at = set(rnd.sample(range(spec.paragraphs),
+                             min(spec.code_blocks, spec.paragraphs)))
+    for paragraph in range(spec.paragraphs):
+        words = [rnd.choice(WORDS) for _ in range(spec.words)]
+        links = int(spec.link_density)
+        if rnd.random() < spec.link_density - links:
+            links += 1
+        for _ in range(links):
+            position = rnd.randrange(len(words))
+            words[position] = u'[[{0}]]'.format(rnd.choice(urls))
+        if paragraph == 0:
+            lines.append(u'# {0}'.format(u' '.join(words[:4]).title()))
+            lines.append(u'')
+        lines.append(u' '.join(words))
+        lines.append(u'')
+        if paragraph in code_at:
+            language, code = rnd.choice(CODE_SNIPPETS)
+            lines.append(u'```{0}'.format(language))
+            lines.append(code.rstrip(u'\n'))
+            lines.append(u'```')
+            lines.append(u'')
+    if revision:
+        lines.append(u'Revision {0}.'.format(revision))
+        lines.append(u'')
+    return u'\n'.join(lines)
+
+
+def _write(root, url, content):
+    path = os.path.join(root, url + u'.md')
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def _git(root, *args):
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(('git',) + args, cwd=root,
+                              stdout=devnull, stderr=subprocess.STDOUT)
+
+
+def generate(root, spec):
+    """
+        Generates a synthetic wiki inside ``root``.
+
+        :param str root: the (existing, empty) content directory.
+        :param WikiSpec spec: what to generate.
+
+        :returns: the list of generated page urls
+        :rtype: list
+    """
+    rnd = random.Random(spec.seed)
+    urls = page_urls(spec)
+    with open(os.path.join(root, 'config.py'), 'w', encoding='utf-8') as f:
+        f.write(CONFIG.format(use_git=spec.git))
+    for index, url in enumerate(urls):
+        _write(root, url, page_content(spec, rnd, urls, index))
+    if not spec.git:
+        return urls
+    _git(root, 'init', '-q')
+    _git(root, 'config', 'user.name', 'benchmark')
+    _git(root, 'config', 'user.email', 'benchmark@localhost')
+    _git(root, 'add', '--', *[url + '.md' for url in urls])
+    _git(root, 'commit', '-q', '-m', 'initial import')
+    for revision in range(1, spec.history + 1):
+        index = rnd.randrange(len(urls))
+        _write(root, urls[index],
+               page_content(spec, rnd, urls, index, revision))
+        _git(root, 'commit', '-q', '-a', '-m', 'revision %d' % revision)
+    return urls
@@ -0,0 +1,404 @@
+"""
+    Concurrent write stress test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs several processes against the same content directory at the
+    same time, each saving, moving and deleting pages and adding and
+    updating users in a random (seeded) order:
+
+    ``save``
+        writes one of the pages of the process, new or existing
+    ``save_shared``
+        writes one of a few pages all processes write
+    ``read_shared``
+        reads one of those pages, which must never be incomplete
+    ``move``, ``delete``
+        moves or deletes one of the pages of the process
+    ``add_user``, ``update_user``
+        adds a user or updates one of the users of the process
+
+    Afterwards it checks nothing got lost: every page has the content
+    last written to it, shared pages hold one complete write, every
+    write of a git backed wiki is committed and the work tree is clean,
+    and ``users.json`` can be read and holds every user with its last
+    update.
+
+    The report has the throughput, latency percentiles per operation
+    and how long the operations waited for the ``fasteners`` locks
+    (see :mod:`wiki.named_locks`), so changes to the locking can be
+    measured.
+"""
+from io import open
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import traceback
+
+from benchmarks.generator import generate
+from wiki.metrics import clock
+
+
+#: operation -> relative frequency
+OPERATIONS = (
+    ('save', 30),
+    ('save_shared', 10),
+    ('read_shared', 20),
+    ('move', 8),
+    ('delete', 7),
+    ('add_user', 10),
+    ('update_user', 15),
+)
+
+#: the number of pages all processes write
+SHARED_PAGES = 4
+
+#: a complete page as written by the stress test
+PAGE_RE = re.compile(u'^title: (?P<marker>[^\n]+)\n\nWritten by '
+                     u'(?P=marker)\\.\n$')
+
+
+def page_content(marker):
+    return u'title: {0}\n\nWritten by {0}.\n'.format(marker)
+
+
+def shared_url(index):
+    return u'stress/shared{0}'.format(index)
+
+
+def percentile(values, fraction):
+    """
+        :param list values: sorted values
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(values):
+    """
+        :returns: count, mean, p50, p99 and maximum of ``values``
+        :rtype: dict
+    """
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': percentile(values, 0.5),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else 0.0,
+    }
+
+
+def _choose(rnd):
+    total = sum(weight for _, weight in OPERATIONS)
+    point = rnd.uniform(0, total)
+    for name, weight in OPERATIONS:
+        point -= weight
+        if point <= 0:
+            return name
+    return OPERATIONS[-1][0]
+
+
+class Worker(object):
+    """
+        The operations of one process and what it expects to find
+        afterwards.
+    """
+
+    def __init__(self, index, engine, users, rnd, git):
+        self.name = u'w{0}'.format(index)
+        self.engine = engine
+        self.users = users
+        self.rnd = rnd
+        self.git = git
+        #: url -> marker of the last write of the own pages
+        self.pages = {}
+        #: user name -> the last counter written
+        self.accounts = {}
+        #: the number of commits git backed wikis should have made
+        self.commits = 0
+        #: the markers written to the shared pages
+        self.shared = []
+        #: things read which should not have been
+        self.problems = []
+
+    def run(self, seq):
+        operation = _choose(self.rnd)
+        if operation in ('move', 'delete') and not self.pages:
+            operation = 'save'
+        if operation == 'update_user' and not self.accounts:
+            operation = 'add_user'
+        getattr(self, operation)(seq)
+        return operation
+
+    def marker(self, seq):
+        return u'{0}-{1}'.format(self.name, seq)
+
+    def _write(self, url, marker):
+        self.engine.save(url, u'Written by {0}.\n'.format(marker),
+                         {'title': marker}, author=self.name)
+        if self.git:
+            self.commits += 1
+
+    def save(self, seq):
+        if self.pages and self.rnd.random() < 0.5:
+            url = self.rnd.choice(sorted(self.pages))
+        else:
+            url = u'stress/{0}/p{1}'.format(self.name, seq)
+        self.pages[url] = self.marker(seq)
+        self._write(url, self.pages[url])
+
+    def save_shared(self, seq):
+        marker = self.marker(seq)
+        self.shared.append(marker)
+        self._write(shared_url(self.rnd.randrange(SHARED_PAGES)), marker)
+
+    def read_shared(self, seq):
+        url = shared_url(self.rnd.randrange(SHARED_PAGES))
+        content = self.engine.load(url)
+        if not PAGE_RE.match(content):
+            self.problems.append(u'incomplete read of {0}: {1!r}'.format(
+                url, content[:80]))
+
+    def move(self, seq):
+        url = self.rnd.choice(sorted(self.pages))
+        target = u'stress/{0}/m{1}'.format(self.name, seq)
+        self.engine.move(url, target)
+        self.pages[target] = self.pages.pop(url)
+        if self.git:
+            self.commits += 1
+
+    def delete(self, seq):
+        url = self.rnd.choice(sorted(self.pages))
+        self.engine.delete(url)
+        del self.pages[url]
+        if self.git:
+            self.commits += 1
+
+    def add_user(self, seq):
+        name = self.marker(seq)
+        self.users.add_user(name, u'secret',
+                            authentication_method='cleartext')
+        self.accounts[name] = None
+
+    def update_user(self, seq):
+        name = self.rnd.choice(sorted(self.accounts))
+        user = self.users.get_user(name)
+        if user is None:
+            self.problems.append(u'lost user {0}'.format(name))
+            return
+        user.data['counter'] = seq
+        self.users.update(name, user.data)
+        self.accounts[name] = seq
+
+
+def work(root, index, operations, seed, barrier):
+    """
+        Runs in a process of its own.
+
+        :returns: the samples as ``(operation, seconds, lock wait)``
+            and what the worker expects to find
+        :rtype: dict
+    """
+    from wiki import metrics
+    from wiki.core import Wiki
+    from wiki.web import create_app
+    from wiki.web.user import UserManager
+    from wiki.wikigit import WikiGit
+
+    app = create_app(root)
+    git = bool(app.config.get('USE_GIT'))
+    with app.test_request_context('/'):
+        engine = WikiGit(root) if git else Wiki(root)
+        worker = Worker(index, engine, UserManager(root),
+                        random.Random(seed * 1000 + index), git)
+        samples = []
+        barrier.wait()
+        started = clock()
+        for seq in range(operations):
+            metrics.start_request()
+            operation = worker.run(seq)
+            seconds, timings = metrics.finish_request()
+            samples.append((operation, seconds,
+                            timings.get('lock', (0.0, 0))[0]))
+        elapsed = clock() - started
+    return {
+        'name': worker.name,
+        'samples': samples,
+        'elapsed': elapsed,
+        'pages': worker.pages,
+        'accounts': worker.accounts,
+        'commits': worker.commits,
+        'shared': worker.shared,
+        'problems': worker.problems,
+    }
+
+
+def _work(root, index, operations, seed, barrier, queue):
+    try:
+        queue.put(work(root, index, operations, seed, barrier))
+    except Exception:
+        barrier.abort()
+        queue.put({'name': u'w{0}'.format(index),
+                   'error': traceback.format_exc()})
+
+
+def _git(root, *args):
+    return subprocess.check_output(('git',) + args, cwd=root).decode('utf-8')
+
+
+def prepare(root, spec):
+    """
+        Generates the wiki and the shared pages.
+    """
+    generate(root, spec)
+    for index in range(SHARED_PAGES):
+        path = os.path.join(root, shared_url(index) + '.md')
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(page_content(u'initial'))
+    if spec.git:
+        _git(root, 'add', 'stress')
+        _git(root, 'commit', '-q', '-m', 'stress pages')
+        return _git(root, 'rev-parse', 'HEAD').strip()
+    return None
+
+
+def verify(root, results, start):
+    """
+        Checks the content directory against what the workers expect.
+
+        :param str start: the sha of ``HEAD`` before the workers ran,
+            ``None`` without git
+        :returns: the problems found
+        :rtype: list
+    """
+    problems = []
+    expected = {}
+    shared = set([u'initial'])
+    for result in results:
+        problems.extend(result['problems'])
+        expected.update(result['pages'])
+        shared.update(result['shared'])
+    for url, marker in sorted(expected.items()):
+        try:
+            with open(os.path.join(root, url + '.md'),
+                      encoding='utf-8') as f:
+                content = f.read()
+        except (IOError, OSError):
+            problems.append(u'missing page {0}'.format(url))
+            continue
+        if content != page_content(marker):
+            problems.append(u'lost write of {0}: {1!r}'.format(
+                url, content[:80]))
+    for cur_dir, _, files in os.walk(os.path.join(root, 'stress')):
+        for name in files:
+            url = os.path.relpath(os.path.join(cur_dir, name), root)[:-3]
+            url = url.replace(os.sep, u'/')
+            if name.endswith('.md') and url not in expected and \
+                    not url.startswith(u'stress/shared'):
+                problems.append(u'deleted page exists {0}'.format(url))
+    for index in range(SHARED_PAGES):
+        with open(os.path.join(root, shared_url(index) + '.md'),
+                  encoding='utf-8') as f:
+            match = PAGE_RE.match(f.read())
+        if not match or match.group('marker') not in shared:
+            problems.append(u'corrupt page {0}'.format(shared_url(index)))
+    try:
+        with open(os.path.join(root, 'users.json'), encoding='utf-8') as f:
+            users = json.load(f)
+    except ValueError as e:
+        problems.append(u'corrupt users.json: {0}'.format(e))
+        users = {}
+    except (IOError, OSError):
+        users = {}
+    for result in results:
+        for name, counter in sorted(result['accounts'].items()):
+            if name not in users:
+                problems.append(u'lost user {0}'.format(name))
+            elif users[name].get('counter') != counter:
+                problems.append(u'lost update of user {0}'.format(name))
+    if start is not None:
+        commits = int(_git(root, 'rev-list', '--count', start + '..HEAD'))
+        if commits != sum(result['commits'] for result in results):
+            problems.append(u'{0} commits instead of {1}'.format(
+                commits, sum(result['commits'] for result in results)))
+        status = _git(root, 'status', '--porcelain', '--', 'stress')
+        if status.strip():
+            problems.append(u'uncommitted changes: {0}'.format(
+                status.strip()[:200]))
+        try:
+            _git(root, 'fsck', '--no-progress', '--no-dangling')
+        except subprocess.CalledProcessError:
+            problems.append(u'git fsck failed')
+    return problems
+
+
+def run(spec, processes=4, operations=100, seed=0, root=None):
+    """
+        Runs the stress test.
+
+        :param spec: the :class:`~benchmarks.generator.WikiSpec` of the
+            wiki to start with
+        :param int processes: the number of concurrent processes
+        :param int operations: the number of operations per process
+        :param str root: directory to generate into, a temporary one
+            that is removed afterwards is used by default
+
+        :returns: the JSON serializable report, ``problems`` lists
+            everything lost or corrupted
+        :rtype: dict
+    """
+    cleanup = root is None
+    if cleanup:
+        root = tempfile.mkdtemp(prefix='wiki-stress-')
+    try:
+        start = prepare(root, spec)
+        barrier = multiprocessing.Barrier(processes)
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_work,
+                args=(root, index, operations, seed, barrier, queue))
+            for index in range(processes)]
+        for process in workers:
+            process.start()
+        results = [queue.get() for _ in workers]
+        for process in workers:
+            process.join()
+        errors = [result['error'] for result in results
+                  if 'error' in result]
+        if errors:
+            raise RuntimeError(errors[0])
+        problems = verify(root, results, start)
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+    samples = [sample for result in results
+               for sample in result['samples']]
+    wall = max(result['elapsed'] for result in results)
+    latency = {}
+    waits = {}
+    for operation, seconds, wait in samples:
+        latency.setdefault(operation, []).append(seconds)
+        waits.setdefault(operation, []).append(wait)
+    return {
+        'meta': {
+            'spec': spec.as_dict(),
+            'processes': processes,
+            'operations': operations,
+            'seed': seed,
+        },
+        'throughput': len(samples) / wall if wall else 0.0,
+        'latency': dict((name, summarize(values))
+                        for name, values in latency.items()),
+        'lock_wait': dict((name, summarize(values))
+                          for name, values in waits.items()),
+        'problems': problems,
+    }
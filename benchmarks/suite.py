@@ -0,0 +1,540 @@
+"""
+    Benchmark suite
+    ~~~~~~~~~~~~~~~
+
+    Times the core engine, the git engine and the web layer on top of a
+    generated wiki. Every benchmark is a function that receives a
+    :class:`Context` and performs the measured operation once; the
+    runner takes care of warming up, repeating and summarizing.
+"""
+import datetime
+import gc
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.generator import generate
+from benchmarks.generator import WikiSpec
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: all registered benchmarks as ``(name, function, needs_git)``
+BENCHMARKS = []
+
+PLAIN_TERM = u'latency'
+REGEX_TERM = u'rep[a-z]*ca [a-z]+'
+
+
+def benchmark(name, needs_git=False):
+    """
+        Registers a benchmark function under the given name.
+
+        :param str name: dotted name, the first part is the group.
+        :param bool needs_git: whether the benchmark requires a git
+            backed wiki.
+    """
+    def decorator(f):
+        BENCHMARKS.append((name, f, needs_git))
+        return f
+    return decorator
+
+
+def memory_benchmark(name, needs_git=False):
+    """
+        Registers a benchmark function whose result is measured by the
+        memory it keeps alive instead of its time. The name has to
+        start with ``memory.``.
+    """
+    def decorator(f):
+        f.memory = True
+        return benchmark(name, needs_git)(f)
+    return decorator
+
+
+def simple_url_formatter(endpoint, url):
+    return u'/{0}/'.format(url)
+
+
+def check(response):
+    """
+        Makes sure a web benchmark did not time an error page.
+    """
+    if response.status_code >= 400:
+        raise RuntimeError('{0} {1}'.format(
+            response.status_code, response.data[:200]))
+    return response
+
+
+class Context(object):
+    """
+        Holds the generated wiki and lazily created engines and clients
+        shared by all benchmarks of a run.
+    """
+
+    def __init__(self, root, spec, urls):
+        self.root = root
+        self.spec = spec
+        self.urls = urls
+        self.counter = 0
+        self._wiki = None
+        self._wikigit = None
+        self._app = None
+        self._html = None
+
+    @property
+    def url(self):
+        """A page url that is stable across repetitions."""
+        return self.urls[len(self.urls) // 2]
+
+    @property
+    def selective_term(self):
+        """An expression only matching the few pages linking a page."""
+        return re.escape(u'[[{0}]]'.format(self.urls[-1]))
+
+    def next_url(self):
+        """A different page url on every call."""
+        self.counter += 1
+        return self.urls[self.counter % len(self.urls)]
+
+    @property
+    def wiki(self):
+        if self._wiki is None:
+            from wiki.core import Wiki
+            self._wiki = Wiki(self.root)
+        return self._wiki
+
+    @property
+    def wikigit(self):
+        if self._wikigit is None:
+            from wiki.wikigit import WikiGit
+            self._wikigit = WikiGit(self.root)
+        return self._wikigit
+
+    @property
+    def app(self):
+        if self._app is None:
+            from wiki.web import create_app
+            self._app = create_app(self.root)
+        return self._app
+
+    @property
+    def client(self):
+        return self.app.test_client()
+
+    @property
+    def html(self):
+        """Rendered markdown of a page, before wikilinks are resolved."""
+        if self._html is None:
+            from wiki.core import Processor
+            processor = Processor(self.wiki.load(self.url))
+            processor.process_pre()
+            processor.split_raw()
+            processor.process_markdown()
+            self._html = processor.html
+        return self._html
+
+
+@benchmark('core.index')
+def bench_index(ctx):
+    ctx.wiki.index()
+
+
+@benchmark('core.cold_start')
+def bench_cold_start(ctx):
+    """Builds the indexes like a new process without a snapshot."""
+    from wiki.indexes import WikiIndexes
+    indexes = WikiIndexes(ctx.root)
+    indexes.refresh()
+    indexes.close()
+
+
+@benchmark('core.cold_start_snapshot')
+def bench_cold_start_snapshot(ctx):
+    """Loads the indexes from a snapshot, the warmup writes it."""
+    import os
+    from wiki.indexes import WikiIndexes
+    indexes = WikiIndexes(ctx.root, os.path.join(ctx.root, '.bench-indexes'))
+    indexes.refresh()
+    indexes.close()
+
+
+@benchmark('core.get_tags')
+def bench_get_tags(ctx):
+    ctx.wiki.get_tags()
+
+
+@benchmark('core.search_plain')
+def bench_search_plain(ctx):
+    ctx.wiki.search(PLAIN_TERM)
+
+
+@benchmark('core.search_regex')
+def bench_search_regex(ctx):
+    ctx.wiki.search(REGEX_TERM)
+
+
+@benchmark('core.search_selective')
+def bench_search_selective(ctx):
+    ctx.wiki.search(ctx.selective_term)
+
+
+@benchmark('core.complete')
+def bench_complete(ctx):
+    ctx.wiki.complete(ctx.next_url()[:4])
+
+
+@benchmark('core.related')
+def bench_related(ctx):
+    ctx.wiki.related(ctx.next_url())
+
+
+@benchmark('core.page_load')
+def bench_page_load(ctx):
+    ctx.wiki.load(ctx.next_url())
+
+
+@benchmark('core.page_render')
+def bench_page_render(ctx):
+    from wiki.core import Page
+    Page(ctx.wiki, ctx.next_url())
+
+
+@benchmark('core.save')
+def bench_save(ctx):
+    # writes the page back unchanged, git backed trees stay clean
+    from wiki.core import split_meta
+    url = ctx.next_url()
+    meta, body = split_meta(ctx.wiki.load(url))
+    ctx.wiki.save(url, body, meta)
+
+
+def renderer_benchmark(name):
+    """
+        Registers ``core.render_<name>``, which renders a page with the
+        given markdown renderer, if it is installed.
+    """
+    from wiki.renderers import RENDERERS
+    if not RENDERERS[name].available():
+        return
+
+    @benchmark('core.render_' + name)
+    def bench_render(ctx):
+        from wiki.core import Processor
+        Processor(ctx.wiki.load(ctx.next_url()), renderer=name).process()
+
+
+for _name in ('markdown', 'commonmark'):
+    renderer_benchmark(_name)
+
+
+@benchmark('core.wikilink')
+def bench_wikilink(ctx):
+    from wiki.core import wikilink
+    wikilink(ctx.html, simple_url_formatter)
+
+
+@memory_benchmark('memory.index_pages')
+def bench_memory_index_pages(ctx):
+    """The listing as the rendered pages it was built from before."""
+    from wiki.core import Page
+    ctx.wiki.renders.clear()
+    return [Page(ctx.wiki, url) for url in ctx.urls]
+
+
+@memory_benchmark('memory.index_entries')
+def bench_memory_index_entries(ctx):
+    """The listing as the entries the indexes keep for it."""
+    import os
+    from wiki.core import split_meta
+    from wiki.core import title_key
+    from wiki.indexes import IndexEntry
+    from wiki.watcher import stat_key
+    entries = []
+    for url in ctx.urls:
+        meta = split_meta(ctx.wiki.load(url))[0]
+        key = stat_key(os.stat(ctx.wiki.path(url)))
+        entries.append(IndexEntry.create(url, meta, key))
+    return sorted(entries, key=title_key)
+
+
+@benchmark('git.search_plain', needs_git=True)
+def bench_git_search_plain(ctx):
+    ctx.wikigit.search(PLAIN_TERM)
+
+
+@benchmark('git.search_regex', needs_git=True)
+def bench_git_search_regex(ctx):
+    ctx.wikigit.search(REGEX_TERM)
+
+
+@benchmark('git.search_selective', needs_git=True)
+def bench_git_search_selective(ctx):
+    ctx.wikigit.search(ctx.selective_term)
+
+
+@benchmark('git.save', needs_git=True)
+def bench_git_save(ctx):
+    from wiki.core import Page
+    page = Page(ctx.wikigit, ctx.next_url())
+    page.body += u'\nBenchmark edit {0}.\n'.format(ctx.counter)
+    page.save(ctx.wikigit, update=False, author=u'benchmark')
+
+
+@benchmark('git.save_batch', needs_git=True)
+def bench_git_save_batch(ctx):
+    # ten pages in a single commit, compare with ten times git.save
+    from wiki.core import split_meta
+    pages = []
+    loaded = ctx.wikigit.load_many([ctx.next_url() for _ in range(10)])
+    for url, (content, token) in loaded.items():
+        meta, body = split_meta(content)
+        body += u'\nBenchmark edit {0}.\n'.format(ctx.counter)
+        pages.append((url, body, meta, token))
+    ctx.wikigit.save_many(pages, author=u'benchmark')
+
+
+@benchmark('git.history', needs_git=True)
+def bench_git_history(ctx):
+    ctx.wikigit.history(ctx.next_url())
+
+
+@benchmark('git.show', needs_git=True)
+def bench_git_show(ctx):
+    commit = ctx.wikigit.history(ctx.url, limit=1)[0]
+    ctx.wikigit.show(commit.commit)
+
+
+@benchmark('git.changes', needs_git=True)
+def bench_git_changes(ctx):
+    # uncached, the web benchmark measures the cached case
+    from wiki.history import CACHE
+    CACHE.clear()
+    ctx.wikigit.changes()
+
+
+@benchmark('git.blame', needs_git=True)
+def bench_git_blame(ctx):
+    ctx.wikigit.blame(ctx.next_url())
+
+
+@benchmark('web.home')
+def bench_web_home(ctx):
+    check(ctx.client.get('/'))
+
+
+@benchmark('web.index')
+def bench_web_index(ctx):
+    check(ctx.client.get('/index/'))
+
+
+@benchmark('web.index_namespace')
+def bench_web_index_namespace(ctx):
+    prefix = ctx.url.rsplit(u'/', 1)[0] if u'/' in ctx.url else u''
+    check(ctx.client.get(u'/index/{0}/'.format(prefix) if prefix
+                         else u'/index/'))
+
+
+@benchmark('web.tags')
+def bench_web_tags(ctx):
+    check(ctx.client.get('/tags/'))
+
+
+@benchmark('web.display')
+def bench_web_display(ctx):
+    check(ctx.client.get('/{0}/'.format(ctx.next_url())))
+
+
+@benchmark('web.search')
+def bench_web_search(ctx):
+    check(ctx.client.post('/search/', data={'term': PLAIN_TERM}))
+
+
+@benchmark('web.complete')
+def bench_web_complete(ctx):
+    check(ctx.client.get('/api/complete', query_string={
+        'q': ctx.next_url()[:4]}))
+
+
+@benchmark('web.api_pages')
+def bench_web_api_pages(ctx):
+    urls = u','.join(ctx.next_url() for _ in range(20))
+    check(ctx.client.get('/api/pages', query_string={'urls': urls}))
+
+
+@benchmark('web.preview')
+def bench_web_preview(ctx):
+    body = ctx.wiki.load(ctx.url)
+    check(ctx.client.post('/preview/', data={'body': body}))
+
+
+@benchmark('web.preview_typing')
+def bench_web_preview_typing(ctx):
+    # one changed block per request, like typing at the end of a page
+    ctx.counter += 1
+    body = ctx.wiki.load(ctx.url).rstrip() + u' x' * ctx.counter
+    check(ctx.client.post('/preview/', data={'body': body}))
+
+
+@benchmark('web.history', needs_git=True)
+def bench_web_history(ctx):
+    check(ctx.client.get('/history/{0}/'.format(ctx.url)))
+
+
+@benchmark('web.changes', needs_git=True)
+def bench_web_changes(ctx):
+    check(ctx.client.get('/changes/'))
+
+
+@benchmark('web.blame', needs_git=True)
+def bench_web_blame(ctx):
+    check(ctx.client.get('/blame/{0}/'.format(ctx.url)))
+
+
+@benchmark('web.feed', needs_git=True)
+def bench_web_feed(ctx):
+    check(ctx.client.get('/feed.atom'))
+
+
+@benchmark('web.feed_not_modified', needs_git=True)
+def bench_web_feed_not_modified(ctx):
+    # a feed reader polling without any new commit
+    if not hasattr(ctx, 'feed_etag'):
+        ctx.feed_etag = ctx.client.get('/feed.atom').headers['ETag']
+    etag = ctx.feed_etag
+    response = ctx.client.get('/feed.atom', headers={'If-None-Match': etag})
+    if response.status_code != 304:
+        raise RuntimeError(response.status_code)
+
+
+def measure(f, ctx, repeat, warmup=1):
+    """
+        Runs ``f(ctx)`` ``warmup`` times without and ``repeat`` times
+        with timing.
+
+        :returns: summary statistics in seconds
+        :rtype: dict
+    """
+    for _ in range(warmup):
+        f(ctx)
+    timings = []
+    for _ in range(repeat):
+        start = clock()
+        f(ctx)
+        timings.append(clock() - start)
+    timings.sort()
+    return {
+        'runs': repeat,
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': sum(timings) / len(timings),
+        'median': timings[len(timings) // 2],
+    }
+
+
+def measure_memory(f, ctx, warmup=1):
+    """
+        Runs ``f(ctx)`` ``warmup`` times, so caches it fills are not
+        counted, and once more while tracing allocations.
+
+        :returns: the bytes still allocated while the result of the
+            last call is alive
+        :rtype: dict
+    """
+    for _ in range(warmup):
+        f(ctx)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = f(ctx)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'runs': 1, 'unit': 'bytes', 'min': size, 'max': size,
+            'mean': size, 'median': size}
+
+
+def run(spec, repeat=5, select=None, root=None, progress=None,
+        maintain=False):
+    """
+        Generates a wiki for ``spec`` and runs the benchmarks on it.
+
+        :param WikiSpec spec: the wiki to generate.
+        :param int repeat: timed repetitions per benchmark.
+        :param str select: only run benchmarks whose name starts with
+            one of these comma separated prefixes.
+        :param str root: directory to generate into, a temporary one
+            that is removed afterwards is used by default.
+        :param function progress: called with each benchmark name.
+        :param bool maintain: run the repository maintenance (see
+            :mod:`wiki.maintenance`) on the generated git repository
+            before the benchmarks, to compare against a run without.
+
+        :returns: the JSON serializable results
+        :rtype: dict
+    """
+    prefixes = tuple(select.split(',')) if select else ('',)
+    cleanup = root is None
+    if cleanup:
+        root = tempfile.mkdtemp(prefix='wiki-bench-')
+    started = datetime.datetime.utcnow()
+    try:
+        ctx = Context(root, spec, generate(root, spec))
+        maintenance = None
+        if maintain and spec.git:
+            from wiki.maintenance import Maintenance
+            report = Maintenance(root).run(force=True)
+            maintenance = dict((step.name, step.seconds)
+                               for step in report.steps)
+        results = {}
+        with ctx.app.test_request_context('/'):
+            for name, f, needs_git in BENCHMARKS:
+                if needs_git and not spec.git:
+                    continue
+                if not name.startswith(prefixes):
+                    continue
+                if progress:
+                    progress(name)
+                if getattr(f, 'memory', False):
+                    results[name] = measure_memory(f, ctx)
+                else:
+                    results[name] = measure(f, ctx, repeat)
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        'meta': {
+            'started': started.isoformat() + 'Z',
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'spec': spec.as_dict(),
+            'repeat': repeat,
+            'maintenance': maintenance,
+        },
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """
+        Compares the medians of two result sets.
+
+        :returns: ``(name, old median, new median, ratio)`` tuples for
+            all benchmarks present in both runs, ratios above one mean
+            the new run is slower.
+        :rtype: list
+    """
+    rows = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before = old['results'][name]['median']
+        after = new['results'][name]['median']
+        rows.append((name, before, after, after / before if before else 0))
+    return rows
+
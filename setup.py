@@ -11,6 +11,7 @@ setup(
     package_data={
         'wiki': [
             'wiki/web/templates/*.html',
+            'wiki/web/templates/*.xml',
             'wiki/web/static/*.js',
             'wiki/web/static/*.css'
         ],
@@ -26,6 +27,10 @@ setup(
         'Werkzeug>=0.8.3',
         'fasteners>=0.14'
     ],
+    extras_require={
+        'commonmark': ['markdown-it-py'],
+        'related': ['numpy'],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest', 'mock'],
     entry_points={
@@ -6,6 +6,7 @@ from tempfile import mkstemp
 from unittest import TestCase
 
 from wiki.core import Wiki
+from wiki.indexes import close_indexes
 from wiki.web import create_app
 
 #: the default configuration
@@ -75,5 +76,6 @@ class WikiBaseTestCase(TestCase):
             Will remove the root directory and all contents if one
             exists.
         """
+        close_indexes(self.rootdir)
         if self.rootdir and os.path.exists(self.rootdir):
             shutil.rmtree(self.rootdir)
@@ -0,0 +1,141 @@
+import json
+import shutil
+import subprocess
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from benchmarks import stress
+from benchmarks import suite
+from benchmarks.generator import generate
+from benchmarks.generator import WikiSpec
+from wiki.core import Wiki
+
+
+class GeneratorTestCase(TestCase):
+    """
+        Contains various tests for the synthetic wiki generator.
+    """
+
+    def setUp(self):
+        self.rootdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+
+    def test_generate_pages(self):
+        """
+            Assert the requested number of pages is generated and can
+            be read by the wiki.
+        """
+        urls = generate(self.rootdir, WikiSpec(pages=12, namespaces=3))
+        assert len(urls) == 12
+        wiki = Wiki(self.rootdir)
+        assert all(wiki.exists(url) for url in urls)
+        content = wiki.load(urls[0])
+        assert content.startswith(u'title: Page 0')
+        assert u'[[' in content
+        assert u'```' in content
+
+    def test_generate_reproducible(self):
+        """
+            Assert the same seed generates the same content.
+        """
+        other = mkdtemp()
+        try:
+            spec = WikiSpec(pages=5, seed=42)
+            urls = generate(self.rootdir, spec)
+            generate(other, spec)
+            for url in urls:
+                assert (Wiki(self.rootdir).load(url) ==
+                        Wiki(other).load(url))
+        finally:
+            shutil.rmtree(other)
+
+    def test_generate_history(self):
+        """
+            Assert the git history has the requested depth.
+        """
+        generate(self.rootdir, WikiSpec(pages=3, history=4, git=True))
+        count = subprocess.check_output(
+            ['git', 'rev-list', '--count', 'HEAD'], cwd=self.rootdir)
+        assert int(count) == 5
+
+
+class SuiteTestCase(TestCase):
+    """
+        Contains various tests for the benchmark runner.
+    """
+
+    def test_run(self):
+        """
+            Assert selected benchmarks run and produce JSON results.
+        """
+        results = suite.run(WikiSpec(pages=5), repeat=1,
+                            select='core.page,web.display')
+        assert sorted(results['results']) == [
+            'core.page_load', 'core.page_render', 'web.display']
+        assert results['meta']['spec']['pages'] == 5
+        json.dumps(results)
+
+    def test_compare(self):
+        """
+            Assert comparing two runs reports the median ratio.
+        """
+        old = {'results': {'a': {'median': 2.0}, 'b': {'median': 1.0}}}
+        new = {'results': {'a': {'median': 1.0}}}
+        assert suite.compare(old, new) == [('a', 2.0, 1.0, 0.5)]
+
+    def test_memory(self):
+        """
+            Assert memory benchmarks report the bytes their result
+            keeps alive.
+        """
+        results = suite.run(WikiSpec(pages=5), repeat=1, select='memory.')
+        pages = results['results']['memory.index_pages']
+        entries = results['results']['memory.index_entries']
+        assert pages['unit'] == 'bytes'
+        assert 0 < entries['median'] < pages['median']
+
+    def test_maintenance(self):
+        """
+            Assert the repository can be maintained before the
+            benchmarks and the steps are reported.
+        """
+        results = suite.run(WikiSpec(pages=5, git=True), repeat=1,
+                            select='git.history', maintain=True)
+        assert 'commit-graph' in results['meta']['maintenance']
+        assert 'git.history' in results['results']
+
+
+class StressTestCase(TestCase):
+    """
+        Contains tests for the concurrent write stress test.
+    """
+
+    def test_stress(self):
+        """
+            Assert concurrent writes to a git backed wiki are all kept
+            and the report covers every operation.
+        """
+        report = stress.run(WikiSpec(pages=5, git=True), processes=2,
+                            operations=20)
+        assert report['problems'] == []
+        assert report['throughput'] > 0
+        assert set(report['latency']) <= set(
+            name for name, _ in stress.OPERATIONS)
+        assert sum(s['count'] for s in report['latency'].values()) == 40
+        json.dumps(report)
+
+    def test_verify(self):
+        """
+            Assert lost writes are found.
+        """
+        root = mkdtemp()
+        try:
+            stress.prepare(root, WikiSpec(pages=1))
+            result = {'pages': {u'stress/w0/p1': u'w0-1'}, 'accounts': {},
+                      'shared': [], 'problems': [], 'commits': 0}
+            assert stress.verify(root, [result], None) == [
+                u'missing page stress/w0/p1']
+        finally:
+            shutil.rmtree(root)
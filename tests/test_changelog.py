@@ -0,0 +1,68 @@
+import os
+
+from wiki.changelog import ChangeLog
+from wiki.changelog import REMOVED
+from wiki.changelog import SAVED
+from wiki.indexes import WikiIndexes
+
+from . import WikiBaseTestCase
+
+
+class ChangeLogTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for the :class:`ChangeLog`.
+    """
+
+    def setUp(self):
+        super(ChangeLogTestCase, self).setUp()
+        self.path = os.path.join(self.rootdir, '.wiki', 'changes')
+
+    def test_records(self):
+        """
+            Assert records are read once, in order, by every reader.
+        """
+        writer = ChangeLog(self.path)
+        reader = ChangeLog(self.path)
+        assert reader.read() == []
+        assert writer.append(SAVED, ['a', 'b']) == 2
+        assert writer.append(REMOVED, ['a']) == 3
+        assert reader.read() == [(1, SAVED, 'a'), (2, SAVED, 'b'),
+                                 (3, REMOVED, 'a')]
+        assert reader.read() == []
+        # new readers start at the end
+        late = ChangeLog(self.path)
+        assert late.generation == 3
+        assert late.read() == []
+
+    def test_start_over(self):
+        """
+            Assert readers are told to check everything when the log
+            was started over, and generations keep increasing.
+        """
+        writer = ChangeLog(self.path, max_size=10)
+        reader = ChangeLog(self.path)
+        writer.append(SAVED, ['a'])
+        assert reader.read() == [(1, SAVED, 'a')]
+        assert writer.append(SAVED, ['b']) == 2
+        assert reader.read() is None
+        assert reader.generation == 2
+        assert reader.read() == []
+
+    def test_indexes(self):
+        """
+            Assert writes of one process show up in the indexes of
+            another one without waiting for its watcher.
+        """
+        this = WikiIndexes(self.rootdir, changes=self.path)
+        other = WikiIndexes(self.rootdir, changes=self.path)
+        self.addCleanup(this.close)
+        self.addCleanup(other.close)
+        self.create_file('a.md', u'title: Alpha\n\nx\n')
+        other.refresh()
+        assert other.complete(u'bet') == []
+        self.create_file('b.md', u'title: Beta\n\nx\n')
+        this.page_saved('b')
+        assert other.complete(u'bet') == [('b', u'Beta', 'prefix')]
+        os.remove(os.path.join(self.rootdir, 'a.md'))
+        this.page_removed('a')
+        assert other.complete(u'alp') == []
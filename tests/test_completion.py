@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from wiki.completion import Completer
+
+
+class CompleterTestCase(TestCase):
+    """
+        Contains various tests for the :class:`Completer`.
+    """
+
+    def setUp(self):
+        self.completer = Completer()
+        self.completer.add('ops/deploy', u'Deploy Howto')
+        self.completer.add('ops/backup', u'Backup')
+        self.completer.add('home', u'Welcome')
+        self.completer.add('design', u'Design Notes')
+
+    def urls(self, query, limit=10):
+        return [url for url, _, _ in self.completer.complete(query, limit)]
+
+    def test_prefix(self):
+        """
+            Assert titles, urls and the last url segment are completed.
+        """
+        assert self.urls(u'De') == ['ops/deploy', 'design']
+        assert self.urls(u'wel') == ['home']
+        assert self.urls(u'ops/') == ['ops/backup', 'ops/deploy']
+        assert self.urls(u'back') == ['ops/backup']
+
+    def test_subsequence(self):
+        """
+            Assert subsequence matches follow the prefix matches.
+        """
+        results = self.completer.complete(u'dplhw')
+        assert results == [('ops/deploy', u'Deploy Howto', 'subsequence')]
+        assert self.urls(u'dsn') == ['design']
+        assert self.urls(u'xyz') == []
+
+    def test_limit(self):
+        """
+            Assert the number of results is limited.
+        """
+        assert len(self.urls(u'o', limit=1)) == 1
+
+    def test_update(self):
+        """
+            Assert renamed and removed pages are updated.
+        """
+        self.completer.add('home', u'Start')
+        assert self.urls(u'wel') == []
+        assert self.urls(u'sta') == ['home']
+        self.completer.remove('ops/deploy')
+        assert self.urls(u'dep') == []
+        assert self.urls(u'dplhw') == []
+        assert len(self.completer) == 3
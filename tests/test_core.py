@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
 from io import open
+from mock import Mock
 from mock import patch
 import os
+import re
+import threading
 from unittest import TestCase
 
+from wiki.core import ANY
 from wiki.core import clean_url
+from wiki.core import ConflictError
+from wiki.core import MAX_INCLUDE_SIZE
+from wiki.core import MAX_INCLUDES
 from wiki.core import wikilink
 from wiki.core import Page
 from wiki.core import Processor
+from wiki.core import Snippet
+from wiki.core import split_blocks
+from wiki.core import split_meta
+from wiki.indexes import close_indexes
+from wiki.named_locks import StripedLock
+from wiki.scanner import read_text
+from wiki.scanner import Scanner
 
 from . import WikiBaseTestCase
 
@@ -37,6 +51,34 @@ WIKILINK_CONTENT_HTML = u"""\
 <p><a href='/target'>target</a></p>"""
 
 
+BLOCKS_PAGE_CONTENT = u"""\
+title: Blocks
+tags: one
+
+# Header
+
+* loose
+
+* list
+    continued
+
+```python
+x = 1
+
+
+y = 2
+```
+
+> a
+
+> quote
+
+    code
+
+Note: not metadata [[target]]
+"""
+
+
 def simple_url_formatter(endpoint, url):
     """
         A simple URL formatter to use when no application context
@@ -136,6 +178,52 @@ class WikilinkTestCase(TestCase):
         )
 
 
+class SplitMetaTestCase(TestCase):
+    """
+        Contains various tests for the markdown free meta parser.
+    """
+
+    def test_split_meta(self):
+        """
+            Assert the meta data equals the one of the processor.
+        """
+        meta, body = split_meta(PAGE_CONTENT)
+        assert meta == Processor(PAGE_CONTENT).process()[2]
+        assert body == PAGE_CONTENT.split(u'\n\n', 1)[1]
+
+    def test_multiline_value(self):
+        """
+            Assert indented lines continue the previous value.
+        """
+        meta, body = split_meta(u'Title: one\n    two\ntags: x\n\nbody')
+        assert meta == {'title': u'one\ntwo', 'tags': u'x'}
+        assert body == u'body'
+
+
+class SnippetTestCase(TestCase):
+    """
+        Contains various tests for search result snippets.
+    """
+
+    def test_highlight(self):
+        """
+            Assert matches are highlighted and the text is escaped.
+        """
+        snippet = Snippet(3, u'  <b>foo</b> and foo ', re.compile('foo'))
+        assert snippet.__html__() == (
+            u'&lt;b&gt;<mark>foo</mark>&lt;/b&gt; and <mark>foo</mark>')
+
+    def test_cut_long_line(self):
+        """
+            Assert long lines are cut around the first match.
+        """
+        snippet = Snippet(1, u'x' * 500 + u'needle' + u'y' * 500,
+                          re.compile('needle'))
+        assert len(snippet.text) == Snippet.width
+        start, end = snippet.spans[0]
+        assert snippet.text[start:end] == u'needle'
+
+
 class ProcessorTestCase(WikiBaseTestCase):
     """
         Contains various tests for the :class:`~wiki.core.Processors`
@@ -169,6 +257,34 @@ class ProcessorTestCase(WikiBaseTestCase):
         html, _, _ = self.processor.process()
         assert html == WIKILINK_CONTENT_HTML
 
+    def test_split_blocks(self):
+        """
+            Assert blocks are split at blank lines between independent
+            blocks only.
+        """
+        body = BLOCKS_PAGE_CONTENT.split(u'\n\n', 1)[1]
+        assert [block.split(u'\n')[0] for block in split_blocks(body)] == [
+            u'# Header', u'* loose', u'```python', u'> a', u'Note: not '
+            u'metadata [[target]]']
+        assert split_blocks(u'a\n\n<div>\n\nb\n\n</div>') is None
+        assert split_blocks(u'[a][1]\n\n[1]: http://example.com') is None
+
+    def test_process_blocks(self):
+        """
+            Assert rendering blocks separately gives the same result and
+            unchanged blocks are reused.
+        """
+        full = SimpleWikilinkProcessor(BLOCKS_PAGE_CONTENT).process()
+        cache = {}
+        processor = SimpleWikilinkProcessor(BLOCKS_PAGE_CONTENT)
+        assert processor.process_blocks(cache) == full
+        assert len(cache) == 5
+        changed = BLOCKS_PAGE_CONTENT.replace(u'# Header', u'# Changed')
+        processor = SimpleWikilinkProcessor(changed)
+        html, _, _ = processor.process_blocks(cache)
+        assert html == SimpleWikilinkProcessor(changed).process()[0]
+        assert len(cache) == 6
+
 
 class PageTestCase(WikiBaseTestCase):
     """
@@ -263,3 +379,337 @@ class WikiTestCase(WikiBaseTestCase):
 
         testpage = pages[1]
         assert testpage.url == 'test'
+
+    def test_search(self):
+        """
+            Assert search works on the raw content and reports the
+            matching lines.
+        """
+        self.create_file('test.md', PAGE_CONTENT)
+        self.create_file('one/two/three.md', WIKILINK_PAGE_CONTENT)
+        results = self.wiki.search(u'MAGNIFICENT')
+        assert [r.url for r in results] == ['test']
+        assert results[0].title == u'Test'
+        assert results[0].count == 1
+        assert results[0].snippets[0].lineno == 6
+        assert self.wiki.search(u'magnificent', ignore_case=False) != []
+        assert self.wiki.search(u'MAGNIFICENT', ignore_case=False) == []
+
+    def test_search_meta(self):
+        """
+            Assert titles and tags are searched but not the meta keys.
+        """
+        self.create_file('test.md', PAGE_CONTENT)
+        assert [r.url for r in self.wiki.search(u'jö')] == ['test']
+        assert self.wiki.search(u'tags') == []
+        assert self.wiki.search(u'jö', attrs=['title', 'body']) == []
+
+    def test_search_limit(self):
+        """
+            Assert the number of results can be limited.
+        """
+        for i in range(5):
+            self.create_file('page%d.md' % i, PAGE_CONTENT)
+        assert len(self.wiki.search(u'hello')) == 5
+        assert len(self.wiki.search(u'hello', limit=2)) == 2
+
+    def test_search_candidates(self):
+        """
+            Assert searches given their candidates do not need the
+            indexes.
+        """
+        for i in range(3):
+            self.create_file('page%d.md' % i, PAGE_CONTENT)
+        assert self.wiki.candidates(u'magnificent') == [
+            'page0', 'page1', 'page2']
+        close_indexes(self.rootdir)
+        results = self.wiki.search(u'magnificent', candidates=['page1'])
+        assert [r.url for r in results] == ['page1']
+        assert len(self.wiki.search(u'magnificent', candidates=None)) == 3
+        assert not self.wiki.indexes.built
+
+    def test_save_atomic(self):
+        """
+            Assert saving replaces the page without leaving temporary
+            files and with the permissions ``open`` would have used.
+        """
+        umask = os.umask(0o022)
+        try:
+            self.wiki.save('one/page', u'first\r\n', {'title': u'One'})
+            self.wiki.save('one/page', u'second\n', {'title': u'Two'})
+        finally:
+            os.umask(umask)
+        path = os.path.join(self.rootdir, 'one', 'page.md')
+        assert os.listdir(os.path.dirname(path)) == ['page.md']
+        with open(path, encoding='utf-8') as f:
+            assert f.read() == u'title: Two\n\nsecond\n'
+        assert os.stat(path).st_mode & 0o777 == 0o644
+
+    def test_move_and_delete_locked(self):
+        """
+            Assert moving and deleting wait for a writer of the page.
+        """
+        self.create_file('test.md', PAGE_CONTENT)
+        done = threading.Event()
+
+        def delete():
+            self.wiki.delete('test')
+            done.set()
+
+        with self.wiki.page_lock('test'):
+            thread = threading.Thread(target=delete)
+            thread.start()
+            assert not done.wait(0.2)
+            assert self.wiki.exists('test')
+        thread.join()
+        assert not self.wiki.exists('test')
+        assert self.wiki.delete('test') is False
+
+    def test_save_many_locked(self):
+        """
+            Assert tokens are checked under the lock of the pages, so a
+            concurrent batch either waits or conflicts.
+        """
+        self.create_file('a.md', PAGE_CONTENT)
+        token = self.wiki.tokens(['a'])['a']
+        done = threading.Event()
+        errors = []
+
+        def save():
+            try:
+                self.wiki.save_many([('a', u'mine\n', {}, token)])
+            except ConflictError as e:
+                errors.append(e)
+            done.set()
+
+        with self.wiki.page_lock('a'):
+            thread = threading.Thread(target=save)
+            thread.start()
+            assert not done.wait(0.2)
+            self.wiki._write('a', u'theirs\n', {})
+        thread.join()
+        assert errors and list(errors[0].conflicts) == ['a']
+        assert self.wiki.load('a') == u'\ntheirs\n'
+
+    def test_save_many_restores(self):
+        """
+            Assert pages written before a failing write are restored.
+        """
+        self.create_file('a.md', PAGE_CONTENT)
+        os.makedirs(os.path.join(self.rootdir, 'c.md'))
+        with self.assertRaises(OSError):
+            self.wiki.save_many([('a', u'new\n', {}, ANY),
+                                 ('b', u'new\n', {}, None),
+                                 ('c', u'new\n', {}, ANY)])
+        assert self.wiki.load('a') == PAGE_CONTENT
+        assert not self.wiki.exists('b')
+
+
+class TranscludeTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for ``{{include:url}}``.
+    """
+
+    def body(self, url):
+        return self.wiki.get(url).html
+
+    def test_include(self):
+        """
+            Assert included pages are expanded without their metadata,
+            also when they include pages themselves.
+        """
+        self.create_file('a.md', u'title: A\n\nbefore\n\n'
+                         u'{{include: Shared/B }}\n\nafter\n')
+        self.create_file('shared/b.md', u'title: B\n\n*b* {{include:c}}\n')
+        self.create_file('c.md', u'title: C\n\nc\n')
+        assert self.body('a') == (u'<p>before</p>\n<p><em>b</em> c</p>\n'
+                                  u'<p>after</p>')
+
+    def test_body_not_expanded(self):
+        """
+            Assert the body of a page, which is edited and saved, keeps
+            the include.
+        """
+        self.create_file('a.md', u'title: A\n\n{{include:b}}\n')
+        self.create_file('b.md', u'title: B\n\nb\n')
+        page = self.wiki.get('a')
+        assert page.body == u'{{include:b}}\n'
+        assert page.title == u'A'
+
+    def test_loop(self):
+        """
+            Assert pages including each other are expanded once.
+        """
+        self.create_file('a.md', u'title: A\n\na {{include:b}}\n')
+        self.create_file('b.md', u'title: B\n\nb {{include:a}}\n')
+        assert self.body('a') == u'<p>a b <em>Include loop: a</em></p>'
+
+    def test_limits(self):
+        """
+            Assert pages including pages many times over are cut off
+            instead of growing exponentially.
+        """
+        for level in range(6):
+            self.create_file('p{0}.md'.format(level), u'title: P\n\nx' + (
+                u' {{include:p%d}}' % (level + 1) * 10 if level < 5
+                else u''))
+        html = self.body('p0')
+        assert html.count(u'Too many includes: p') > 0
+        assert html.count(u'x') <= MAX_INCLUDES + 1
+        big = u'y' * (MAX_INCLUDE_SIZE // 2 + 1)
+        self.create_file('big.md', u'title: Big\n\n' + big)
+        self.create_file('twice.md', u'title: Twice\n\n'
+                         u'{{include:big}}\n\n{{include:big}}\n')
+        assert u'Included pages too large: big' in self.body('twice')
+
+    def test_missing_and_invalid(self):
+        """
+            Assert missing pages and urls leaving the content directory
+            are not included.
+        """
+        self.create_file('a.md', u'title: A\n\n{{include:nope}}\n\n'
+                         u'{{include:../config}}\n')
+        html = self.body('a')
+        assert u'Included page not found: nope' in html
+        assert u'Invalid include: ../config' in html
+
+    def test_fenced_code(self):
+        """
+            Assert includes in fenced code and the metadata are left
+            alone.
+        """
+        self.create_file('a.md', u'title: {{include:b}}\n\n'
+                         u'```\n{{include:b}}\n```\n')
+        self.create_file('b.md', u'title: B\n\nb\n')
+        page = self.wiki.get('a')
+        assert page.title == u'{{include:b}}'
+        # highlighted, but not expanded
+        assert u'include' in page.html
+        assert u'<p>b</p>' not in page.html
+
+    def test_without_context(self):
+        """
+            Assert processors used outside a page rendering leave
+            includes alone.
+        """
+        html = Processor(u'title: A\n\n{{include:b}}\n').process()[0]
+        assert html == u'<p>{{include:b}}</p>'
+
+
+class StripedLockTestCase(WikiBaseTestCase):
+    """
+        Contains tests for :class:`~wiki.named_locks.StripedLock`.
+    """
+
+    def setUp(self):
+        super(StripedLockTestCase, self).setUp()
+        self.lock = StripedLock(os.path.join(self.rootdir, 'locks'), 4)
+
+    def keys(self):
+        """
+            :returns: two keys in the same and one in another stripe
+        """
+        keys = {}
+        for i in range(100):
+            keys.setdefault(self.lock.index(u'page%d' % i), []).append(
+                u'page%d' % i)
+        same = next(k for k in keys.values() if len(k) > 1)
+        other = next(k[0] for i, k in keys.items()
+                     if i != self.lock.index(same[0]))
+        return same[0], same[1], other
+
+    def acquire(self, *keys):
+        done = threading.Event()
+
+        def target():
+            with self.lock(*keys):
+                done.set()
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread, done
+
+    def test_same_stripe_excludes(self):
+        """
+            Assert keys of the same stripe are locked one at a time.
+        """
+        first, second, _ = self.keys()
+        with self.lock(first):
+            thread, done = self.acquire(second)
+            assert not done.wait(0.2)
+        thread.join()
+        assert done.is_set()
+
+    def test_other_stripe_parallel(self):
+        """
+            Assert keys of other stripes do not wait, and a key can be
+            given twice.
+        """
+        first, second, other = self.keys()
+        with self.lock(first, second):
+            thread, done = self.acquire(other, other)
+            assert done.wait(5)
+        thread.join()
+        assert len(os.listdir(os.path.join(self.rootdir, 'locks'))) == 2
+
+
+class ScannerTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for the :class:`~wiki.scanner.Scanner`.
+    """
+
+    def setUp(self):
+        super(ScannerTestCase, self).setUp()
+        self.urls = []
+        for i in range(20):
+            self.create_file('ns/page%02d.md' % i, PAGE_CONTENT)
+            self.urls.append('ns/page%02d' % i)
+        self.create_file('other.md', WIKILINK_PAGE_CONTENT)
+        self.urls.append('other')
+
+    def test_parallel_scan(self):
+        """
+            Assert chunks scanned by several threads are combined.
+        """
+        scanner = Scanner(self.rootdir, workers=4, chunk_size=3)
+        results = scanner.scan(self.urls, re.compile(u'magnificent'))
+        assert sorted(r.url for r in results) == self.urls[:-1]
+
+    def test_early_stop(self):
+        """
+            Assert the scan stops at the limit.
+        """
+        scanner = Scanner(self.rootdir, workers=4, chunk_size=2)
+        results = scanner.scan(self.urls, re.compile(u'Hello'), limit=5)
+        assert len(results) == 5
+
+    def test_process_pool(self):
+        """
+            Assert scanning works with a process pool.
+        """
+        scanner = Scanner(self.rootdir, workers=2, processes=True,
+                          chunk_size=8)
+        results = scanner.scan(self.urls, re.compile(u'target'))
+        assert [r.url for r in results] == ['other']
+
+    def test_process_pool_in_daemon(self):
+        """
+            Assert daemonic processes scan with threads instead.
+        """
+        scanner = Scanner(self.rootdir, workers=2, processes=True,
+                          chunk_size=8)
+        process = Mock(daemon=True)
+        with patch('wiki.scanner.multiprocessing.current_process',
+                   return_value=process), \
+                patch('wiki.scanner.ProcessPoolExecutor') as executor:
+            results = scanner.scan(self.urls, re.compile(u'target'))
+        assert not executor.called
+        assert [r.url for r in results] == ['other']
+
+    def test_read_mmap(self):
+        """
+            Assert big files are read through a memory map.
+        """
+        content = u'title: big\n\n' + u'jö ' * 500000
+        path = self.create_file('big.md', content)
+        assert read_text(path) == content
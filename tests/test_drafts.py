@@ -0,0 +1,199 @@
+import json
+import os
+import time
+
+from wiki.drafts import DraftStore
+from wiki.drafts import DraftTooLarge
+
+from . import WikiBaseTestCase
+from .test_wikigit import WikiGitBaseTestCase
+
+
+class DraftStoreTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for the :class:`DraftStore`.
+    """
+
+    def store(self, **kwargs):
+        store = DraftStore(os.path.join(self.rootdir, 'drafts'), **kwargs)
+        self.addCleanup(store.flush)
+        return store
+
+    def test_put_and_get(self):
+        """
+            Assert drafts are kept per user and page until discarded.
+        """
+        store = self.store()
+        store.put(u'user:1', u'a', {'body': u'one'})
+        store.put(u'user:2', u'a', {'body': u'two'})
+        assert store.get(u'user:1', u'a')['body'] == u'one'
+        assert store.get(u'user:2', u'a')['body'] == u'two'
+        assert store.get(u'user:1', u'b') is None
+        store.discard(u'user:1', u'a')
+        assert store.get(u'user:1', u'a') is None
+        assert store.get(u'user:2', u'a')['url'] == u'a'
+
+    def test_interval(self):
+        """
+            Assert a draft is written at most every ``interval``
+            seconds, the latest version wins.
+        """
+        store = self.store(interval=0.2)
+        store.put(u'user:1', u'a', {'body': u'one'})
+        path = store.path(u'user:1', u'a')
+        store.put(u'user:1', u'a', {'body': u'two'})
+        store.put(u'user:1', u'a', {'body': u'three'})
+        assert store.get(u'user:1', u'a')['body'] == u'three'
+        with open(path) as f:
+            assert json.load(f)['body'] == u'one'
+        time.sleep(0.4)
+        with open(path) as f:
+            assert json.load(f)['body'] == u'three'
+        assert store._timers == {}
+
+    def test_limits(self):
+        """
+            Assert large drafts are refused and only the newest drafts
+            of a user are kept.
+        """
+        store = self.store(max_size=100, max_count=2, interval=0)
+        with self.assertRaises(DraftTooLarge):
+            store.put(u'user:1', u'a', {'body': u'x' * 100})
+        for url in (u'a', u'b', u'c'):
+            store.put(u'user:1', url, {'body': url})
+            # distinct modification times
+            time.sleep(0.01)
+        assert store.get(u'user:1', u'a') is None
+        assert store.get(u'user:1', u'c')['body'] == u'c'
+        folder = os.path.dirname(store.path(u'user:1', u'a'))
+        assert len(os.listdir(folder)) == 2
+
+    def test_max_age(self):
+        """
+            Assert old drafts are ignored.
+        """
+        store = self.store(max_age=60)
+        store.put(u'user:1', u'a', {'body': u'a'})
+        path = store.path(u'user:1', u'a')
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        assert store.get(u'user:1', u'a') is None
+
+
+class DraftsApiTestCase(WikiBaseTestCase):
+    """
+        Contains tests for autosaving drafts while editing.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+SECRET_KEY='secret'
+WTF_CSRF_ENABLED=False
+DRAFT_INTERVAL=0
+DRAFT_MAX_SIZE=1024
+"""
+
+    def put(self, url, **draft):
+        return self.app.put('/api/drafts/' + url, data=json.dumps(draft),
+                            content_type='application/json')
+
+    def test_api(self):
+        """
+            Assert drafts can be stored, read and discarded, outside
+            the content.
+        """
+        rsp = self.put('ops/deploy', title=u'Deploy', body=u'Step 1',
+                       tags=None, token=None)
+        assert rsp.status_code == 200
+        draft = self.app.get('/api/drafts/ops/deploy').get_json()
+        assert draft['body'] == u'Step 1'
+        assert draft['url'] == u'ops/deploy'
+        assert not os.path.exists(os.path.join(self.rootdir, 'ops'))
+        assert os.path.isdir(os.path.join(self.rootdir, '.wiki', 'drafts'))
+        rsp = self.app.delete('/api/drafts/ops/deploy')
+        assert rsp.status_code == 204
+        assert self.app.get('/api/drafts/ops/deploy').status_code == 404
+
+    def test_invalid(self):
+        """
+            Assert invalid and too large drafts are refused.
+        """
+        assert self.put('a', body=1).status_code == 400
+        assert self.app.put('/api/drafts/a', data={'body': u'x'}) \
+            .status_code == 400
+        assert self.put('..', body=u'x').status_code == 400
+        assert self.put('a', body=u'x' * 2000).status_code == 413
+
+    def test_edit(self):
+        """
+            Assert the editor offers a draft, which is dropped once the
+            page is saved.
+        """
+        self.create_file('a.md', u'title: A\n\nold\n')
+        assert b'id="draft"' not in self.app.get('/edit/a/').data
+        self.put('a', title=u'A', body=u'new', tags=u'', token=u'other')
+        html = self.app.get('/edit/a/').data
+        assert b'id="draft"' in html
+        assert b'The page was changed since.' in html
+        rsp = self.app.post('/edit/a/', data={
+            'title': u'A', 'body': u'new', 'tags': u''})
+        assert rsp.status_code == 302
+        assert self.app.get('/api/drafts/a').status_code == 404
+
+
+class NoSessionsTestCase(WikiBaseTestCase):
+    """
+        Contains tests for wikis without a secret key, which can not
+        tell anonymous editors apart.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+WTF_CSRF_ENABLED=False
+DRAFT_INTERVAL=0
+"""
+
+    def test_no_drafts(self):
+        """
+            Assert drafts are neither offered nor stored.
+        """
+        rsp = self.app.put('/api/drafts/a', data=json.dumps({'body': u'x'}),
+                           content_type='application/json')
+        assert rsp.status_code == 404
+        assert self.app.get('/api/drafts/a').status_code == 404
+        assert b'draftUrl' not in self.app.get('/edit/a/').data
+        assert not os.path.exists(os.path.join(self.rootdir, '.wiki',
+                                               'drafts'))
+
+    def test_no_preview_cache(self):
+        """
+            Assert previews are not cached per remote address.
+        """
+        rsp = self.app.post('/preview/', data={'body': u'title: a\n\n*x*'})
+        assert rsp.data == b'<p><em>x</em></p>'
+        previews = self.app.application.extensions['wiki_previews']
+        assert len(previews._cache) == 0
+
+
+class WikiGitDraftsTestCase(WikiGitBaseTestCase):
+    """
+        Contains tests for drafts of git backed wikis.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+USE_GIT=True
+SECRET_KEY='secret'
+WTF_CSRF_ENABLED=False
+DRAFT_INTERVAL=0
+"""
+
+    def test_no_commits(self):
+        """
+            Assert drafts are neither committed nor in the work tree.
+        """
+        self.commit_file('a.md', u'title: A\n\nold\n')
+        rsp = self.app.put('/api/drafts/a', data=json.dumps({'body': u'x'}),
+                           content_type='application/json')
+        assert rsp.status_code == 200
+        assert self.git('rev-list', '--count', 'HEAD').strip() == b'1'
+        assert self.git('status', '--porcelain', '--untracked-files=no') \
+            .strip() == b''
+        assert os.path.isdir(os.path.join(self.rootdir, '.git', 'wiki',
+                                          'drafts'))
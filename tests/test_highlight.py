@@ -0,0 +1,81 @@
+import os
+import shutil
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import markdown
+from mock import patch
+
+from wiki import highlight
+from wiki.core import highlite_diff
+from wiki.highlight import HighlightCache
+
+
+CODE = u'```python\ndef f(x):\n    return x\n```'
+
+
+class HighlightCacheTestCase(TestCase):
+    """
+        Contains various tests for the :class:`HighlightCache`.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory_bound(self):
+        """
+            Assert the least recently used entries are dropped.
+        """
+        cache = HighlightCache(size=2)
+        cache.put('a', u'1')
+        cache.put('b', u'2')
+        assert cache.get('a') == u'1'
+        cache.put('c', u'3')
+        assert cache.get('b') is None
+        assert len(cache) == 2
+
+    def test_directory(self):
+        """
+            Assert entries are shared through the directory.
+        """
+        key = HighlightCache.key(u'code', u'python')
+        HighlightCache(directory=self.directory).put(key, u'<pre>x</pre>')
+        cache = HighlightCache(directory=self.directory)
+        assert cache.get(key) == u'<pre>x</pre>'
+        assert HighlightCache().get(key) is None
+
+    def test_prune(self):
+        """
+            Assert the directory is pruned to its maximum size.
+        """
+        cache = HighlightCache(directory=self.directory, max_files=3)
+        for i in range(5):
+            cache.put(HighlightCache.key(i), u'x')
+        cache.prune()
+        assert sum(len(files) for _, _, files in
+                   os.walk(self.directory)) == 3
+
+    def test_codehilite(self):
+        """
+            Assert code blocks and diffs are highlighted once.
+        """
+        highlight.CACHE.clear()
+        calls = []
+        original = highlight._hilite
+
+        def hilite(self, *args):
+            calls.append(self.src)
+            return original(self, *args)
+
+        with patch('wiki.highlight._hilite', new=hilite):
+            first = highlite_diff(u'-a\n+b')
+            assert highlite_diff(u'-a\n+b') == first
+            assert len(calls) == 1
+            md = markdown.Markdown(['codehilite', 'fenced_code'])
+            html = md.convert(CODE)
+            assert markdown.Markdown(
+                ['codehilite', 'fenced_code']).convert(CODE) == html
+            assert len(calls) == 2
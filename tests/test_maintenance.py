@@ -0,0 +1,72 @@
+import os
+
+from click.testing import CliRunner
+
+from wiki.cli import main
+from wiki.maintenance import Maintenance
+from wiki.maintenance import run_due
+from wiki.maintenance import stamp_path
+
+from .test_wikigit import PAGE_CONTENT
+from .test_wikigit import WikiGitBaseTestCase
+
+
+class MaintenanceTestCase(WikiGitBaseTestCase):
+    """
+        Contains various tests for the repository maintenance.
+    """
+
+    def setUp(self):
+        super(MaintenanceTestCase, self).setUp()
+        for i in range(3):
+            self.commit_file('page%d.md' % i, PAGE_CONTENT)
+
+    def test_run(self):
+        """
+            Assert loose objects are packed and the history is intact.
+        """
+        report = Maintenance(self.rootdir, loose_objects=1).run()
+        assert [step.name for step in report.steps] == [
+            'repack', 'multi-pack-index', 'commit-graph', 'gc', 'pack-refs']
+        assert report.failed == []
+        assert report.before['count'] > 0
+        assert report.after['count'] == 0
+        assert report.after['in-pack'] == report.before['count']
+        assert os.path.exists(os.path.join(
+            self.rootdir, '.git', 'objects', 'info', 'commit-graph'))
+        assert len(self.wiki.history('page0')) == 1
+        assert [r.url for r in self.wiki.search(u'runbook')] == [
+            'page0', 'page1', 'page2']
+
+    def test_not_due(self):
+        """
+            Assert nothing is packed below the thresholds.
+        """
+        report = Maintenance(self.rootdir).run()
+        assert 'repack' not in [step.name for step in report.steps]
+        assert report.after['count'] == report.before['count']
+        assert Maintenance(self.rootdir).run(force=True).after['count'] == 0
+
+    def test_run_due(self):
+        """
+            Assert maintenance is only run once per interval.
+        """
+        assert run_due(self.rootdir, 3600) is not None
+        assert os.path.exists(stamp_path(self.rootdir))
+        assert run_due(self.rootdir, 3600) is None
+        assert run_due(self.rootdir, 0) is not None
+
+    def test_cli(self):
+        """
+            Assert the command prints a report.
+        """
+        result = CliRunner().invoke(
+            main, ['--directory', self.rootdir, 'maintenance', '--force'])
+        assert result.exit_code == 0, result.output
+        assert 'commit-graph' in result.output
+        assert 'git-lock held' in result.output
+        os.mkdir(os.path.join(self.rootdir, 'plain'))
+        result = CliRunner().invoke(
+            main, ['--directory', os.path.join(self.rootdir, 'plain'),
+                   'maintenance'])
+        assert result.exit_code != 0
@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from wiki import metrics
+
+
+class MetricsTestCase(TestCase):
+    """
+        Contains various tests for the metrics registry.
+    """
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram_buckets(self):
+        """
+            Assert observations are rendered as cumulative buckets.
+        """
+        self.registry.observe('latency', 0.003, stage='load')
+        self.registry.observe('latency', 20, stage='load')
+        text = self.registry.render()
+        assert 'latency_bucket{stage="load",le="0.0025"} 0' in text
+        assert 'latency_bucket{stage="load",le="0.005"} 1' in text
+        assert 'latency_bucket{stage="load",le="10.0"} 1' in text
+        assert 'latency_bucket{stage="load",le="+Inf"} 2' in text
+        assert 'latency_count{stage="load"} 2' in text
+
+    def test_counter(self):
+        """
+            Assert counters are summed per label set.
+        """
+        self.registry.inc('calls', command='log')
+        self.registry.inc('calls', 2, command='log')
+        self.registry.inc('calls', command='grep')
+        text = self.registry.render()
+        assert '# TYPE calls counter' in text
+        assert 'calls{command="log"} 3' in text
+        assert 'calls{command="grep"} 1' in text
+
+    def test_request_timings(self):
+        """
+            Assert timings are only collected inside a request and
+            summed per operation.
+        """
+        metrics.record('outside', 1.0)
+        metrics.start_request()
+        metrics.record('load', 0.001)
+        metrics.record('load', 0.002)
+        with metrics.timer('git'):
+            pass
+        total, timings = metrics.finish_request()
+        assert total >= 0
+        assert list(timings) == ['load', 'git']
+        assert timings['load'][1] == 2
+        header = metrics.server_timing(total, timings)
+        assert header.startswith('load;dur=3.00;desc="2 calls", git;dur=')
+        assert metrics.finish_request() == (None, {})
@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from wiki.indexes import IndexEntry
+from wiki.namespaces import NamespaceTree
+
+
+def entry(url, title=None):
+    return IndexEntry(url, title or url, (), 0.0, 0)
+
+
+class NamespaceTreeTestCase(TestCase):
+    """
+        Contains various tests for the :class:`NamespaceTree`.
+    """
+
+    def setUp(self):
+        self.tree = NamespaceTree()
+        self.entries = dict((url, entry(url, title)) for url, title in (
+            ('home', 'Home'), ('ops/deploy', 'Deploy'),
+            ('ops/backup', 'backup'), ('ops/db/restore', None),
+            ('dev/build', None)))
+        for page in self.entries.values():
+            self.tree.add(page)
+
+    def test_listing(self):
+        """
+            Assert namespaces list their pages by title and their sub
+            namespaces by name, with the number of pages below them.
+        """
+        assert self.tree.root.names == ['dev', 'ops']
+        assert [e.url for e in self.tree.root.entries] == ['home']
+        ops = self.tree.get('ops')
+        assert ops is self.tree.get('ops/')
+        assert [e.url for e in ops.entries] == ['ops/backup', 'ops/deploy']
+        assert ops.count == 3
+        assert self.tree.get('ops/db').prefix == 'ops/db/'
+        assert self.tree.get('missing') is None
+        assert len(self.tree) == 5
+
+    def test_remove(self):
+        """
+            Assert removing pages updates the counts and drops empty
+            namespaces.
+        """
+        self.tree.remove(self.entries['ops/db/restore'])
+        assert self.tree.get('ops/db') is None
+        assert self.tree.get('ops').names == []
+        assert self.tree.get('ops').count == 2
+        self.tree.remove(self.entries['dev/build'])
+        assert self.tree.root.names == ['ops']
+        assert len(self.tree) == 3
+        changed = entry('ops/deploy', 'A deploy')
+        self.tree.remove(self.entries['ops/deploy'])
+        self.tree.add(changed)
+        assert self.tree.get('ops').entries == [changed,
+                                                self.entries['ops/backup']]
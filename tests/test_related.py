@@ -0,0 +1,154 @@
+import marshal
+import os
+from unittest import skipUnless
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+from wiki import related
+from wiki.cli import main
+from wiki.indexes import WikiIndexes
+from wiki.related import TermMatrix
+
+from . import WikiBaseTestCase
+
+
+PAGE = u'title: {0}\n\n{1}\n'
+
+
+@skipUnless(related.available(), 'numpy is missing')
+class TermMatrixTestCase(TestCase):
+    """
+        Contains various tests for the :class:`TermMatrix`.
+    """
+
+    def setUp(self):
+        self.matrix = TermMatrix()
+        self.matrix.add('deploy', u'Deploy the server with ansible, then '
+                        u'restart the server.')
+        self.matrix.add('rollback', u'Restart the previous server release '
+                        u'with ansible.')
+        self.matrix.add('pasta', u'Cook the pasta, add tomato sauce.')
+        self.matrix.add('copy', u'Deploy the server with ansible, then '
+                        u'restart the server!')
+
+    def urls(self, url, limit=5):
+        return [similar for similar, _ in self.matrix.similar(url, limit)]
+
+    def test_similar(self):
+        """
+            Assert pages sharing words are ranked by similarity and
+            unrelated pages are left out.
+        """
+        assert self.urls('deploy') == ['copy', 'rollback']
+        assert self.urls('deploy', 1) == ['copy']
+        assert self.urls('pasta') == []
+        assert self.urls('missing') == []
+        score = self.matrix.similar('deploy')[0][1]
+        assert abs(score - 1.0) < 1e-5
+
+    def test_update(self):
+        """
+            Assert replaced and removed pages are updated, dead rows are
+            compacted away.
+        """
+        self.matrix.add('copy', u'Boil the pasta in salted water.')
+        assert self.urls('pasta') == ['copy']
+        assert self.urls('deploy') == ['rollback']
+        self.matrix.remove('copy')
+        self.matrix.remove('rollback')
+        assert self.urls('deploy') == []
+        assert self.matrix.dead == 0
+        assert self.matrix.urls == ['deploy', 'pasta']
+        assert self.matrix.df[self.matrix.terms[u'ansible']] == 1
+
+    def test_dump(self):
+        """
+            Assert the matrix round trips through marshal.
+        """
+        self.matrix.remove('rollback')
+        payload = marshal.loads(marshal.dumps(self.matrix.dump()))
+        loaded = TermMatrix.load(payload)
+        assert loaded.similar('deploy') == self.matrix.similar('deploy')
+        loaded.add('rollback', u'Restart the server release.')
+        assert [url for url, _ in loaded.similar('rollback')] == [
+            'deploy', 'copy']
+
+    def test_duplicates(self):
+        """
+            Assert near duplicates are reported once per pair.
+        """
+        pairs = self.matrix.duplicates()
+        assert [(a, b) for a, b, _ in pairs] == [('deploy', 'copy')]
+        assert self.matrix.duplicates(0.1)[0][:2] == ('deploy', 'copy')
+        assert len(self.matrix.duplicates(0.1)) == 3
+
+
+@skipUnless(related.available(), 'numpy is missing')
+class RelatedPagesTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the related pages of a wiki.
+    """
+
+    def setUp(self):
+        super(RelatedPagesTestCase, self).setUp()
+        self.create_file('deploy.md', PAGE.format(
+            u'Deploy', u'Deploy the server with ansible.'))
+        self.create_file('ops/rollback.md', PAGE.format(
+            u'Rollback', u'Roll the server back with ansible.'))
+        self.create_file('pasta.md', PAGE.format(u'Pasta', u'Cook pasta.'))
+
+    def test_related(self):
+        """
+            Assert related pages come with their index entries and saved
+            pages are indexed.
+        """
+        related = self.wiki.related('deploy')
+        assert [entry.title for entry, _ in related] == [u'Rollback']
+        self.wiki.save('pasta', u'Deploy pasta with ansible.',
+                       {'title': u'Pasta'})
+        assert [entry.url for entry, _ in self.wiki.related('deploy')] == [
+            'ops/rollback', 'pasta']
+
+    def test_snapshot(self):
+        """
+            Assert the matrix is loaded from snapshots, and rebuilt from
+            the pages if the snapshot has none.
+        """
+        path = os.path.join(self.rootdir, '.wiki', 'indexes')
+        indexes = WikiIndexes(self.rootdir, path, terms=True)
+        self.addCleanup(indexes.close)
+        indexes.refresh()
+        indexes.save()
+        loaded = WikiIndexes(self.rootdir, path, terms=True)
+        self.addCleanup(loaded.close)
+        assert [entry.url for entry, _ in loaded.related_pages('deploy')] \
+            == ['ops/rollback']
+        plain = WikiIndexes(self.rootdir, path)
+        self.addCleanup(plain.close)
+        plain.refresh()
+        assert plain.related_pages('deploy') is None
+        plain.save()
+        rebuilt = WikiIndexes(self.rootdir, path, terms=True)
+        self.addCleanup(rebuilt.close)
+        assert len(rebuilt.related_pages('deploy')) == 1
+
+    def test_display(self):
+        """
+            Assert pages show their related pages.
+        """
+        rsp = self.app.get('/deploy/')
+        assert b'<h3>Related</h3>' in rsp.data
+        assert b'>Rollback</a>' in rsp.data
+        assert b'<h3>Related</h3>' not in self.app.get('/pasta/').data
+
+    def test_duplicates_command(self):
+        """
+            Assert ``wiki duplicates`` lists nearly identical pages.
+        """
+        self.create_file('copy.md', PAGE.format(
+            u'Copy', u'Deploy the server with ansible!'))
+        result = CliRunner().invoke(
+            main, ['--directory', self.rootdir, 'duplicates'])
+        assert result.exit_code == 0, result.output
+        assert result.output.split() == ['1.000', 'deploy', 'copy']
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+from unittest import skipUnless
+from unittest import TestCase
+
+from wiki.core import Processor
+from wiki.core import wikilink
+from wiki.renderers import CommonMarkRenderer
+from wiki.renderers import get_renderer
+from wiki.renderers import RendererError
+from wiki.renderers import RENDERERS
+
+
+#: the syntax used on our pages, every renderer has to render it to the
+#: same html. Known differences, which are not part of the corpus:
+#: CommonMark nests lists indented by two spaces, Python-Markdown needs
+#: four; CommonMark starts a new list when the bullet changes and a new
+#: quote after a blank line; CommonMark ends html blocks at a blank
+#: line, Python-Markdown reads up to the closing tag.
+CORPUS = {
+    'heading': u'# Title\n\n## Sub *em*\n',
+    'setext': u'Title\n=====\n\ntext\n',
+    'inline': u'Some *em*, **strong**, _em_ and `code`.\n',
+    'paragraphs': u'one\nline\n\ntwo\n',
+    'list': u'* one\n* two\n* three\n',
+    'ordered': u'1. one\n2. two\n',
+    'loose': u'* one\n\n* two\n',
+    'nested': u'* one\n    * two\n',
+    'quote': u'> quoted\n> text\n>\n> * item\n',
+    'link': u'A [link](http://example.com "t") and <http://example.com>.\n',
+    'reflink': u'A [link][x].\n\n[x]: http://example.com\n',
+    'image': u'![alt](/a.png)\n',
+    'wikilink': u'See [[target]] and [[ns/page|Page]].\n',
+    'fence': u'```python\nx = 1 < 2\n```\n',
+    'fence_plain': u'```\nplain & text\n```\n',
+    'indented': u'text\n\n    :::python\n    x = 1\n',
+    'table': u'a | b\n--- | ---\n1 | *2*\n',
+    'table_pipes': u'| a | b |\n|:--|--:|\n| 1 | 2 |\n',
+    'hr': u'text\n\n---\n\nmore\n',
+    'html': u'<div>raw</div>\n\ntext\n',
+    'entities': u'AT&T &amp; 1 < 2 ö\n',
+    'linebreak': u'one  \ntwo\n',
+    'escape': u'\\*not em\\* \\[[x]]\n',
+}
+
+
+class SimpleWikilinkProcessor(Processor):
+    postprocessors = [lambda html: wikilink(
+        html, lambda endpoint, url: u'/{0}/'.format(url))]
+
+
+class Normalizer(HTMLParser):
+    """
+        Reduces html to its elements, sorted attributes and text, so
+        renderings only differing in formatting compare equal.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.events = []
+
+    def handle_starttag(self, tag, attrs):
+        self.events.append(('start', tag, sorted(attrs)))
+
+    def handle_endtag(self, tag):
+        self.events.append(('end', tag))
+
+    def handle_data(self, data):
+        if data.strip():
+            self.events.append(('text', data.strip()))
+
+
+def normalize(html):
+    parser = Normalizer()
+    parser.feed(html)
+    parser.close()
+    return parser.events
+
+
+class RendererTestCase(TestCase):
+    """
+        Contains various tests for selecting renderers.
+    """
+
+    def test_default(self):
+        """
+            Assert Python-Markdown is used if nothing is configured.
+        """
+        assert get_renderer().name == 'markdown'
+        assert Processor(u'a: b\n\nc').renderer.name == 'markdown'
+
+    def test_unknown(self):
+        """
+            Assert unknown renderers are reported.
+        """
+        with self.assertRaises(RendererError):
+            get_renderer('textile')
+
+
+@skipUnless(CommonMarkRenderer.available(), 'markdown-it-py is missing')
+class ConformanceTestCase(TestCase):
+    """
+        Compares the renderers on :data:`CORPUS`.
+    """
+
+    def test_corpus(self):
+        """
+            Assert all renderers render the corpus the same way.
+        """
+        reference = get_renderer('markdown')
+        for name in sorted(RENDERERS):
+            renderer = get_renderer(name)
+            for case, text in sorted(CORPUS.items()):
+                expected = normalize(reference.convert(text))
+                assert normalize(renderer.convert(text)) == expected, \
+                    (name, case)
+
+    def test_processor(self):
+        """
+            Assert metadata and wikilinks work with every renderer.
+        """
+        text = u'title: Test\ntags: a,\n    b\n\nSee [[target]].\n'
+        for name in sorted(RENDERERS):
+            html, body, meta = SimpleWikilinkProcessor(
+                text, renderer=name).process()
+            assert meta == {'title': u'Test', 'tags': u'a,\nb'}
+            assert body == u'See [[target]].\n'
+            assert normalize(html) == normalize(
+                u'<p>See <a href="/target/">target</a>.</p>'), name
@@ -0,0 +1,84 @@
+import os
+
+from mock import patch
+
+from wiki import snapshot
+from wiki.indexes import WikiIndexes
+from wiki.scanner import read_text
+
+from . import WikiBaseTestCase
+
+
+PAGE = u'title: {0}\ntags: {1}\n\n{2}\n'
+
+
+class SnapshotTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for index snapshots.
+    """
+
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        self.path = os.path.join(self.rootdir, '.wiki', 'indexes')
+
+    def indexes(self):
+        indexes = WikiIndexes(self.rootdir, self.path)
+        self.addCleanup(indexes.close)
+        return indexes
+
+    def test_format(self):
+        """
+            Assert snapshots round trip and unusable files are ignored.
+        """
+        snapshot.write(self.path, u'tag', {'a': set([u'b'])})
+        assert snapshot.read(self.path) == (u'tag', {'a': set([u'b'])})
+        with open(self.path, 'r+b') as f:
+            f.seek(8)
+            f.write(b'\xff')
+        assert snapshot.read(self.path) is None
+        with open(self.path, 'wb') as f:
+            f.write(b'')
+        assert snapshot.read(self.path) is None
+        assert snapshot.read(self.path + '.missing') is None
+
+    def test_generation(self):
+        """
+            Assert git wikis are tagged with the sha of their head.
+        """
+        assert snapshot.generation(self.rootdir).startswith('mtime:')
+        self.create_file('.git/HEAD', u'ref: refs/heads/main\n')
+        self.create_file('.git/packed-refs', u'abc refs/heads/main\n')
+        assert snapshot.generation(self.rootdir) == 'abc'
+        self.create_file('.git/refs/heads/main', u'def\n')
+        assert snapshot.generation(self.rootdir) == 'def'
+        assert snapshot.default_path(self.rootdir).startswith(
+            os.path.join(self.rootdir, '.git'))
+
+    def test_replay(self):
+        """
+            Assert a new process loads the snapshot and only reads the
+            pages that changed since.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'one', u'[[bb]]'))
+        self.create_file('bb.md', PAGE.format(u'B', u'two', u'text'))
+        self.create_file('ns/c.md', PAGE.format(u'C', u'one', u'x'))
+        first = self.indexes()
+        first.refresh()
+        assert os.path.exists(self.path)
+
+        self.create_file('bb.md', PAGE.format(u'B', u'one', u'changed'))
+        os.utime(os.path.join(self.rootdir, 'bb.md'), (1, 1))
+        os.remove(os.path.join(self.rootdir, 'ns', 'c.md'))
+        with patch('wiki.indexes.read_text', side_effect=read_text) as read:
+            second = self.indexes()
+            second.refresh()
+        assert [c[0][0] for c in read.call_args_list] == [
+            os.path.join(self.rootdir, 'bb.md')]
+        # the replayed changes are saved for the next process
+        assert second.snapshot_tag == snapshot.generation(self.rootdir)
+        assert second.tagged('one') == ['a', 'bb']
+        assert second.backlinks_of('bb') == ['a']
+        assert second.namespace('ns') is None
+        assert [e.title for e in second.get_entries(['a'])] == [u'A']
+        assert second.complete(u'b') == [('bb', u'B', 'prefix')]
+        assert second.candidates('changed') == ['bb']
@@ -0,0 +1,125 @@
+import re
+import time
+from unittest import TestCase
+
+from wiki.trigram import ALL
+from wiki.trigram import MAX_DEPTH
+from wiki.trigram import MAX_NODES
+from wiki.trigram import Query
+from wiki.trigram import regex_query
+from wiki.trigram import TrigramIndex
+
+
+def grams(*names):
+    return Query.and_(*[Query(Query.GRAM, gram=name) for name in names])
+
+
+class RegexQueryTestCase(TestCase):
+    """
+        Contains various tests for translating expressions into
+        trigram queries.
+    """
+
+    def test_literal(self):
+        """
+            Assert a literal requires all of its trigrams.
+        """
+        assert regex_query(u'Hello') == grams(u'hel', u'ell', u'llo')
+
+    def test_short(self):
+        """
+            Assert expressions without trigrams match everything.
+        """
+        assert regex_query(u'he') is ALL
+        assert regex_query(u'\\w+') is ALL
+        assert regex_query(u'(a+)+$') is ALL
+
+    def test_alternation(self):
+        """
+            Assert alternatives are combined with OR.
+        """
+        assert regex_query(u'foo|barbaz') == Query.or_(
+            grams(u'foo'), grams(u'bar', u'arb', u'rba', u'baz'))
+
+    def test_gap(self):
+        """
+            Assert both sides of a gap are required.
+        """
+        assert regex_query(u'foo.*bar') == grams(u'foo', u'bar')
+
+    def test_small_class(self):
+        """
+            Assert small character classes and optional characters are
+            expanded.
+        """
+        assert regex_query(u'gr[ae]y') == Query.or_(
+            grams(u'gra', u'ray'), grams(u'gre', u'rey'))
+        assert regex_query(u'colou?r') == Query.or_(
+            grams(u'col', u'olo', u'lor'),
+            grams(u'col', u'olo', u'lou', u'our'))
+
+    def test_repeat(self):
+        """
+            Assert a repeated group is required at least once.
+        """
+        assert regex_query(u'(abc)+d') == grams(u'abc')
+
+    def test_nested_groups(self):
+        """
+            Assert deeply nested groups are analyzed in linear time and
+            too complex expressions are not narrowed down.
+        """
+        start = time.time()
+        assert regex_query(u'(' * 30 + u'ab*xyz' + u')' * 30) == \
+            grams(u'xyz')
+        assert time.time() - start < 1
+        assert regex_query(u'(' * (MAX_DEPTH + 1) + u'xyz' +
+                           u')' * (MAX_DEPTH + 1)) is ALL
+        assert regex_query(u'|'.join(u'(abc%d)' % i
+                                     for i in range(MAX_NODES))) is ALL
+
+
+class TrigramIndexTestCase(TestCase):
+    """
+        Contains various tests for the :class:`TrigramIndex`.
+    """
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add('one', u'The quick brown Fox')
+        self.index.add('two', u'jumps over the lazy dog')
+        self.index.add('three', u'the grey fox')
+
+    def candidates(self, pattern, flags=re.IGNORECASE):
+        return self.index.candidates(re.compile(pattern, flags))
+
+    def test_candidates(self):
+        """
+            Assert candidates are selected case insensitively.
+        """
+        assert self.candidates(u'fox') == set(['one', 'three'])
+        assert self.candidates(u'FOX', 0) == set(['one', 'three'])
+        assert self.candidates(u'gr[ae]y|lazy') == set(['two', 'three'])
+        assert self.candidates(u'cat') == set()
+        assert self.candidates(u'.') is None
+
+    def test_update(self):
+        """
+            Assert re-indexing and removing pages updates the postings.
+        """
+        self.index.add('one', u'slow')
+        assert self.candidates(u'fox') == set(['three'])
+        self.index.remove('three')
+        assert self.candidates(u'fox') == set()
+        assert u'fox' not in self.index.postings
+
+    def test_dump(self):
+        """
+            Assert a loaded index answers and updates like the original.
+        """
+        self.index = TrigramIndex.load(self.index.dump())
+        assert self.candidates(u'fox') == set(['one', 'three'])
+        self.index.add('one', u'slow')
+        self.index.remove('three')
+        assert self.candidates(u'fox') == set()
+        assert self.candidates(u'slow') == set(['one'])
@@ -0,0 +1,335 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from wiki.indexes import RenderCache
+from wiki.indexes import WikiIndexes
+from wiki.watcher import diff
+from wiki.watcher import Event
+from wiki.watcher import Watcher
+
+from . import WikiBaseTestCase
+
+
+PAGE = u'title: {0}\ntags: {1}\n\n{2}\n'
+
+
+class DiffTestCase(TestCase):
+    """
+        Contains various tests for comparing snapshots.
+    """
+
+    def test_changes(self):
+        """
+            Assert additions, changes and removals are reported.
+        """
+        old = {'a': (1, 1, 1), 'b': (2, 1, 1), 'c': (3, 1, 1)}
+        new = {'a': (1, 1, 1), 'b': (2, 2, 5), 'd': (4, 1, 1)}
+        assert set(diff(old, new)) == set([
+            Event(Event.MODIFIED, 'b'),
+            Event(Event.DELETED, 'c'),
+            Event(Event.CREATED, 'd'),
+        ])
+
+    def test_move(self):
+        """
+            Assert an inode showing up under another url is a move.
+        """
+        events = diff({'a': (1, 1, 1)}, {'b': (1, 1, 1)})
+        assert events == [Event(Event.MOVED, 'a', dest='b')]
+        assert events[0].key == (1, 1, 1)
+
+
+class WatcherTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for the :class:`Watcher`, with inotify
+        where it is available.
+    """
+
+    use_inotify = True
+
+    def setUp(self):
+        super(WatcherTestCase, self).setUp()
+        self.watcher = Watcher(self.rootdir, use_inotify=self.use_inotify)
+
+    def tearDown(self):
+        self.watcher.close()
+        super(WatcherTestCase, self).tearDown()
+
+    def write(self, name, content=u'x'):
+        self.create_file(name, content)
+        # make sure the modification time differs on coarse filesystems
+        path = os.path.join(self.rootdir, name)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 6))
+
+    def test_start(self):
+        """
+            Assert the initial snapshot contains all pages.
+        """
+        self.write('a.md')
+        self.write('ns/b.md')
+        assert sorted(self.watcher.start()) == ['a', 'ns/b']
+        assert self.watcher.poll() == []
+
+    def test_hidden_folders(self):
+        """
+            Assert hidden folders, like the git and state folders, are
+            not listed.
+        """
+        self.write('a.md')
+        self.write('.git/objects/b.md')
+        self.write('.wiki/drafts/c.md')
+        assert sorted(self.watcher.start()) == ['a']
+        self.write('.wiki/drafts/d.md')
+        assert self.watcher.poll() == []
+
+    def test_changes(self):
+        """
+            Assert changes in new and existing folders are detected.
+        """
+        self.write('a.md')
+        self.write('ns/b.md')
+        self.watcher.start()
+        self.write('a.md', u'changed')
+        self.write('ns/c.md')
+        self.write('new/deep/d.md')
+        os.remove(os.path.join(self.rootdir, 'ns', 'b.md'))
+        assert set(self.watcher.poll()) == set([
+            Event(Event.MODIFIED, 'a'),
+            Event(Event.CREATED, 'ns/c'),
+            Event(Event.CREATED, 'new/deep/d'),
+            Event(Event.DELETED, 'ns/b'),
+        ])
+        # the new folder is watched as well
+        self.write('new/deep/d.md', u'changed')
+        assert self.watcher.poll() == [Event(Event.MODIFIED, 'new/deep/d')]
+
+    def test_moves(self):
+        """
+            Assert renamed pages and folders are reported as moves.
+        """
+        self.write('a.md')
+        self.write('ns/b.md')
+        self.watcher.start()
+        os.rename(os.path.join(self.rootdir, 'a.md'),
+                  os.path.join(self.rootdir, 'c.md'))
+        os.rename(os.path.join(self.rootdir, 'ns'),
+                  os.path.join(self.rootdir, 'other'))
+        assert set(self.watcher.poll()) == set([
+            Event(Event.MOVED, 'a', dest='c'),
+            Event(Event.MOVED, 'ns/b', dest='other/b'),
+        ])
+
+    def test_subscribers(self):
+        """
+            Assert subscribers receive every non empty batch.
+        """
+        batches = []
+        self.watcher.subscribe(batches.append)
+        self.watcher.start()
+        self.watcher.poll()
+        self.write('a.md')
+        self.watcher.poll()
+        assert batches == [[Event(Event.CREATED, 'a')]]
+
+    def test_run_debounces(self):
+        """
+            Assert a burst of changes is published as one batch.
+        """
+        batches = []
+        self.watcher.subscribe(batches.append)
+        self.watcher.start()
+        stop = threading.Event()
+        thread = threading.Thread(target=self.watcher.run, args=(
+            stop, 0.05, 0.2, 5.0))
+        thread.start()
+        try:
+            for i in range(5):
+                self.write('page%d.md' % i)
+                time.sleep(0.02)
+            for _ in range(100):
+                if batches:
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        if self.watcher.inotify is not None:
+            assert len(batches) == 1
+        assert len(sum(batches, [])) == 5
+
+
+class StatWatcherTestCase(WatcherTestCase):
+    """
+        Runs the watcher tests by comparing the whole tree.
+    """
+
+    use_inotify = False
+
+
+class IndexesTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for keeping the
+        :class:`~wiki.indexes.WikiIndexes` up to date.
+    """
+
+    def setUp(self):
+        super(IndexesTestCase, self).setUp()
+        self.indexes = WikiIndexes(self.rootdir)
+
+    def tearDown(self):
+        self.indexes.close()
+        super(IndexesTestCase, self).tearDown()
+
+    def test_external_changes(self):
+        """
+            Assert files changed by other programs update the tag and
+            link indexes.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'one, two', u'[[bb]]'))
+        self.create_file('bb.md', PAGE.format(u'B', u'two', u'text'))
+        assert self.indexes.get_tags() == {'one': ['a'], 'two': ['a', 'bb']}
+        assert self.indexes.backlinks_of('bb') == ['a']
+        os.remove(os.path.join(self.rootdir, 'a.md'))
+        self.create_file('c.md', PAGE.format(u'C', u'one', u'[[Bb|B]]'))
+        assert self.indexes.tagged('one') == ['c']
+        assert self.indexes.tagged('two') == ['bb']
+        assert self.indexes.backlinks_of('bb') == ['c']
+
+    def test_entries(self):
+        """
+            Assert the index entries carry the listed attributes and
+            share their tags.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'one, two', u'x'))
+        self.create_file('b.md', u'tags: one\n\ny\n')
+        a, b = sorted(self.indexes.get_entries(), key=lambda e: e.url)
+        assert (a.url, a.title, a.tags) == ('a', u'A', (u'one', u'two'))
+        assert a.size == os.path.getsize(os.path.join(self.rootdir, 'a.md'))
+        stat = os.stat(os.path.join(self.rootdir, 'a.md'))
+        assert a.mtime == stat.st_mtime_ns / 1e9
+        assert b.title == 'b'
+        assert a.tags[0] is b.tags[0]
+        assert not hasattr(a, '__dict__')
+        assert self.indexes.get_entries(['b', 'missing']) == [b]
+
+    def test_watch(self):
+        """
+            Assert the background thread applies changes.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'one', u''))
+        self.indexes.watch(interval=0.05, debounce=0.05)
+        for _ in range(100):
+            if self.indexes.built:
+                break
+            time.sleep(0.02)
+        self.create_file('b.md', PAGE.format(u'B', u'one', u''))
+        for _ in range(100):
+            if 'b' in self.indexes.stats:
+                break
+            time.sleep(0.02)
+        assert sorted(self.indexes.tags['one']) == ['a', 'b']
+
+    def test_throttled_without_inotify(self):
+        """
+            Assert the whole tree is not listed for every query if
+            there is no inotify.
+        """
+        self.indexes.watcher.use_inotify = False
+        self.create_file('a.md', PAGE.format(u'A', u'one', u''))
+        assert self.indexes.tagged('one') == ['a']
+        self.create_file('b.md', PAGE.format(u'B', u'one', u''))
+        assert self.indexes.tagged('one') == ['a']
+        self.indexes.refreshed -= self.indexes.max_age + 1
+        assert self.indexes.tagged('one') == ['a', 'b']
+
+
+class RenderCacheTestCase(WikiBaseTestCase):
+    """
+        Contains various tests for the :class:`RenderCache`.
+    """
+
+    def test_text_is_compared(self):
+        """
+            Assert entries are only used for the same text.
+        """
+        cache = RenderCache(size=1)
+        cache.put('a', u'text', 'rendered')
+        assert cache.get('a', u'text') == 'rendered'
+        assert cache.get('a', u'other') is None
+        cache.put('b', u'text', 'rendered')
+        assert cache.get('a', u'text') is None
+
+    def test_pages_use_cache(self):
+        """
+            Assert pages are rendered once and changes are rendered
+            again.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'', u'*x*'))
+        assert self.wiki.get('a').html == u'<p><em>x</em></p>'
+        assert len(self.wiki.renders) == 1
+        page = self.wiki.get('a')
+        page.title = u'Changed'
+        assert self.wiki.get('a').title == u'A'
+        self.create_file('a.md', PAGE.format(u'A', u'', u'*y*'))
+        assert self.wiki.get('a').html == u'<p><em>y</em></p>'
+
+    def test_includers_dropped(self):
+        """
+            Assert dropping a page drops the pages including it, but
+            no others.
+        """
+        cache = RenderCache()
+        cache.put('a', u'text', 'rendered', ['b', 'c'])
+        cache.put('d', u'text', 'rendered', ['c'])
+        cache.put('e', u'text', 'rendered')
+        cache.discard('c')
+        assert cache.get('a', u'text') is None
+        assert cache.get('d', u'text') is None
+        assert cache.get('e', u'text') == 'rendered'
+        assert cache.dependents == {}
+
+    def test_stale_includes_not_stored(self):
+        """
+            Assert a rendering including pages is not stored if a page
+            changed while it was rendered.
+        """
+        cache = RenderCache()
+        version = cache.version
+        cache.discard('b')
+        cache.put('a', u'text', 'rendered', ['b'], version)
+        assert cache.get('a', u'text') is None
+        cache.put('c', u'text', 'rendered', (), version)
+        assert cache.get('c', u'text') == 'rendered'
+
+    def test_included_page_saved(self):
+        """
+            Assert saving an included page renders exactly the pages
+            including it again.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'', u'{{include:b}}'))
+        self.create_file('b.md', PAGE.format(u'B', u'', u'*x*'))
+        self.create_file('c.md', PAGE.format(u'C', u'', u'*c*'))
+        assert self.wiki.get('a').html == u'<p><em>x</em></p>'
+        self.wiki.get('c')
+        assert len(self.wiki.renders) == 2
+        self.wiki.save('b', u'*y*\n', {'title': u'B'})
+        assert len(self.wiki.renders) == 1
+        assert self.wiki.get('a').html == u'<p><em>y</em></p>'
+
+    def test_included_page_changed_elsewhere(self):
+        """
+            Assert a change of an included page made by another
+            process is rendered before the indexes detect it.
+        """
+        self.create_file('a.md', PAGE.format(u'A', u'', u'{{include:b}}'))
+        self.create_file('b.md', PAGE.format(u'B', u'', u'*x*'))
+        assert self.wiki.get('a').html == u'<p><em>x</em></p>'
+        assert len(self.wiki.renders) == 1
+        # not published, like a process without a change log
+        self.create_file('b.md', PAGE.format(u'B', u'', u'*yy*'))
+        assert self.wiki.get('a').html == u'<p><em>yy</em></p>'
+        os.remove(os.path.join(self.rootdir, 'b.md'))
+        assert u'Included page not found: b' in self.wiki.get('a').html
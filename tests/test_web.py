@@ -14,3 +14,267 @@ class WebContentTestCase(WikiBaseTestCase):
         rsp = self.app.get('/')
         assert b"You did not create any content yet." in rsp.data
         assert rsp.status_code == 200
+
+    def test_namespace_index(self):
+        """
+            Assert the index lists one namespace at a time.
+        """
+        self.create_file('home.md', u'title: Home\n\nx\n')
+        self.create_file('ops/deploy.md', u'title: Deploy\n\nx\n')
+        self.create_file('ops/db/restore.md', u'title: Restore\n\nx\n')
+        rsp = self.app.get('/index/')
+        assert b'/index/ops/' in rsp.data
+        assert b'2 pages' in rsp.data
+        assert b'Deploy' not in rsp.data
+        rsp = self.app.get('/index/ops/')
+        assert b'Deploy' in rsp.data
+        assert b'/index/ops/db/' in rsp.data
+        assert b'/home/' not in rsp.data
+        assert self.app.get('/index/missing/').status_code == 404
+
+
+class InstrumentationTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the request timing and metrics endpoint.
+    """
+
+    def test_server_timing(self):
+        """
+            Assert a page view reports its stages in the Server-Timing
+            header.
+        """
+        self.create_file('home.md', u'title: Home\n\nHello *world*.\n')
+        rsp = self.app.get('/')
+        timing = rsp.headers['Server-Timing']
+        for stage in ('load', 'pre', 'markdown', 'meta', 'post',
+                      'template', 'total'):
+            assert stage + ';dur=' in timing
+
+    def test_metrics(self):
+        """
+            Assert the metrics endpoint exports the aggregated
+            histograms in the Prometheus text format.
+        """
+        self.create_file('home.md', u'title: Home\n\nHello.\n')
+        self.app.get('/')
+        rsp = self.app.get('/metrics')
+        assert rsp.status_code == 200
+        assert rsp.mimetype == 'text/plain'
+        assert (b'wiki_operation_duration_seconds_count'
+                b'{operation="markdown"}') in rsp.data
+        assert b'wiki_request_duration_seconds_bucket{' in rsp.data
+        assert b'# TYPE wiki_requests_total counter' in rsp.data
+
+
+class PrivateMetricsTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the metrics of private wikis.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+PRIVATE=True
+SECRET_KEY='secret'
+"""
+
+    def test_metrics_protected(self):
+        """
+            Assert only logged in users see the metrics.
+        """
+        rsp = self.app.get('/metrics')
+        assert rsp.status_code == 302
+        assert b'wiki_requests_total' not in rsp.data
+
+
+class SearchTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the search view.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+WTF_CSRF_ENABLED=False
+"""
+
+    def test_search_snippets(self):
+        """
+            Assert results show the title, match count and highlighted
+            snippets.
+        """
+        self.create_file('test.md', u'title: Test\n\nfoo <bar>\n\nfoo\n')
+        rsp = self.app.post('/search/', data={'term': 'foo'})
+        assert rsp.status_code == 200
+        assert b'>Test</a>' in rsp.data
+        assert b'2 matches' in rsp.data
+        assert b'<mark>foo</mark> &lt;bar&gt;' in rsp.data
+
+    def test_search_invalid_regex(self):
+        """
+            Assert an invalid regular expression is reported.
+        """
+        rsp = self.app.post('/search/', data={'term': '(foo'})
+        assert rsp.status_code == 200
+        assert b'Invalid regular expression' in rsp.data
+
+
+class BoundedSearchTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the deadline of user supplied expressions.
+    """
+
+    config_content = WikiBaseTestCase.config_content + u"""
+SECRET_KEY='secret'
+WTF_CSRF_ENABLED=False
+SEARCH_TIMEOUT=0.5
+WORKER_POOL_SIZE=1
+"""
+
+    def test_search_timeout(self):
+        """
+            Assert a catastrophic backtracking expression is cancelled.
+        """
+        self.create_file('test.md', u'title: Test\n\n' + u'a' * 40 + u'b\n')
+        rsp = self.app.post('/search/', data={'term': '(a+)+$'})
+        assert rsp.status_code == 503
+        assert b'took too long' in rsp.data
+        rsp = self.app.post('/search/', data={'term': 'a+b'})
+        assert rsp.status_code == 200
+        assert b'>Test</a>' in rsp.data
+
+    def test_preview(self):
+        """
+            Assert the preview is rendered by a worker.
+        """
+        rsp = self.app.post('/preview/', data={
+            'body': u'title: preview\n\n[[Some Page]] *x*'})
+        assert rsp.status_code == 200
+        assert rsp.data == (b"<p><a href='/some_page/'>Some Page</a> "
+                            b"<em>x</em></p>")
+
+    def test_preview_include(self):
+        """
+            Assert the preview expands includes.
+        """
+        self.create_file('shared.md', u'title: Shared\n\n*shared*\n')
+        rsp = self.app.post('/preview/', data={
+            'body': u'title: preview\n\n{{include:shared}}'})
+        assert rsp.status_code == 200
+        assert rsp.data == b'<p><em>shared</em></p>'
+
+    def test_preview_blocks(self):
+        """
+            Assert only changed blocks are sent to the worker.
+        """
+        body = u'title: preview\n\n# A\n\ntext\n\n```\ncode\n```'
+        first = self.app.post('/preview/', data={'body': body})
+        previews = self.app.application.extensions['wiki_previews']
+        sid = list(previews._cache)[0]
+        assert len(previews._cache[sid]) == 3
+        second = self.app.post('/preview/', data={
+            'body': body.replace(u'text', u'more text')})
+        assert len(previews._cache[sid]) == 4
+        assert first.data.replace(b'text', b'more text') == second.data
+
+
+class CompletionTestCase(WikiBaseTestCase):
+    """
+        Contains tests for the completion endpoint.
+    """
+
+    def test_complete(self):
+        """
+            Assert titles are completed as JSON and new pages show up.
+        """
+        self.create_file('ops/deploy.md', u'title: Deploy Howto\n\nx\n')
+        rsp = self.app.get('/api/complete?q=dep')
+        assert rsp.status_code == 200
+        assert rsp.get_json() == {'query': u'dep', 'results': [
+            {'url': u'ops/deploy', 'title': u'Deploy Howto',
+             'match': u'prefix'}]}
+        self.wiki.save('design', u'body', {'title': u'Design'})
+        urls = [r['url'] for r in
+                self.app.get('/api/complete?q=de').get_json()['results']]
+        assert urls == ['ops/deploy', 'design']
+
+
+class PagesApiTestCase(WikiBaseTestCase):
+    """
+        Contains tests for reading and writing pages in batches.
+    """
+
+    def test_read(self):
+        """
+            Assert many pages are read with their metadata and tokens.
+        """
+        self.create_file('a.md', u'title: A\ntags: x\n\nbody a\n')
+        self.create_file('ns/b.md', u'title: B\n\nbody b\n')
+        rsp = self.app.get('/api/pages?urls=a,ns/b&urls=missing')
+        assert rsp.status_code == 200
+        data = rsp.get_json()
+        assert [p['url'] for p in data['pages']] == ['a', 'ns/b']
+        assert data['pages'][0]['meta'] == {'title': u'A', 'tags': u'x'}
+        assert data['pages'][0]['body'] == u'body a\n'
+        assert len(data['pages'][0]['token']) == 40
+        assert data['missing'] == ['missing']
+        assert self.app.get('/api/pages?urls=../x').status_code == 400
+
+    def test_write(self):
+        """
+            Assert pages are written all at once and their new tokens
+            are returned.
+        """
+        self.create_file('a.md', u'title: A\n\nold\n')
+        token = self.app.get('/api/pages?urls=a').get_json()[
+            'pages'][0]['token']
+        rsp = self.app.post('/api/pages:batch', json={'pages': [
+            {'url': 'a', 'body': u'new\n', 'meta': {'title': u'A'},
+             'token': token},
+            {'url': 'ns/b', 'body': u'b\n', 'meta': {'title': u'B'},
+             'token': None},
+        ]})
+        assert rsp.status_code == 200, rsp.get_data()
+        tokens = dict((p['url'], p['token'])
+                      for p in rsp.get_json()['pages'])
+        assert tokens['a'] != token
+        assert self.wiki.load('a') == u'title: A\n\nnew\n'
+        assert self.wiki.get('ns/b').title == u'B'
+        assert self.wiki.load_many(['ns/b'])['ns/b'][1] == tokens['ns/b']
+
+    def test_conflict(self):
+        """
+            Assert nothing is written if any page changed since it was
+            read.
+        """
+        self.create_file('a.md', u'title: A\n\nold\n')
+        token = self.app.get('/api/pages?urls=a').get_json()[
+            'pages'][0]['token']
+        self.create_file('a.md', u'title: A\n\nchanged\n')
+        rsp = self.app.post('/api/pages:batch', json={'pages': [
+            {'url': 'b', 'body': u'b\n', 'token': None},
+            {'url': 'a', 'body': u'mine\n', 'token': token},
+        ]})
+        assert rsp.status_code == 409
+        conflicts = rsp.get_json()['conflicts']
+        assert [c['url'] for c in conflicts] == ['a']
+        assert conflicts[0]['token'] != token
+        assert not self.wiki.exists('b')
+        assert self.wiki.load('a') == u'title: A\n\nchanged\n'
+        # pages expected to be new must not exist
+        rsp = self.app.post('/api/pages:batch', json={'pages': [
+            {'url': 'a', 'body': u'mine\n', 'token': None}]})
+        assert rsp.get_json()['conflicts'] == [
+            {'url': 'a', 'token': conflicts[0]['token']}]
+
+    def test_invalid(self):
+        """
+            Assert malformed batches are refused.
+        """
+        for data in ({}, {'pages': []}, {'pages': [{'body': u'x'}]},
+                     {'pages': [{'url': 'a', 'meta': []}]},
+                     {'pages': [{'url': 'a', 'meta': {'a': u'x\n\nbody'}}]},
+                     {'pages': [{'url': 'a', 'meta': {'a: b': u'x'}}]},
+                     {'pages': [{'url': 'a', 'meta': {'a\nb': u'x'}}]},
+                     {'pages': [{'url': 'edit/a'}]},
+                     {'pages': [{'url': 'a'}, {'url': 'a'}]}):
+            assert self.app.post('/api/pages:batch',
+                                 json=data).status_code == 400, data
+        assert self.app.post('/api/pages:batch', data='{"pages": []}',
+                             content_type='text/plain').status_code == 400
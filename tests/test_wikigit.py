@@ -0,0 +1,341 @@
+import subprocess
+from xml.etree import ElementTree
+
+from wiki.core import ANY
+from wiki.wikigit import WikiGit
+
+from . import CONFIGURATION
+from . import WikiBaseTestCase
+
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+PAGE_CONTENT = u"""\
+title: Deploy: Howto
+tags: ops, runbook
+
+Deploy the server.
+
+Restart the server after every deploy.
+"""
+
+
+class WikiGitBaseTestCase(WikiBaseTestCase):
+    """
+        Creates a git repository in the content directory.
+    """
+
+    def setUp(self):
+        super(WikiGitBaseTestCase, self).setUp()
+        self.git('init', '-q')
+        self.git('config', 'user.name', 'test')
+        self.git('config', 'user.email', 'test@localhost')
+        self._gitwiki = None
+
+    @property
+    def wiki(self):
+        if not self._gitwiki:
+            self._gitwiki = WikiGit(self.rootdir)
+        return self._gitwiki
+
+    def git(self, *args):
+        return subprocess.check_output(('git',) + args, cwd=self.rootdir)
+
+    def commit_file(self, name, content):
+        path = self.create_file(name, content)
+        self.git('add', name)
+        self.git('commit', '-q', '-m', 'add %s' % name)
+        return path
+
+
+class WikiGitSearchTestCase(WikiGitBaseTestCase):
+    """
+        Contains various tests for :meth:`WikiGit.search`.
+    """
+
+    def test_search_deduplicates(self):
+        """
+            Assert a page with several matching lines is returned once,
+            with all matches counted.
+        """
+        self.commit_file('ops/deploy:now.md', PAGE_CONTENT)
+        # no trigrams, so git grep is used
+        results = self.wiki.search(u'se\\w+')
+        assert len(results) == 1
+        result = results[0]
+        assert result.url == 'ops/deploy:now'
+        assert result.title == u'Deploy: Howto'
+        assert result.count == 2
+        assert [s.lineno for s in result.snippets] == [4, 6]
+        assert u'<mark>server</mark>' in result.snippets[0].__html__()
+        assert self.wiki.search(u'server')[0].count == 2
+
+    def test_search_meta(self):
+        """
+            Assert meta values are searched, meta keys are not.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        assert [r.url for r in self.wiki.search(u'runbook')] == ['deploy']
+        assert self.wiki.search(u'tags') == []
+
+    def test_search_no_match(self):
+        """
+            Assert nothing is returned if nothing matches.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        assert self.wiki.search(u'nothing-like-this') == []
+
+    def test_search_limit(self):
+        """
+            Assert the number of results is capped.
+        """
+        for i in range(4):
+            self.commit_file('page%d.md' % i, PAGE_CONTENT)
+        assert len(self.wiki.search(u'de.*')) == 4
+        assert len(self.wiki.search(u'de.*', limit=3)) == 3
+        assert len(self.wiki.search(u'deploy', limit=3)) == 3
+
+    def test_search_limit_meta_keys(self):
+        """
+            Assert pages matching only in metadata keys do not take the
+            places of the results.
+        """
+        for i in range(10):
+            self.commit_file('page%d.md' % i, PAGE_CONTENT)
+        self.commit_file('page9.md', PAGE_CONTENT + u'\nMore tags.\n')
+        assert [r.url for r in self.wiki.search(u'tags', limit=3)] == [
+            'page9']
+
+    def test_search_fallback(self):
+        """
+            Assert expressions git can not handle are searched by the
+            file scanner.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        results = self.wiki.search(u'the (?=server)')
+        assert [r.url for r in results] == ['deploy']
+        assert results[0].count == 2
+
+    def test_search_index_updates(self):
+        """
+            Assert the trigram index follows moves and deletes.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        assert [r.url for r in self.wiki.search(u'runbook')] == ['deploy']
+        self.wiki.move('deploy', 'moved')
+        assert [r.url for r in self.wiki.search(u'runbook')] == ['moved']
+        self.wiki.delete('moved')
+        assert self.wiki.search(u'runbook') == []
+
+
+class WikiGitChangesTestCase(WikiGitBaseTestCase):
+    """
+        Contains various tests for the recent changes.
+    """
+
+    config_content = CONFIGURATION + u'USE_GIT=True\n'
+
+    def test_changes(self):
+        """
+            Assert commits are listed newest first with their pages.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        self.commit_file('ops/restart.md', PAGE_CONTENT)
+        self.git('mv', 'deploy.md', 'ops/deploy.md')
+        self.git('commit', '-q', '-m', 'move')
+        changes, cursor = self.wiki.changes()
+        assert cursor is None
+        assert [c.subject for c in changes] == [
+            'move', 'add ops/restart.md', 'add deploy.md']
+        moved = changes[0].files[0]
+        assert (moved.status, moved.url, moved.old_url) == (
+            'R', 'ops/deploy', 'deploy')
+        assert [(f.status, f.url) for f in changes[1].files] == [
+            ('A', 'ops/restart')]
+
+    def test_changes_pages(self):
+        """
+            Assert the cursor continues where the last page ended.
+        """
+        for i in range(5):
+            self.commit_file('page%d.md' % i, PAGE_CONTENT)
+        changes, cursor = self.wiki.changes(limit=2)
+        seen = [c.subject for c in changes]
+        while cursor:
+            changes, cursor = self.wiki.changes(cursor, limit=2)
+            seen += [c.subject for c in changes]
+        assert seen == ['add page%d.md' % i for i in range(4, -1, -1)]
+
+    def test_changes_prefix(self):
+        """
+            Assert changes can be limited to a namespace and files
+            which are no pages are left out.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        self.commit_file('ops/restart.md', PAGE_CONTENT)
+        self.commit_file('notes.txt', u'text')
+        changes = self.wiki.changes(prefix='ops')[0]
+        assert [c.subject for c in changes] == ['add ops/restart.md']
+        assert self.wiki.changes()[0][0].subject == 'add ops/restart.md'
+
+    def test_changes_cache(self):
+        """
+            Assert results are cached until HEAD moves.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        first = self.wiki.changes()
+        assert self.wiki.changes() is first
+        self.commit_file('restart.md', PAGE_CONTENT)
+        assert len(self.wiki.changes()[0]) == 2
+
+    def test_changes_empty(self):
+        """
+            Assert a repository without commits has no changes and
+            invalid cursors are refused.
+        """
+        assert self.wiki.changes() == ([], None)
+        with self.assertRaises(ValueError):
+            self.wiki.changes('HEAD~1')
+
+    def test_changes_page(self):
+        """
+            Assert the changes page links the pages and the next page.
+        """
+        for i in range(3):
+            self.commit_file('page%d.md' % i, PAGE_CONTENT)
+        response = self.app.get('/changes/?limit=2')
+        assert response.status_code == 200
+        html = response.get_data(as_text=True)
+        assert '/page2/' in html and '/page1/' in html
+        assert '/page0/' not in html
+        cursor = self.wiki.changes(limit=2)[1]
+        assert 'start=' + cursor in html
+        response = self.app.get('/changes/?limit=2&start=' + cursor)
+        assert '/page0/' in response.get_data(as_text=True)
+        assert self.app.get('/changes/?start=nope').status_code == 400
+
+    def test_feed(self):
+        """
+            Assert the feed lists the latest commits.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        self.commit_file('ops/restart.md', PAGE_CONTENT)
+        response = self.app.get('/feed.atom')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/atom+xml'
+        root = ElementTree.fromstring(response.data)
+        entries = root.findall(ATOM + 'entry')
+        assert [e.find(ATOM + 'title').text for e in entries] == [
+            'ops/restart', 'deploy']
+        assert entries[0].find(ATOM + 'link').get('href') == \
+            'http://localhost/ops/restart/'
+
+    def test_feed_namespace(self):
+        """
+            Assert namespace feeds only list changes of their pages.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        self.commit_file('ops/restart.md', PAGE_CONTENT)
+        response = self.app.get('/index/ops/feed.atom')
+        assert response.status_code == 200
+        root = ElementTree.fromstring(response.data)
+        assert [e.find(ATOM + 'title').text
+                for e in root.findall(ATOM + 'entry')] == ['ops/restart']
+        assert response.headers['ETag'] != \
+            self.app.get('/feed.atom').headers['ETag']
+
+    def test_feed_not_modified(self):
+        """
+            Assert feed readers get a 304 until the next commit.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        etag = self.app.get('/feed.atom').headers['ETag']
+        response = self.app.get('/feed.atom',
+                                headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        self.commit_file('restart.md', PAGE_CONTENT)
+        response = self.app.get('/feed.atom',
+                                headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+
+class WikiGitBlameTestCase(WikiGitBaseTestCase):
+    """
+        Contains various tests for the blame view.
+    """
+
+    config_content = CONFIGURATION + u'USE_GIT=True\nBLAME_EXPAND_LINES=5\n'
+
+    def test_blame(self):
+        """
+            Assert lines are blamed on the commits changing them last
+            and split into sections at headings.
+        """
+        self.commit_file('deploy.md', u'title: Deploy\n\n# One\n\nfirst\n')
+        self.git('config', 'user.name', 'other')
+        self.commit_file('deploy.md', u'title: Deploy\n\n# One\n\nsecond\n'
+                         u'```\n# no heading\n```\n## Two\n')
+        sections = self.wiki.blame('deploy')
+        assert [(s.title, s.lineno, s.count) for s in sections] == [
+            (None, 1, 2), ('One', 3, 6), ('Two', 9, 1)]
+        hunks = sections[1].hunks
+        assert [(h.commit.author, h.lineno, h.lines) for h in hunks] == [
+            ('test', 3, ['# One', '']),
+            ('other', 5, ['second', '```', '# no heading', '```'])]
+        assert hunks[0].commit.summary == 'add deploy.md'
+
+    def test_blame_cache(self):
+        """
+            Assert blames are cached by content and uncommitted lines
+            are not cached.
+        """
+        self.commit_file('deploy.md', PAGE_CONTENT)
+        sections = self.wiki.blame('deploy')
+        assert self.wiki.blame('deploy') is sections
+        self.create_file('deploy.md', PAGE_CONTENT + u'more\n')
+        sections = self.wiki.blame('deploy')
+        assert not sections[-1].hunks[-1].commit.committed
+        assert self.wiki.blame('deploy') is not sections
+        assert self.wiki.blame('missing') is None
+
+    def test_blame_page(self):
+        """
+            Assert only the first sections are rendered right away.
+        """
+        self.commit_file('deploy.md', u'title: Deploy\n\n# One\n\nfirst\n'
+                         u'# Two\n\nsecond\n')
+        html = self.app.get('/blame/deploy/').get_data(as_text=True)
+        assert 'first' in html and 'second' not in html
+        assert '/blame/deploy/?section=2' in html
+        response = self.app.get('/blame/deploy/?section=2')
+        assert 'second' in response.get_data(as_text=True)
+        assert self.app.get('/blame/deploy/?section=3').status_code == 404
+        assert self.app.get('/blame/missing/').status_code == 404
+
+
+class WikiGitBatchTestCase(WikiGitBaseTestCase):
+    """
+        Contains tests for saving many pages at once.
+    """
+
+    def test_save_many(self):
+        """
+            Assert all pages are saved in a single commit.
+        """
+        self.commit_file('a.md', PAGE_CONTENT)
+        token = self.wiki.load_many(['a'])['a'][1]
+        assert token == self.git('rev-parse', 'HEAD:a.md').decode().strip()
+        tokens = self.wiki.save_many([
+            ('a', u'new\n', {'title': u'A'}, token),
+            ('ns/b', u'b\n', {'title': u'B'}, None),
+        ], author='bot')
+        log = self.git('log', '--format=%an %s', '--name-only', '-1')
+        assert log.decode().split() == [
+            'bot', 'changed', '2', 'pages', 'a.md', 'ns/b.md']
+        assert tokens['a'] == self.git(
+            'rev-parse', 'HEAD:a.md').decode().strip()
+        # the same content again, nothing to commit
+        self.wiki.save_many([('a', u'new\n', {'title': u'A'}, ANY)])
+        assert len(self.wiki.changes()[0]) == 2
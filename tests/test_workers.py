@@ -0,0 +1,94 @@
+import os
+import time
+from unittest import TestCase
+
+from wiki.workers import DeadlineExceeded
+from wiki.workers import PoolBusy
+from wiki.workers import WorkerPool
+
+
+def echo(value):
+    return value, os.getpid()
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def setenv(name, value):
+    os.environ[name] = value
+
+
+def getenv(name):
+    return os.environ.get(name)
+
+
+class WorkerPoolTestCase(TestCase):
+    """
+        Contains various tests for the deadline bounded worker pool.
+    """
+
+    def setUp(self):
+        self.pool = WorkerPool(1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_run(self):
+        """
+            Assert jobs run in a reused worker process.
+        """
+        value, pid = self.pool.run(10, echo, u'hello')
+        assert value == u'hello'
+        assert pid != os.getpid()
+        assert self.pool.run(10, echo, 1)[1] == pid
+
+    def test_exception(self):
+        """
+            Assert exceptions are raised again in the caller.
+        """
+        with self.assertRaises(ValueError):
+            self.pool.run(10, fail, 'broken')
+
+    def test_deadline(self):
+        """
+            Assert a job exceeding the deadline is cancelled and the
+            worker is replaced.
+        """
+        pid = self.pool.run(10, echo, None)[1]
+        with self.assertRaises(DeadlineExceeded):
+            self.pool.run(0.2, sleep, 30)
+        assert self.pool.run(10, echo, None)[1] != pid
+
+    def test_initializer(self):
+        """
+            Assert new workers run the initializer before taking jobs,
+            also after a worker was replaced.
+        """
+        pool = WorkerPool(1, initializer=setenv,
+                          initargs=('WIKI_TEST_WORKER', u'ready'))
+        self.addCleanup(pool.close)
+        assert pool.run(10, getenv, 'WIKI_TEST_WORKER') == u'ready'
+        with self.assertRaises(DeadlineExceeded):
+            pool.run(0.2, sleep, 30)
+        assert len(pool._idle) == 1
+        assert pool.run(10, getenv, 'WIKI_TEST_WORKER') == u'ready'
+
+    def test_busy(self):
+        """
+            Assert the concurrency limit is enforced.
+        """
+        self.pool._busy = 1
+        with self.assertRaises(PoolBusy):
+            self.pool.run(0.1, echo, None)
+
+    def test_inline(self):
+        """
+            Assert a pool of size zero runs jobs in the caller.
+        """
+        assert WorkerPool(0).run(1, echo, 1)[1] == os.getpid()
@@ -0,0 +1,166 @@
+"""
+    Change log
+    ~~~~~~~~~~
+
+    An append-only log of the pages written through the engines, shared
+    by all processes of a content directory. Every process remembers
+    how far it has read the log, so finding out whether another process
+    changed something is a single ``stat`` of the log file, reading the
+    new records only happens if it grew.
+
+    Every record is one line holding a generation number, which
+    increases with every record, the kind of change and the url::
+
+        17	saved	ops/deploy
+
+    The log is started over when it gets too big. Processes notice
+    that by the changed inode and have to assume anything changed.
+"""
+import os
+import threading
+
+import fasteners
+
+from wiki import metrics
+
+
+SAVED = 'saved'
+REMOVED = 'removed'
+
+HEADER = u'# wiki change log\n'
+
+
+class ChangeLog(object):
+    """
+        The change log of a content directory.
+
+        :param str path: the log file, its folder is created if needed
+        :param int max_size: the log is started over once it is bigger
+            than that many bytes
+    """
+
+    def __init__(self, path, max_size=1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.lock = fasteners.InterProcessLock(path + '.lock')
+        self._read_lock = threading.Lock()
+        #: the generation of the last record read
+        self.generation = 0
+        self._ino = None
+        self._offset = 0
+        self.seek_end()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path)
+        except OSError:
+            return None
+
+    def seek_end(self):
+        """
+            Skips everything logged so far.
+        """
+        stat = self._stat()
+        if stat is not None:
+            self._ino, self._offset = stat.st_ino, stat.st_size
+            self.generation = self._last_generation()
+
+    def _last_generation(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 4096))
+                lines = f.read().split(b'\n')
+        except (IOError, OSError):
+            return 0
+        for line in reversed(lines):
+            try:
+                return int(line.split(b'\t', 1)[0])
+            except ValueError:
+                continue
+        return 0
+
+    def append(self, kind, urls):
+        """
+            Logs a change of the given pages.
+
+            :param str kind: :data:`SAVED` or :data:`REMOVED`
+            :param list urls: the urls of the pages
+
+            :returns: the generation of the last record
+            :rtype: int
+        """
+        folder = os.path.dirname(self.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        with self.lock:
+            stat = self._stat()
+            if stat is None or stat.st_size > self.max_size:
+                self._start_over()
+            generation = self._last_generation()
+            lines = []
+            for url in urls:
+                generation += 1
+                lines.append(
+                    u'{0}\t{1}\t{2}\n'.format(generation, kind, url))
+            # readers only take complete lines, a record being written
+            # is read the next time
+            with open(self.path, 'ab') as f:
+                f.write(u''.join(lines).encode('utf-8'))
+        metrics.count('wiki_changelog_records_total', len(lines))
+        return generation
+
+    def _start_over(self):
+        generation = self._last_generation()
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            # the generation keeps increasing across files
+            f.write((HEADER + u'{0}\tstart\t\n'.format(generation))
+                    .encode('utf-8'))
+        os.replace(temp, self.path)
+
+    def read(self):
+        """
+            Reads the records logged since the last call.
+
+            :returns: ``(generation, kind, url)`` tuples, or ``None`` if
+                the log was started over and anything could have
+                changed
+            :rtype: list
+        """
+        stat = self._stat()
+        if stat is None:
+            return []
+        if stat.st_ino == self._ino and stat.st_size == self._offset:
+            return []
+        with self._read_lock:
+            return self._read()
+
+    def _read(self):
+        stat = self._stat()
+        if stat is None:
+            return []
+        if self._ino is not None and (stat.st_ino != self._ino or
+                                      stat.st_size < self._offset):
+            self._ino = None
+            self._offset = 0
+            self.seek_end()
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read(stat.st_size - self._offset)
+        except (IOError, OSError):
+            return []
+        # a record being written right now is read next time
+        end = data.rfind(b'\n') + 1
+        self._ino = stat.st_ino
+        self._offset += end
+        records = []
+        for line in data[:end].decode('utf-8').splitlines():
+            parts = line.split(u'\t', 2)
+            if len(parts) != 3 or parts[1] not in (SAVED, REMOVED):
+                continue
+            self.generation = int(parts[0])
+            records.append((self.generation, parts[1], parts[2]))
+        return records
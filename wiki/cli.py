@@ -5,6 +5,9 @@
 import os
 
 import click
+from wiki import maintenance as git_maintenance
+from wiki import related
+from wiki.core import Wiki
 from wiki.web import create_app
 
 @click.group()
@@ -37,3 +40,51 @@ def web(ctx, debug):
     """
     app = create_app(ctx.meta['directory'])
     app.run(debug=debug)
+
+
+@main.command()
+@click.option('--force/--no-force', default=False,
+              help='Repack all objects, even if it is not due.')
+@click.pass_context
+def maintenance(ctx, force):
+    """
+        Maintain the git repository of the wiki.
+
+        \b
+        :param bool force: whether to repack all objects, even if there
+            are only a few loose objects.
+    """
+    directory = ctx.meta['directory']
+    if not os.path.isdir(os.path.join(directory, '.git')):
+        raise click.UsageError('{0} is no git repository.'.format(directory))
+    report = git_maintenance.run_due(directory, 0, force=force)
+    if report is None:
+        raise click.ClickException('Maintenance is running already.')
+    click.echo(report.format())
+    if report.failed:
+        ctx.exit(1)
+
+
+@main.command()
+@click.option('--threshold', type=float, default=0.9, show_default=True,
+              help='Minimum similarity of the words of two pages.')
+@click.pass_context
+def duplicates(ctx, threshold):
+    """
+        List pages which are nearly the same.
+
+        \b
+        :param float threshold: the minimum cosine similarity of the
+            words of two pages, 1.0 for the same words.
+    """
+    directory = ctx.meta['directory']
+    create_app(directory)
+    pairs = Wiki(directory).duplicates(threshold)
+    if pairs is None and not related.available():
+        raise click.ClickException(
+            'Finding duplicates needs numpy (pip install wiki2[related]).')
+    if pairs is None:
+        raise click.ClickException('Related pages are disabled, '
+                                   'RELATED_PAGES is 0.')
+    for url, other, score in pairs:
+        click.echo(u'{0:.3f}  {1}  {2}'.format(score, url, other))
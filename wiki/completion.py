@@ -0,0 +1,164 @@
+"""
+    Completion
+    ~~~~~~~~~~
+
+    Prefix and subsequence matching over page titles and urls, backed
+    by a sorted array of lower cased keys.
+
+    Prefix matches are a binary search followed by a walk over the
+    matching range. Subsequence matches (``dplhw`` finds
+    ``deploy howto``) are restricted to keys starting with the same
+    character, which form a contiguous range of the array as well. The
+    keys of such a range are joined into one string, so a single
+    regular expression scan finds all matches in C instead of testing
+    every key in python.
+"""
+from bisect import bisect_left
+import re
+
+
+class Completer(object):
+    """
+        Completes page titles and urls.
+    """
+
+    def __init__(self):
+        #: sorted lower cased keys and the url each key belongs to
+        self.keys = []
+        self.urls = []
+        #: url -> (title, keys)
+        self.pages = {}
+        #: added ``(key, url)`` pairs not merged into the arrays yet
+        self._pending = []
+        #: first character -> (joined keys, start offsets, first index)
+        self._ranges = {}
+
+    def __len__(self):
+        return len(self.pages)
+
+    @staticmethod
+    def page_keys(url, title):
+        keys = set([url.lower(), title.lower()])
+        if '/' in url:
+            keys.add(url.rsplit('/', 1)[1].lower())
+        return sorted(key for key in keys if key)
+
+    def add(self, url, title):
+        """
+            Adds a page, or updates its title.
+        """
+        title = title or url
+        current = self.pages.get(url)
+        if current is not None and current[0] == title:
+            return
+        self.remove(url)
+        keys = self.page_keys(url, title)
+        self.pages[url] = (title, keys)
+        self._pending.extend((key, url) for key in keys)
+
+    def remove(self, url):
+        page = self.pages.pop(url, None)
+        if page is None:
+            return
+        self._merge()
+        for key in page[1]:
+            i = bisect_left(self.keys, key)
+            while self.urls[i] != url:
+                i += 1
+            del self.keys[i]
+            del self.urls[i]
+            self._ranges.pop(key[0], None)
+
+    def _merge(self):
+        """
+            Merges pending additions into the sorted arrays: one by one
+            for a few of them, by sorting everything for bulk loads.
+        """
+        pending, self._pending = self._pending, []
+        if len(pending) <= 32:
+            for key, url in pending:
+                i = bisect_left(self.keys, key)
+                while (i < len(self.keys) and self.keys[i] == key and
+                       self.urls[i] < url):
+                    i += 1
+                self.keys.insert(i, key)
+                self.urls.insert(i, url)
+                self._ranges.pop(key[0], None)
+            return
+        pairs = sorted(list(zip(self.keys, self.urls)) + pending)
+        self.keys = [key for key, _ in pairs]
+        self.urls = [url for _, url in pairs]
+        self._ranges.clear()
+
+    def dump(self):
+        """
+            Returns the state of the completer as plain lists and
+            dicts, see :meth:`load`.
+        """
+        if self._pending:
+            self._merge()
+        return self.keys, self.urls, self.pages
+
+    @classmethod
+    def load(cls, state):
+        completer = cls()
+        completer.keys, completer.urls, completer.pages = state
+        return completer
+
+    def _range(self, char):
+        cached = self._ranges.get(char)
+        if cached is None:
+            start = bisect_left(self.keys, char)
+            end = bisect_left(self.keys, chr(ord(char) + 1))
+            offsets = []
+            position = 0
+            for key in self.keys[start:end]:
+                offsets.append(position)
+                position += len(key) + 1
+            cached = self._ranges[char] = (
+                u'\n'.join(self.keys[start:end]), offsets, start)
+        return cached
+
+    def complete(self, query, limit=10):
+        """
+            Completes the given query.
+
+            :param str query: what the user typed so far
+            :param int limit: the maximum number of results
+
+            :returns: ``(url, title, kind)`` tuples, prefix matches
+                first, ``kind`` is ``'prefix'`` or ``'subsequence'``
+            :rtype: list
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        if self._pending:
+            self._merge()
+        results = []
+        seen = set()
+
+        def add(index, kind):
+            url = self.urls[index]
+            if url not in seen:
+                seen.add(url)
+                results.append((url, self.pages[url][0], kind))
+
+        i = bisect_left(self.keys, query)
+        while (i < len(self.keys) and len(results) < limit and
+               self.keys[i].startswith(query)):
+            add(i, 'prefix')
+            i += 1
+        if len(results) >= limit or len(query) < 2:
+            return results
+        text, offsets, start = self._range(query[0])
+        # taking the first occurrence of every character is always
+        # right for subsequences, so negated classes avoid backtracking
+        pattern = u'^' + re.escape(query[0]) + u''.join(
+            u'[^{0}\\n]*{0}'.format(re.escape(c))
+            for c in query[1:])
+        for match in re.finditer(pattern, text, re.M):
+            add(start + bisect_left(offsets, match.start()), 'subsequence')
+            if len(results) >= limit:
+                break
+        return results
@@ -3,13 +3,32 @@
     ~~~~~~~~~
 """
 from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
 from io import open
 import os
 import re
+import threading
+import uuid
 
 from flask import abort
+from flask import current_app
+from flask import has_app_context
 from flask import url_for
 import markdown
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markupsafe import escape
+from markupsafe import Markup
+
+from wiki import highlight
+from wiki import metrics
+from wiki import named_locks
+from wiki import snapshot
+from wiki.renderers import get_renderer
+from wiki.watcher import stat_key
+
+
+highlight.install()
 
 
 def clean_url(url):
@@ -33,6 +52,13 @@ def clean_url(url):
     return url
 
 
+#: matches the wikilink syntax, see :func:`wikilink`
+LINK_RE = re.compile(
+    r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
+    re.X | re.U
+)
+
+
 def wikilink(text, url_formatter=None):
     """
         Processes Wikilink syntax "[[Link]]" within the html body.
@@ -54,19 +80,178 @@ def wikilink(text, url_formatter=None):
     """
     if url_formatter is None:
         url_formatter = url_for
-    link_regex = re.compile(
-        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
-        re.X | re.U
-    )
-    for i in link_regex.findall(text):
-        title = [i[-1] if i[-1] else i[1]][0]
-        url = clean_url(i[1])
-        html_url = u"<a href='{0}'>{1}</a>".format(
-            url_formatter('display', url=url),
+
+    def link(match):
+        title = match.group(4) or match.group(2)
+        url = clean_url(match.group(2))
+        return u"<a href='{0}'>{1}</a>".format(
+            url_formatter('wiki.display', url=url),
             title
         )
-        text = re.sub(link_regex, html_url, text, count=1)
-    return text
+    # a single pass, instead of searching the text again for every link
+    return LINK_RE.sub(link, text)
+
+
+def links(text):
+    """
+        Returns the urls of all wikilinks in a text.
+
+        :rtype: set
+    """
+    return set(clean_url(match[1]) for match in LINK_RE.findall(text))
+
+
+#: matches the include syntax, see :func:`transclude`
+INCLUDE_RE = re.compile(r'\{\{include:\s*([^{}\n]+?)\s*\}\}')
+_FENCE_RE = re.compile(r'^[ ]{0,3}(```|~~~)')
+
+#: how deep included pages may include further pages
+MAX_INCLUDE_DEPTH = 10
+
+#: how many includes a page may expand, nested ones included
+MAX_INCLUDES = 100
+
+#: how many characters of included pages a page may expand
+MAX_INCLUDE_SIZE = 1024 * 1024
+
+_render = threading.local()
+
+
+class RenderContext(object):
+    """
+        What the preprocessors need to know about the page being
+        rendered by the current thread, see :func:`render_context`.
+
+        :param engine: the engine included pages are loaded from
+        :param str url: the url of the page being rendered, if any
+    """
+
+    def __init__(self, engine, url=None):
+        self.engine = engine
+        #: the pages being included, the rendered page first
+        self.stack = [url] if url else []
+        #: the urls of all pages the rendering included or tried to,
+        #: directly or not
+        self.depends = set()
+        #: the number of includes expanded so far
+        self.includes = 0
+        #: the number of characters included so far
+        self.size = 0
+        #: url -> :func:`~wiki.watcher.stat_key` of the loaded pages,
+        #: taken before they were read, ``None`` if they are missing
+        self.keys = {}
+        self._texts = {}
+
+    def load(self, url):
+        """
+            :returns: the content of a page, ``None`` if it is missing
+        """
+        if url not in self._texts:
+            self.keys[url] = page_key(self.engine, url)
+            try:
+                self._texts[url] = self.engine.load(url)
+            except (IOError, OSError):
+                self._texts[url] = None
+        return self._texts[url]
+
+
+def page_key(engine, url):
+    """
+        :returns: the :func:`~wiki.watcher.stat_key` of the file of a
+            page, ``None`` if it is missing
+    """
+    try:
+        return stat_key(os.stat(engine.path(url)))
+    except OSError:
+        return None
+
+
+@contextmanager
+def render_context(engine, url=None):
+    """
+        Sets the :class:`RenderContext` of the current thread while
+        rendering, so :func:`transclude` can load included pages.
+
+        :returns: a context manager yielding the context
+    """
+    previous = getattr(_render, 'context', None)
+    context = _render.context = RenderContext(engine, url)
+    try:
+        yield context
+    finally:
+        _render.context = previous
+
+
+def current_render_context():
+    """
+        :returns: the :class:`RenderContext` of the current thread,
+            ``None`` if no page is being rendered
+    """
+    return getattr(_render, 'context', None)
+
+
+def transclude(text):
+    """
+        Replaces "{{include:url}}" in the body of a page with the body
+        of that page, which can include pages itself. Includes in
+        fenced code are left alone, loops and missing pages are
+        replaced by a note. So are includes beyond
+        :data:`MAX_INCLUDES` or :data:`MAX_INCLUDE_SIZE` characters,
+        pages including a page many times over cannot grow
+        exponentially.
+
+        Pages are loaded from the engine of the
+        :func:`current_render_context`, without one the text is
+        returned as it is.
+
+        :param str text: the raw page content, with metadata
+        :returns: the content with the includes expanded
+        :rtype: str
+    """
+    context = current_render_context()
+    if context is None or u'{{include:' not in text:
+        return text
+    header, separator, body = text.partition(u'\n\n')
+    return header + separator + _expand(context, body)
+
+
+def _expand(context, body):
+    lines = body.split(u'\n')
+    fenced = False
+    for index, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            fenced = not fenced
+        elif not fenced and u'{{include:' in line:
+            lines[index] = INCLUDE_RE.sub(
+                lambda match: _include(context, match.group(1)), line)
+    return u'\n'.join(lines)
+
+
+def _include(context, target):
+    url = clean_url(target)
+    if not url or any(part in (u'.', u'..') for part in url.split(u'/')):
+        return u'*Invalid include: {0}*'.format(target)
+    context.depends.add(url)
+    if url in context.stack:
+        return u'*Include loop: {0}*'.format(url)
+    if len(context.stack) > MAX_INCLUDE_DEPTH:
+        return u'*Includes nested too deeply: {0}*'.format(url)
+    if context.includes >= MAX_INCLUDES:
+        return u'*Too many includes: {0}*'.format(url)
+    text = context.load(url)
+    if text is None:
+        return u'*Included page not found: {0}*'.format(url)
+    body = text.partition(u'\n\n')[2]
+    if context.size + len(body) > MAX_INCLUDE_SIZE:
+        return u'*Included pages too large: {0}*'.format(url)
+    context.includes += 1
+    context.size += len(body)
+    metrics.count('wiki_includes_total')
+    context.stack.append(url)
+    try:
+        return _expand(context, body).rstrip(u'\n')
+    finally:
+        context.stack.pop()
 
 
 def highlite_diff(raw_diff):
@@ -78,6 +263,253 @@ def highlite_diff(raw_diff):
     return html
 
 
+META_RE = re.compile(r'^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)')
+META_MORE_RE = re.compile(r'^[ ]{4,}(?P<value>.*)')
+#: metadata keys which are read back as they are written
+META_KEY_RE = re.compile(r'[A-Za-z0-9_-]+\Z')
+
+
+def split_meta(text):
+    """
+        Splits raw page content into its metadata and body without
+        rendering any markdown. The metadata is interpreted the same
+        way the markdown meta extension does it.
+
+        :param str text: the raw page content
+
+        :returns: the metadata and the body
+        :rtype: tuple
+    """
+    header, _, body = text.partition(u'\n\n')
+    meta = OrderedDict()
+    key = None
+    for line in header.split(u'\n'):
+        match = META_RE.match(line)
+        if match:
+            key = match.group('key').lower()
+            value = match.group('value').strip()
+            # repeated keys are collected like continuation lines
+            meta[key] = (u'\n'.join((meta[key], value)) if key in meta
+                         else value)
+            continue
+        match = META_MORE_RE.match(line)
+        if match and key is not None:
+            meta[key] = u'\n'.join((meta[key], match.group('value').strip()))
+    return meta, body
+
+
+#: list items and quotes continue after blank lines
+LIST_RE = re.compile(r'^[ ]{0,3}(?:[*+-]|\d+\.)[ ]')
+QUOTE_RE = re.compile(r'^[ ]{0,3}>')
+
+#: reference definitions and raw html blocks affect the whole document
+DOCUMENT_RE = re.compile(r'^[ ]{0,3}(?:\[[^\]]*\]:|<)', re.M)
+
+
+def _continues(lines, line):
+    if line.startswith(u' '):
+        return True
+    for regex in (LIST_RE, QUOTE_RE):
+        if regex.match(line) and any(regex.match(l) for l in lines):
+            return True
+    return False
+
+
+def split_blocks(text, tab_length=4):
+    """
+        Splits a markdown document into top level blocks that render to
+        the same html on their own as within the whole document. Blocks
+        are separated by blank lines, unless the next lines could
+        continue the previous block (indented lines, list items,
+        quotes) or the blank line is part of a fenced code block.
+
+        :param str text: the markdown, without metadata
+
+        :returns: the blocks, or ``None`` if the document has to be
+            rendered as a whole
+        :rtype: list
+    """
+    if u'\x02' in text or u'\x03' in text:
+        # used by markdown internally
+        return None
+    # normalized like markdown does it, so blank lines are empty
+    text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    text = re.sub(u'(?m)^ +$', u'', text.expandtabs(tab_length))
+    spans = [match.span() for match in
+             FencedBlockPreprocessor.FENCED_BLOCK_RE.finditer(text)]
+    outside = text
+    for start, end in reversed(spans):
+        outside = outside[:start] + outside[end:]
+    if DOCUMENT_RE.search(outside):
+        return None
+    blocks = []
+    current = []
+    blanks = 0
+    position = 0
+    spans = iter(spans)
+    span = next(spans, None)
+    for line in text.split(u'\n'):
+        start = position
+        position += len(line) + 1
+        while span is not None and span[1] <= start:
+            span = next(spans, None)
+        fenced = span is not None and span[0] <= start
+        if not line and not fenced:
+            blanks += 1
+            continue
+        if blanks and current:
+            if fenced or not _continues(current, line):
+                blocks.append(u'\n'.join(current))
+                current = []
+            else:
+                current.extend([u''] * blanks)
+        blanks = 0
+        current.append(line)
+    if current:
+        blocks.append(u'\n'.join(current))
+    return blocks
+
+
+def write_atomic(path, data):
+    """
+        Replaces a file, readers see either the old or the complete new
+        content, and after a crash one of them is on disk.
+
+        :param bytes data: the new content
+    """
+    # created like open() does, so the permissions follow the umask
+    temp = u'{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    try:
+        # makes the rename itself durable
+        folder = os.open(os.path.dirname(path), os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(folder)
+    except OSError:
+        pass
+    finally:
+        os.close(folder)
+
+
+def blob_sha(data):
+    """
+        The sha git gives a file with the given content, computed like
+        ``git hash-object`` does, without git.
+
+        :param bytes data: the content of the file
+        :rtype: str
+    """
+    return hashlib.sha1(
+        b'blob ' + str(len(data)).encode('ascii') + b'\0' + data).hexdigest()
+
+
+def block_key(block):
+    """
+        The cache key of a block of markdown.
+    """
+    return hashlib.sha1(block.encode('utf-8')).hexdigest()
+
+
+class Snippet(object):
+    """
+        A line of a page matching a search, with the matches
+        highlighted when rendered as HTML.
+    """
+
+    #: snippets longer than this are cut around the first match
+    width = 160
+
+    def __init__(self, lineno, text, regex=None):
+        self.lineno = lineno
+        text = text.strip()
+        spans = []
+        if regex is not None:
+            spans = [m.span() for m in regex.finditer(text)
+                     if m.end() > m.start()]
+        if len(text) > self.width:
+            start = max(0, spans[0][0] - self.width // 4) if spans else 0
+            end = start + self.width
+            spans = [(max(a, start) - start, min(b, end) - start)
+                     for a, b in spans if b > start and a < end]
+            text = text[start:end]
+        self.text = text
+        self.spans = spans
+
+    def __html__(self):
+        html = []
+        position = 0
+        for start, end in self.spans:
+            html.append(escape(self.text[position:start]))
+            html.append(Markup(u'<mark>%s</mark>') % self.text[start:end])
+            position = end
+        html.append(escape(self.text[position:]))
+        return Markup(u'').join(html)
+
+
+class SearchResult(object):
+    """
+        A page matching a search. Carries everything needed to display
+        the hit without loading or rendering the page itself.
+    """
+
+    #: how many snippets are kept per page
+    max_snippets = 3
+
+    def __init__(self, url, title=None):
+        self.url = url
+        self.title = title or url
+        self.count = 0
+        self.snippets = []
+
+    def __repr__(self):
+        return u"<SearchResult: {} ({})>".format(self.url, self.count)
+
+    def add_match(self, lineno, text, regex=None):
+        self.count += 1
+        if len(self.snippets) < self.max_snippets:
+            self.snippets.append(Snippet(lineno, text, regex))
+
+
+def match_page(url, text, regex, attrs=('title', 'tags', 'body')):
+    """
+        Searches the raw content of a page.
+
+        :param str url: the url of the page
+        :param str text: the raw page content
+        :param regex: the compiled search expression
+        :param attrs: which parts of the page to search in
+
+        :returns: the search result or ``None`` if nothing matched
+        :rtype: SearchResult
+    """
+    meta, body = split_meta(text)
+    result = SearchResult(url, meta.get('title'))
+    if 'title' in attrs and regex.search(result.title):
+        result.add_match(1, result.title, regex)
+    if 'tags' in attrs and regex.search(meta.get('tags', u'')):
+        result.add_match(1, meta['tags'], regex)
+    if 'body' in attrs and regex.search(body):
+        offset = text.count(u'\n', 0, len(text) - len(body)) + 1
+        for lineno, line in enumerate(body.split(u'\n'), offset):
+            if regex.search(line):
+                result.add_match(lineno, line, regex)
+    return result if result.count else None
+
+
 class Processor(object):
     """
         The processor handles the processing of file content into
@@ -87,21 +519,22 @@ class Processor(object):
         cases.
     """
 
-    preprocessors = []
+    preprocessors = [transclude]
     postprocessors = [wikilink]
 
-    def __init__(self, text):
+    def __init__(self, text, renderer=None):
         """
             Initialization of the processor.
 
             :param str text: the text to process
+            :param str renderer: the name of the markdown renderer, see
+                :mod:`wiki.renderers`, defaults to ``MARKDOWN_RENDERER``
+                of the current application
         """
-        self.md = markdown.Markdown([
-            'codehilite',
-            'fenced_code',
-            'meta',
-            'tables'
-        ])
+        if renderer is None and has_app_context():
+            renderer = current_app.config.get('MARKDOWN_RENDERER')
+        self.renderer_name = renderer
+        self._renderer = None
         self.input = text
         self.markdown = None
         self.meta_raw = None
@@ -111,6 +544,14 @@ class Processor(object):
         self.final = None
         self.meta = None
 
+    @property
+    def renderer(self):
+        # created on first use, cached renderings do not need it
+        if self._renderer is None:
+            self._renderer = get_renderer(self.renderer_name)
+        return self._renderer
+
+    @metrics.timed('pre')
     def process_pre(self):
         """
             Content preprocessor.
@@ -120,12 +561,15 @@ class Processor(object):
             current = processor(current)
         self.pre = current
 
+    @metrics.timed('markdown')
     def process_markdown(self):
         """
-            Convert to HTML.
-        """
-        self.html = self.md.convert(self.pre)
+            Convert the markdown to HTML.
 
+            .. warning:: Can only be called after :meth:`split_raw` was
+                called.
+        """
+        self.html = self.renderer.convert(self.markdown)
 
     def split_raw(self):
         """
@@ -133,24 +577,17 @@ class Processor(object):
         """
         self.meta_raw, self.markdown = self.pre.split('\n\n', 1)
 
+    @metrics.timed('meta')
     def process_meta(self):
         """
             Get metadata.
 
-            .. warning:: Can only be called after :meth:`html` was
+            .. warning:: Can only be called after :meth:`split_raw` was
                 called.
         """
-        # the markdown meta plugin does not retain the order of the
-        # entries, so we have to loop over the meta values a second
-        # time to put them into a dictionary in the correct order
-        self.meta = OrderedDict()
-        for line in self.meta_raw.split('\n'):
-            key = line.split(':', 1)[0]
-            # markdown metadata always returns a list of lines, we will
-            # reverse that here
-            self.meta[key.lower()] = \
-                '\n'.join(self.md.Meta[key.lower()])
+        self.meta = split_meta(self.meta_raw)[0]
 
+    @metrics.timed('post')
     def process_post(self):
         """
             Content postprocessor.
@@ -167,18 +604,103 @@ class Processor(object):
             handling.
         """
         self.process_pre()
+        self.split_raw()
+        self.process_meta()
         self.process_markdown()
+        self.process_post()
+
+        return self.final, self.markdown, self.meta
+
+    def _blocks(self):
+        if not self.renderer.blocks:
+            return None
+        return split_blocks(self.markdown, self.renderer.tab_length)
+
+    #: closes every block, so it is rendered as if more followed
+    block_end = u'wiki-block-end'
+
+    def _render_blocks(self, blocks, cache):
+        end = u'<p>%s</p>' % self.block_end
+        parts = []
+        for block in blocks:
+            key = block_key(block)
+            html = cache.get(key)
+            if html is None:
+                html = self.renderer.convert(
+                    block + u'\n\n' + self.block_end)
+                if not html.endswith(end):
+                    return None
+                html = cache[key] = html[:-len(end)]
+            parts.append(html)
+        return u''.join(parts).strip()
+
+    def block_keys(self):
+        """
+            Returns the cache keys of the blocks :meth:`process_blocks`
+            renders separately. The text is only preprocessed if it was
+            not processed yet.
+
+            :rtype: list
+        """
+        if self.markdown is None:
+            self.process_pre()
+            self.split_raw()
+        return [block_key(block) for block in self._blocks() or ()]
+
+    def process_blocks(self, cache):
+        """
+            Like :meth:`process`, but renders the top level blocks of
+            the body separately and reuses unchanged ones. Documents
+            whose blocks depend on each other are rendered as a whole.
+
+            :param dict cache: maps the :func:`block_key` of a block to
+                its html, newly rendered blocks are added
+        """
+        self.process_pre()
         self.split_raw()
+        blocks = self._blocks()
+        html = None
+        if blocks is not None:
+            with metrics.timer('markdown'):
+                html = self._render_blocks(blocks, cache)
         self.process_meta()
+        if html is None:
+            self.process_markdown()
+        else:
+            self.html = html
         self.process_post()
 
         return self.final, self.markdown, self.meta
 
 
+class ConflictError(Exception):
+    """
+        Pages changed since they were read, see :meth:`Wiki.save_many`.
+
+        :param dict conflicts: url -> the current token of the page,
+            ``None`` if it does not exist
+    """
+
+    def __init__(self, conflicts):
+        super(ConflictError, self).__init__(
+            u'Changed since read: {0}'.format(u', '.join(sorted(conflicts))))
+        self.conflicts = conflicts
+
+
+#: token of :meth:`Wiki.save_many` to overwrite a page unconditionally
+ANY = object()
+
+#: candidates of :meth:`Wiki.search` to select them with the index
+INDEXED = object()
+
+
 class Page(object):
     def __init__(self, engine, url, new=False):
         self.url = url
+        self._engine = engine
         self._meta = OrderedDict()
+        #: the :class:`~wiki.indexes.RenderCache` of the engine, if any
+        self.renders = getattr(engine, 'renders', None)
         if not new:
             self.load(engine)
             self.render()
@@ -191,7 +713,26 @@ class Page(object):
 
     def render(self):
         processor = Processor(self.content)
-        self._html, self.body, self._meta = processor.process()
+        cached = None
+        if self.renders is not None:
+            version = self.renders.version
+            cached = self.renders.get(self.url, self.content,
+                                      self._engine)
+        if cached is None:
+            with render_context(self._engine, self.url) as context:
+                processor.process()
+            if self.renders is not None:
+                self.renders.put(self.url, self.content, (
+                    processor.html, processor.markdown, processor.meta),
+                    context.depends, version, context.keys)
+        else:
+            # only the postprocessors depend on the request
+            processor.html, processor.markdown, processor.meta = cached
+            processor.process_post()
+        self._html = processor.final
+        # as written, without the included pages
+        self.body = self.content.partition(u'\n\n')[2]
+        self._meta = OrderedDict(processor.meta)
 
     def save(self, engine, update=True, author=None):
         engine.save(self.url, self.body, self._meta, author)
@@ -239,10 +780,45 @@ class Page(object):
         self['tags'] = value
 
 
+def title_key(page):
+    """
+        The sort key of the page listings.
+    """
+    return page.title.lower()
+
+
 class Wiki(object):
+    #: number of threads used by :meth:`search`, ``None`` picks one
+    #: depending on the number of CPUs
+    search_workers = None
+    #: whether :meth:`scan` uses processes instead of threads, see
+    #: :class:`~wiki.scanner.Scanner`
+    search_processes = False
+    #: number of lock files writes of pages are spread over, see
+    #: :meth:`page_lock`
+    lock_stripes = 64
+
     def __init__(self, root):
         self.root = root
 
+    @property
+    def indexes(self):
+        """
+            The process wide :class:`~wiki.indexes.WikiIndexes` of the
+            content directory.
+        """
+        # imported here as the indexes build on this module
+        from wiki.indexes import get_indexes
+        return get_indexes(self.root)
+
+    @property
+    def renders(self):
+        """
+            The render cache shared by the engines of the content
+            directory.
+        """
+        return self.indexes.renders
+
     def path(self, url):
         return os.path.join(self.root, url + '.md')
 
@@ -268,22 +844,140 @@ class Wiki(object):
             return False
         return Page(self, url, new=True)
 
+    @metrics.timed('load')
     def load(self, url):
         path = self.path(url)
         with open(path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def load_header(self, url):
+        """
+            Reads only the metadata block of a page.
+
+            :returns: the metadata and the number of header lines
+            :rtype: tuple
+        """
+        lines = []
+        with open(self.path(url), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line == u'\n':
+                    break
+                lines.append(line)
+        return split_meta(u''.join(lines))[0], len(lines)
+
+    def page_lock(self, *urls):
+        """
+            Locks pages against writes by other threads and processes,
+            pages are written in parallel unless they share a stripe.
+            Readers never lock, pages are replaced atomically.
+
+            :returns: a context manager
+        """
+        return named_locks.get_striped_lock(
+            snapshot.state_path(self.root, 'locks'),
+            self.lock_stripes)(*urls)
+
     def save(self, url, body, meta, author=None):
+        with self.page_lock(url):
+            self._write(url, body, meta)
+        self.indexes.page_saved(url)
+
+    def _write(self, url, body, meta):
+        # callers hold the page lock
         path = self.path(url)
         folder = os.path.dirname(path)
         if not os.path.exists(folder):
-            os.makedirs(folder)
-        with open(path, 'w', encoding='utf-8') as f:
-            for key, value in meta.items():
-                line = u'%s: %s\n' % (key, value)
-                f.write(line)
-            f.write(u'\n')
-            f.write(body.replace(u'\r\n', u'\n'))
+            os.makedirs(folder, exist_ok=True)
+        lines = [u'%s: %s\n' % (key, value) for key, value in meta.items()]
+        lines.append(u'\n')
+        lines.append(body.replace(u'\r\n', u'\n'))
+        with metrics.timer('write'):
+            write_atomic(path, u''.join(lines).encode('utf-8'))
+
+    def load_many(self, urls):
+        """
+            Reads many pages at once, along with their tokens for
+            :meth:`save_many`. A token is the :func:`blob_sha` of the
+            page, so it changes with every change of the content.
+
+            :returns: url -> ``(content, token)``, pages which do not
+                exist are left out
+            :rtype: OrderedDict
+        """
+        pages = OrderedDict()
+        for url in urls:
+            try:
+                with open(self.path(url), 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                continue
+            pages[url] = (data.decode('utf-8'), blob_sha(data))
+        return pages
+
+    def check_tokens(self, pages):
+        """
+            :param list pages: ``(url, token)`` tuples
+            :raises ConflictError: if a page does not have the token
+            :returns: url -> ``(content, token)`` of the pages which
+                exist, see :meth:`load_many`
+            :rtype: OrderedDict
+        """
+        current = Wiki.load_many(self, [url for url, _ in pages])
+        conflicts = {}
+        for url, token in pages:
+            if token is ANY:
+                continue
+            found = current.get(url, (None, None))[1]
+            if found != token:
+                conflicts[url] = found
+        if conflicts:
+            raise ConflictError(conflicts)
+        return current
+
+    def save_many(self, pages, author=None):
+        """
+            Saves many pages, if none of them changed since it was read
+            (optimistic concurrency).
+
+            :param list pages: ``(url, body, meta, token)`` tuples,
+                ``token`` is the one :meth:`load_many` returned, ``None``
+                for pages which must not exist yet or :data:`ANY`
+            :raises ConflictError: before any page is written
+            :returns: url -> the new token
+            :rtype: dict
+        """
+        self._write_many(pages)
+        return self.tokens(url for url, _, _, _ in pages)
+
+    def _write_many(self, pages):
+        """
+            Checks the tokens and writes the pages under one lock, so
+            no other write gets in between. If a write fails, the pages
+            written before are restored.
+        """
+        urls = [url for url, _, _, _ in pages]
+        with self.page_lock(*urls):
+            current = self.check_tokens([(url, token)
+                                         for url, _, _, token in pages])
+            written = []
+            try:
+                for url, body, meta, _ in pages:
+                    written.append(url)
+                    self._write(url, body, meta)
+            except (IOError, OSError):
+                for url in written:
+                    if url in current:
+                        write_atomic(self.path(url),
+                                     current[url][0].encode('utf-8'))
+                    elif os.path.exists(self.path(url)):
+                        os.remove(self.path(url))
+                raise
+        for url in urls:
+            self.indexes.page_saved(url)
+
+    def tokens(self, urls):
+        return dict((url, token) for url, (_, token)
+                    in Wiki.load_many(self, urls).items())
 
     def move(self, url, newurl):
         source = os.path.join(self.root, url) + '.md'
@@ -303,43 +997,67 @@ class Wiki(object):
         # create folder if it does not exists yet
         folder = os.path.dirname(target)
         if not os.path.exists(folder):
-            os.makedirs(folder)
-        os.rename(source, target)
+            os.makedirs(folder, exist_ok=True)
+        with self.page_lock(url, newurl):
+            os.rename(source, target)
+        self.indexes.page_removed(url)
+        self.indexes.page_saved(newurl)
 
     def delete(self, url):
         path = self.path(url)
-        if not self.exists(url):
-            return False
-        os.remove(path)
+        with self.page_lock(url):
+            try:
+                os.remove(path)
+            except OSError:
+                return False
+        self.indexes.page_removed(url)
         return True
 
-    def index(self):
+    def urls(self):
         """
-            Builds up a list of all the available pages.
+            Walks the content directory.
 
-            :returns: a list of all the wiki pages
+            :returns: the urls of all pages, in directory order
             :rtype: list
         """
         # make sure we always have the absolute path for fixing the
         # walk path
-        pages = []
+        urls = []
         root = os.path.abspath(self.root)
         for cur_dir, _, files in os.walk(root):
             # get the url of the current directory
             cur_dir_url = cur_dir[len(root)+1:]
             for cur_file in files:
-                path = os.path.join(cur_dir, cur_file)
                 if cur_file.endswith('.md'):
-                    url = clean_url(os.path.join(cur_dir_url, cur_file[:-3]))
-                    page = Page(self, url)
-                    pages.append(page)
-        return sorted(pages, key=lambda x: x.title.lower())
+                    urls.append(
+                        clean_url(os.path.join(cur_dir_url, cur_file[:-3])))
+        return urls
+
+    def index(self):
+        """
+            Builds up a list of all the available pages.
+
+            :returns: the :class:`~wiki.indexes.IndexEntry` objects of
+                all pages, sorted by title
+            :rtype: list
+        """
+        return sorted(self.indexes.get_entries(), key=title_key)
+
+    def namespace(self, prefix):
+        """
+            Lists the pages and sub namespaces of a namespace, see
+            :meth:`wiki.indexes.WikiIndexes.namespace`.
+
+            :param str prefix: ``''`` for the root, ``'a/b'`` otherwise
+            :rtype: tuple
+        """
+        return self.indexes.namespace(prefix)
 
     def index_by(self, key):
         """
             Get an index based on the given key.
 
-            Will use the metadata value of the given key to group
+            Will use the given attribute of the index entries to group
             the existing pages.
 
             :param str key: the attribute to group the index on.
@@ -350,45 +1068,118 @@ class Wiki(object):
         """
         pages = {}
         for page in self.index():
-            value = getattr(page, key)
-            pre = pages.get(value, [])
-            pages[value] = pre.append(page)
+            pages.setdefault(getattr(page, key), []).append(page)
         return pages
 
     def get_by_title(self, title):
-        pages = self.index(attr='title')
-        return pages.get(title)
+        return self.index_by('title').get(title)
 
     def get_tags(self):
-        pages = self.index()
+        """
+            Groups the pages by their tags, using the tag index.
+
+            :returns: tag -> index entries sorted by title
+            :rtype: dict
+        """
         tags = {}
-        for page in pages:
-            pagetags = page.tags.split(',')
-            for tag in pagetags:
-                tag = tag.strip()
-                if tag == '':
-                    continue
-                elif tags.get(tag):
-                    tags[tag].append(page)
-                else:
-                    tags[tag] = [page]
+        for tag, urls in self.indexes.get_tags().items():
+            tags[tag] = sorted(self.indexes.get_entries(urls), key=title_key)
         return tags
 
     def index_by_tag(self, tag):
-        pages = self.index()
-        tagged = []
-        for page in pages:
-            if tag in page.tags:
-                tagged.append(page)
-        return sorted(tagged, key=lambda x: x.title.lower())
-
-    def search(self, term, ignore_case=True, attrs=['title', 'tags', 'body']):
-        pages = self.index()
+        entries = self.indexes.get_entries(self.indexes.tagged(tag))
+        return sorted(entries, key=title_key)
+
+    def backlinks(self, url):
+        """
+            Returns the urls of the pages linking to the given page.
+
+            :rtype: list
+        """
+        return self.indexes.backlinks_of(url)
+
+    def related(self, url, limit=5):
+        """
+            Returns the pages whose bodies use the same words as the
+            given page most, see :mod:`wiki.related`.
+
+            :returns: ``(entry, score)`` tuples of
+                :class:`~wiki.indexes.IndexEntry` objects, the most
+                similar first, or ``None`` without numpy
+            :rtype: list
+        """
+        return self.indexes.related_pages(url, limit)
+
+    def duplicates(self, threshold=0.9):
+        """
+            Returns all pairs of pages which are nearly the same.
+
+            :param float threshold: the minimum cosine similarity of
+                their words, ``1.0`` for the same words
+            :returns: ``(url, url, score)`` tuples, the most similar
+                first, or ``None`` without numpy
+            :rtype: list
+        """
+        return self.indexes.duplicates(threshold)
+
+    def complete(self, query, limit=10):
+        """
+            Completes page titles and urls by prefix or subsequence.
+
+            :returns: ``(url, title, kind)`` tuples, ``kind`` is
+                ``'prefix'`` or ``'subsequence'``
+            :rtype: list
+        """
+        return self.indexes.complete(query, limit)
+
+    def candidates(self, term, ignore_case=True):
+        """
+            Selects the pages a search can match with the trigram
+            index, see :meth:`search`. The expression is not compiled,
+            invalid ones are reported by :meth:`search`.
+
+            :returns: the sorted candidate urls or ``None`` if all
+                pages have to be searched
+            :rtype: list
+        """
+        return self.indexes.candidates(
+            term, re.IGNORECASE if ignore_case else 0)
+
+    def search(self, term, ignore_case=True, attrs=['title', 'tags', 'body'],
+               limit=None, candidates=INDEXED):
+        """
+            Searches the raw content of all pages, no markdown is
+            rendered. The trigram index narrows the pages down to the
+            ones that can match, if the expression allows it.
+
+            :param str term: the regular expression to search for
+            :param bool ignore_case: whether to ignore the case
+            :param list attrs: which parts of the pages to search in
+            :param int limit: the maximum number of results
+            :param list candidates: the pages to search, as returned by
+                :meth:`candidates`, so processes without the indexes
+                can search too; ``None`` for all pages
+
+            :returns: the matching pages sorted by title
+            :rtype: list of :class:`SearchResult`
+        """
         regex = re.compile(term, re.IGNORECASE if ignore_case else 0)
-        matched = []
-        for page in pages:
-            for attr in attrs:
-                if regex.search(getattr(page, attr)):
-                    matched.append(page)
-                    break
-        return matched
+        if candidates is INDEXED:
+            candidates = self.indexes.candidates(regex.pattern, regex.flags)
+        if candidates is None:
+            candidates = self.urls()
+        return self.scan(candidates, regex, attrs, limit)
+
+    def scan(self, urls, regex, attrs=['title', 'tags', 'body'], limit=None):
+        """
+            Searches the raw content of the given pages in parallel.
+
+            :returns: the matching pages sorted by title
+            :rtype: list of :class:`SearchResult`
+        """
+        # imported here as the scanner builds on this module
+        from wiki.scanner import Scanner
+        scanner = Scanner(self.root, workers=self.search_workers,
+                          processes=self.search_processes)
+        matched = scanner.scan(urls, regex, attrs, limit)
+        return sorted(matched, key=lambda x: x.title.lower())
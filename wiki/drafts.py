@@ -0,0 +1,186 @@
+"""
+    Drafts
+    ~~~~~~
+
+    Autosaved edits, per user and page, kept outside the repository so
+    they never end up in the history of a git backed wiki and never
+    take its lock. Only saving a page writes it.
+
+    Every draft is a small json file in a folder per user, both named
+    by hashes, so neither user names nor urls have to be valid file
+    names. Editors send their changes every few seconds while typing,
+    :class:`DraftStore` writes a draft at most every ``interval``
+    seconds and keeps the latest version in memory in between. Drafts
+    are limited in size, in number per user (the oldest ones are
+    dropped) and in age.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from wiki import metrics
+from wiki.core import write_atomic
+
+
+class DraftTooLarge(Exception):
+    pass
+
+
+def _name(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+class DraftStore(object):
+    """
+        The drafts of a wiki.
+
+        :param str directory: where the drafts are kept, created if
+            needed
+        :param float interval: seconds between two writes of the same
+            draft
+        :param int max_size: the maximum size of a draft in bytes
+        :param int max_count: the maximum number of drafts of a user
+        :param float max_age: seconds after which drafts are dropped
+    """
+
+    def __init__(self, directory, interval=5.0, max_size=256 * 1024,
+                 max_count=50, max_age=30 * 24 * 3600):
+        self.directory = directory
+        self.interval = interval
+        self.max_size = max_size
+        self.max_count = max_count
+        self.max_age = max_age
+        #: the process the timers run in
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        #: (user, url) -> the draft not written yet
+        self._pending = {}
+        #: (user, url) -> the timer writing it
+        self._timers = {}
+        #: (user, url) -> when it was written last
+        self._written = {}
+
+    def path(self, user, url):
+        return os.path.join(self.directory, _name(user), _name(url) + '.json')
+
+    def put(self, user, url, draft):
+        """
+            Stores the draft of a page, now or once ``interval`` seconds
+            passed since it was written last.
+
+            :param dict draft: json serializable
+            :raises DraftTooLarge: if it is bigger than ``max_size``
+        """
+        draft = dict(draft, url=url, saved=time.time())
+        data = json.dumps(draft).encode('utf-8')
+        if len(data) > self.max_size:
+            raise DraftTooLarge(u'The draft is larger than {0} bytes.'.format(
+                self.max_size))
+        key = (user, url)
+        with self.lock:
+            self._pending[key] = data
+            if key in self._timers:
+                # written by the timer
+                metrics.count('wiki_drafts_total', operation='coalesced')
+                return
+            written = self._written.get(key)
+            since = None if written is None else metrics.clock() - written
+            if since is not None and since < self.interval:
+                timer = self._timers[key] = threading.Timer(
+                    self.interval - since, self.flush, (key,))
+                timer.daemon = True
+                timer.start()
+                return
+            self._write(key)
+
+    def flush(self, key=None):
+        """
+            Writes a pending draft, all of them by default.
+        """
+        with self.lock:
+            keys = [key] if key is not None else list(self._pending)
+            for key in keys:
+                timer = self._timers.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+                self._write(key)
+
+    def _write(self, key):
+        data = self._pending.pop(key, None)
+        if data is None:
+            return
+        path = self.path(*key)
+        folder = os.path.dirname(path)
+        fresh = not os.path.exists(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        with metrics.timer('drafts'):
+            write_atomic(path, data)
+        now = metrics.clock()
+        self._written[key] = now
+        if len(self._written) > 1024:
+            self._written = dict(
+                (k, written) for k, written in self._written.items()
+                if now - written < self.interval)
+        metrics.count('wiki_drafts_total', operation='written')
+        if fresh:
+            self._limit(folder)
+
+    def _limit(self, folder):
+        # oldest first
+        drafts = []
+        for name in os.listdir(folder):
+            if name.endswith('.json'):
+                try:
+                    drafts.append((os.stat(os.path.join(folder, name))
+                                   .st_mtime, name))
+                except OSError:
+                    continue
+        drafts.sort()
+        cutoff = time.time() - self.max_age
+        for index, (mtime, name) in enumerate(drafts):
+            if mtime >= cutoff and len(drafts) - index <= self.max_count:
+                break
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+            metrics.count('wiki_drafts_total', operation='dropped')
+
+    def get(self, user, url):
+        """
+            :returns: the draft of a page, ``None`` if there is none
+            :rtype: dict
+        """
+        with self.lock:
+            data = self._pending.get((user, url))
+        if data is None:
+            path = self.path(user, url)
+            try:
+                if time.time() - os.stat(path).st_mtime > self.max_age:
+                    return None
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def discard(self, user, url):
+        """
+            Drops the draft of a page, like after it was saved.
+        """
+        key = (user, url)
+        with self.lock:
+            self._pending.pop(key, None)
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            try:
+                os.remove(self.path(user, url))
+            except OSError:
+                pass
@@ -0,0 +1,196 @@
+"""
+    Highlighting cache
+    ~~~~~~~~~~~~~~~~~~
+
+    Pygments highlighting (and guessing the language of unlabeled code)
+    dominates the rendering time of pages with code blocks, and the
+    same snippets show up on many pages, in previews of the page being
+    edited and in diffs. :func:`install` makes the ``codehilite``
+    markdown extension, used by :class:`~wiki.core.Processor` and
+    :func:`~wiki.core.highlite_diff`, look highlighted html up in a
+    process wide cache first.
+
+    The cache is a bounded in-memory LRU, optionally backed by a
+    directory on disk which is shared by all processes using it, like
+    the preview worker processes. Entries are keyed by a hash of the
+    code, the language and all highlighting options, as well as the
+    versions of markdown and Pygments.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+import markdown
+from markdown.extensions import codehilite
+
+from wiki import metrics
+
+try:
+    import pygments
+    PYGMENTS_VERSION = pygments.__version__
+except ImportError:
+    PYGMENTS_VERSION = None
+
+MARKDOWN_VERSION = markdown.__version__
+if not isinstance(MARKDOWN_VERSION, str):
+    # markdown 2 has a version module
+    MARKDOWN_VERSION = MARKDOWN_VERSION.version
+
+
+class HighlightCache(object):
+    """
+        Highlighted html by key.
+
+        :param int size: the maximum number of entries kept in memory
+        :param str directory: an optional directory to store entries
+            in, so other processes can use them
+        :param int max_files: the directory is pruned to that many
+            entries, the least recently written are removed first
+    """
+
+    def __init__(self, size=1024, directory=None, max_files=10000):
+        self.size = size
+        self.directory = directory
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._writes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(*parts):
+        """
+            Builds a key from the given parts, which have to have a
+            stable ``repr``.
+        """
+        parts = (MARKDOWN_VERSION, PYGMENTS_VERSION) + parts
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.html')
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                metrics.count('wiki_highlight_cache_total', result='hit')
+                return html
+        if self.directory:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    html = f.read().decode('utf-8')
+            except (IOError, OSError):
+                pass
+            else:
+                metrics.count('wiki_highlight_cache_total', result='disk')
+                self._remember(key, html)
+                return html
+        metrics.count('wiki_highlight_cache_total', result='miss')
+        return None
+
+    def _remember(self, key, html):
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def put(self, key, html):
+        self._remember(key, html)
+        if self.directory:
+            try:
+                self._store(key, html)
+            except (IOError, OSError):
+                # the cache directory is optional
+                pass
+
+    def _store(self, key, html):
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        # written to a temporary file first, so other processes never
+        # read a partial entry
+        fd, temp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(html.encode('utf-8'))
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """
+            Removes the oldest entries of the directory beyond
+            :attr:`max_files`.
+        """
+        files = []
+        for folder in os.listdir(self.directory):
+            folder = os.path.join(self.directory, folder)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    files.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    continue
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+#: the cache used by the ``codehilite`` extension
+CACHE = HighlightCache()
+
+
+def configure(size=1024, directory=None):
+    """
+        Sets the size and the directory of the process wide cache.
+    """
+    CACHE.size = size
+    CACHE.directory = directory
+
+
+_hilite = codehilite.CodeHilite.hilite
+
+
+def cached_hilite(self, *args, **kwargs):
+    """
+        Replacement of :meth:`CodeHilite.hilite` looking the result up
+        in :data:`CACHE` first.
+    """
+    key = CACHE.key(
+        self.src, self.lang, self.linenums, self.guess_lang,
+        self.css_class, self.style, self.noclasses, self.hl_lines,
+        self.use_pygments, getattr(self, 'tab_length', None),
+        args, sorted(kwargs.items()))
+    html = CACHE.get(key)
+    if html is None:
+        with metrics.timer('highlight'):
+            html = _hilite(self, *args, **kwargs)
+        CACHE.put(key, html)
+    return html
+
+
+def install():
+    """
+        Makes the ``codehilite`` extension use :data:`CACHE`.
+    """
+    codehilite.CodeHilite.hilite = cached_hilite
@@ -0,0 +1,336 @@
+"""
+    History
+    ~~~~~~~
+
+    Reading the history of a git backed wiki. ``git log`` output is
+    parsed line by line while git is still writing it, so only as many
+    commits as are shown are ever read, and git is stopped as soon as
+    enough commits came in.
+
+    ``git blame --porcelain`` output is parsed the same way, into
+    :class:`BlameSection` objects per heading of the page, so the blame
+    view can render long pages one section at a time.
+
+    The history only changes when ``HEAD`` moves, results are cached in
+    a process wide :class:`LogCache` keyed by the sha of ``HEAD`` (see
+    :func:`~wiki.snapshot.generation`, which reads it without starting
+    git), so repeated requests do not start git at all.
+"""
+from collections import OrderedDict
+import codecs
+import datetime
+import re
+import threading
+
+from wiki import metrics
+
+
+#: starts every commit line of the log, file lines never do
+COMMIT_MARKER = u'\x1e'
+
+#: ``--format`` of the commit lines, see :meth:`Change.from_log`
+LOG_FORMAT = '%x1e%H%x00%h%x00%at%x00%an%x00%s'
+
+
+def unquote(path):
+    """
+        Decodes a path git quoted because of special characters, like
+        ``"caf\\303\\251.md"``.
+    """
+    if not path.startswith(u'"') or not path.endswith(u'"'):
+        return path
+    raw = codecs.escape_decode(path[1:-1].encode('utf-8'))[0]
+    return raw.decode('utf-8', 'replace')
+
+
+def path_to_url(path):
+    """
+        :returns: the url of a page file, ``None`` for other files
+    """
+    path = unquote(path)
+    if not path.endswith(u'.md'):
+        return None
+    return path[:-3]
+
+
+class FileChange(object):
+    """
+        A page changed by a commit.
+
+        :param str status: ``A``, ``M``, ``D``, ``R`` (moved) or ``C``
+            (copied)
+        :param str url: the url of the page after the commit
+        :param str old_url: the url before the commit if the page was
+            moved or copied
+    """
+
+    __slots__ = ('status', 'url', 'old_url')
+
+    def __init__(self, status, url, old_url=None):
+        self.status = status
+        self.url = url
+        self.old_url = old_url
+
+    def __repr__(self):
+        return u'<FileChange: {0} {1}>'.format(self.status, self.url)
+
+    @property
+    def deleted(self):
+        return self.status == u'D'
+
+
+class Change(object):
+    """
+        A commit with the pages it changed.
+    """
+
+    __slots__ = ('sha', 'commit', 'time', 'timestamp', 'author', 'subject',
+                 'files')
+
+    def __init__(self, sha, commit, timestamp, author, subject):
+        self.sha = sha
+        #: the abbreviated sha, like :attr:`WikiGit.Commit.commit`
+        self.commit = commit
+        #: seconds since the epoch
+        self.time = int(timestamp)
+        self.timestamp = datetime.datetime.fromtimestamp(self.time)
+        self.author = author
+        self.subject = subject
+        #: :class:`FileChange` objects
+        self.files = []
+
+    def __repr__(self):
+        return u'<Change: {0}>'.format(self.commit)
+
+    @property
+    def updated(self):
+        """
+            The commit time in UTC as RFC 3339, like feeds need it.
+        """
+        return datetime.datetime.fromtimestamp(
+            self.time, datetime.timezone.utc).isoformat()
+
+    @classmethod
+    def from_log(cls, line):
+        """
+            Creates a change from a commit line written with
+            :data:`LOG_FORMAT`, without the marker.
+        """
+        sha, commit, timestamp, author, subject = line.split(u'\0', 4)
+        return cls(sha, commit, timestamp, author, subject)
+
+    def add(self, line):
+        """
+            Adds a ``--name-status`` line, ignoring files which are no
+            pages.
+        """
+        parts = line.split(u'\t')
+        status = parts[0][:1]
+        url = path_to_url(parts[-1])
+        if url is None:
+            return
+        old_url = path_to_url(parts[1]) if len(parts) > 2 else None
+        self.files.append(FileChange(status, url, old_url))
+
+
+def parse_log(lines):
+    """
+        Parses ``git log --name-status --format=<LOG_FORMAT>`` output
+        incrementally.
+
+        :param lines: an iterable of (byte) lines, like the ``stdout``
+            of a running git process
+        :returns: a generator of :class:`Change` objects, each one is
+            yielded as soon as the next commit line was read
+    """
+    change = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip(u'\n')
+        if line.startswith(COMMIT_MARKER):
+            if change is not None:
+                yield change
+            change = Change.from_log(line[1:])
+        elif line and change is not None:
+            change.add(line)
+    if change is not None:
+        yield change
+
+
+#: the sha git blames lines which are not committed yet on
+UNCOMMITTED = u'0' * 40
+
+_BLAME_LINE = re.compile(r'^([0-9a-f]{40}) (\d+) (\d+)(?: \d+)?$')
+_HEADING = re.compile(r'^#{1,6}\s+(.*?)[\s#]*$')
+_FENCE = re.compile(r'^(```|~~~)')
+
+
+class BlameCommit(object):
+    """
+        The commit lines are blamed on.
+    """
+
+    __slots__ = ('sha', 'commit', 'author', 'time', 'timestamp', 'summary')
+
+    def __init__(self, sha):
+        self.sha = sha
+        self.commit = sha[:7]
+        self.author = u''
+        self.time = 0
+        self.timestamp = None
+        self.summary = u''
+
+    def __repr__(self):
+        return u'<BlameCommit: {0}>'.format(self.commit)
+
+    @property
+    def committed(self):
+        return self.sha != UNCOMMITTED
+
+    def set(self, key, value):
+        """
+            Takes a header line of the porcelain format.
+        """
+        if key == u'author':
+            self.author = value
+        elif key == u'author-time':
+            self.time = int(value)
+            self.timestamp = datetime.datetime.fromtimestamp(self.time)
+        elif key == u'summary':
+            self.summary = value
+
+
+def parse_blame(lines):
+    """
+        Parses ``git blame --porcelain`` output incrementally.
+
+        :param lines: an iterable of (byte) lines, like the ``stdout``
+            of a running git process
+        :returns: a generator of ``(commit, lineno, text)`` tuples in
+            the order of the lines, ``commit`` is a
+            :class:`BlameCommit` shared by all lines of that commit
+    """
+    commits = {}
+    commit = lineno = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip(u'\n')
+        if line.startswith(u'\t'):
+            yield commit, lineno, line[1:]
+            continue
+        match = _BLAME_LINE.match(line)
+        if match:
+            sha = match.group(1)
+            commit = commits.get(sha)
+            if commit is None:
+                commit = commits[sha] = BlameCommit(sha)
+            lineno = int(match.group(3))
+        elif commit is not None:
+            key, _, value = line.partition(u' ')
+            commit.set(key, value)
+
+
+class BlameHunk(object):
+    """
+        Consecutive lines blamed on the same commit.
+    """
+
+    __slots__ = ('commit', 'lineno', 'lines')
+
+    def __init__(self, commit, lineno):
+        self.commit = commit
+        self.lineno = lineno
+        self.lines = []
+
+
+class BlameSection(object):
+    """
+        The blamed lines from one heading of a page to the next.
+
+        :param str title: the heading, ``None`` for the lines before
+            the first heading
+    """
+
+    __slots__ = ('title', 'lineno', 'count', 'hunks')
+
+    def __init__(self, title, lineno):
+        self.title = title
+        self.lineno = lineno
+        #: the number of lines
+        self.count = 0
+        self.hunks = []
+
+    def __repr__(self):
+        return u'<BlameSection: {0}>'.format(self.title)
+
+    def add(self, commit, lineno, text):
+        if not self.hunks or self.hunks[-1].commit is not commit:
+            self.hunks.append(BlameHunk(commit, lineno))
+        self.hunks[-1].lines.append(text)
+        self.count += 1
+
+
+def blame_sections(blamed):
+    """
+        Splits blamed lines into sections at markdown headings, which
+        are not inside fenced code.
+
+        :param blamed: ``(commit, lineno, text)`` tuples, see
+            :func:`parse_blame`
+        :rtype: list
+    """
+    sections = []
+    fenced = False
+    for commit, lineno, text in blamed:
+        if _FENCE.match(text):
+            fenced = not fenced
+        heading = None if fenced else _HEADING.match(text)
+        if heading or not sections:
+            sections.append(BlameSection(
+                heading.group(1) if heading else None, lineno))
+        sections[-1].add(commit, lineno, text)
+    return sections
+
+
+class LogCache(object):
+    """
+        Results of git history commands by key. The keys have to
+        contain the sha of ``HEAD``, so entries of an older ``HEAD`` are
+        never hit again and simply age out.
+
+        :param int size: the maximum number of entries kept
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            metrics.count('wiki_history_cache_total',
+                          result='miss' if value is None else 'hit')
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+#: the cache of all git backed wikis of the process
+CACHE = LogCache()
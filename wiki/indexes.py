@@ -0,0 +1,728 @@
+"""
+    Indexes
+    ~~~~~~~
+
+    Process wide indexes over the pages of a content directory. Engines
+    are created per request, so the indexes are kept in a registry keyed
+    by the content directory and shared by all engines (and threads) of
+    a process.
+
+    Indexes are built lazily on first use, from a
+    :mod:`~wiki.snapshot` if one was written by another process before,
+    in which case only the pages that changed since are read. Writes
+    through the engines
+    update them directly, other changes to the files (external editors,
+    the cli, sync tools) are reported by a
+    :class:`~wiki.watcher.Watcher` before the indexes are queried, or in
+    the background once :meth:`WikiIndexes.watch` was called. Cheap,
+    frequent queries like completion only check for changes every
+    :attr:`WikiIndexes.max_age` seconds.
+"""
+from collections import OrderedDict
+import os
+import sys
+import threading
+
+from wiki import changelog
+from wiki import metrics
+from wiki import related
+from wiki import snapshot
+from wiki.completion import Completer
+from wiki.core import links
+from wiki.core import page_key
+from wiki.core import split_meta
+from wiki.namespaces import NamespaceTree
+from wiki.related import TermMatrix
+from wiki.scanner import read_text
+from wiki.trigram import ALL
+from wiki.trigram import regex_query
+from wiki.trigram import TrigramIndex
+from wiki.watcher import diff
+from wiki.watcher import Event
+from wiki.watcher import stat_key
+from wiki.watcher import Watcher
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+_options = {'snapshots': True, 'changes': True, 'related': True}
+
+
+def configure(snapshots=True, changes=True, related=True):
+    """
+        Sets whether indexes created from now on are loaded from and
+        saved to a snapshot, see :mod:`wiki.snapshot`, whether
+        writes are exchanged with other processes through a
+        :mod:`~wiki.changelog` and whether related pages are indexed,
+        see :mod:`wiki.related`.
+    """
+    _options['snapshots'] = snapshots
+    _options['changes'] = changes
+    _options['related'] = related
+
+
+def get_indexes(root):
+    """
+        Returns the indexes of the given content directory.
+
+        :rtype: WikiIndexes
+    """
+    root = os.path.abspath(root)
+    with _registry_lock:
+        indexes = _registry.get(root)
+        if indexes is None:
+            path = (snapshot.default_path(root) if _options['snapshots']
+                    else None)
+            changes = (snapshot.state_path(root, 'changes')
+                       if _options['changes'] else None)
+            indexes = _registry[root] = WikiIndexes(
+                root, path, changes,
+                _options['related'] and related.available())
+    return indexes
+
+
+def close_indexes(root):
+    """
+        Stops watching the given content directory and forgets its
+        indexes.
+    """
+    with _registry_lock:
+        indexes = _registry.pop(os.path.abspath(root), None)
+    if indexes is not None:
+        indexes.close()
+
+
+def page_tags(meta):
+    """
+        Returns the tags of a page from its metadata.
+
+        :rtype: list
+    """
+    tags = []
+    for tag in meta.get('tags', u'').split(','):
+        tag = tag.strip()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+class IndexEntry(object):
+    """
+        What the page listings need to know about a page, without its
+        content. Tags are interned, so every tag is stored only once
+        no matter how many pages use it.
+
+        :param str url: the url of the page
+        :param str title: the title, the url if the page has none
+        :param tuple tags: the tags of the page
+        :param float mtime: the modification time of the file
+        :param int size: the size of the file in bytes
+    """
+
+    __slots__ = ('url', 'title', 'tags', 'mtime', 'size')
+
+    def __init__(self, url, title, tags, mtime, size):
+        self.url = url
+        self.title = title
+        self.tags = tags
+        self.mtime = mtime
+        self.size = size
+
+    @classmethod
+    def create(cls, url, meta, key):
+        """
+            Creates the entry of a page from its metadata and its
+            :func:`~wiki.watcher.stat_key`.
+        """
+        return cls(url, meta.get('title') or url,
+                   tuple(sys.intern(tag) for tag in page_tags(meta)),
+                   key[1] / 1e9, key[2])
+
+    def __repr__(self):
+        return u'<IndexEntry: {}>'.format(self.url)
+
+
+class RenderCache(object):
+    """
+        A least recently used cache of rendered pages.
+
+        Entries are stored together with the raw text they were rendered
+        from and only returned for the same text, so a stale entry is
+        never used, even if the change was not detected yet. Entries of
+        changed pages are dropped as soon as the change is detected.
+
+        Renderings including other pages (see
+        :func:`~wiki.core.transclude`) are recorded in a dependency
+        graph, a detected change of an included page drops exactly the
+        entries of the pages including it. They are also stored with
+        the stat keys of the included files, so a change made by another
+        process is not missed before it is detected either.
+
+        :param int size: the maximum number of entries
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.entries = OrderedDict()
+        #: url -> urls of the cached pages including it
+        self.dependents = {}
+        #: increased whenever entries are dropped, see :meth:`put`
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, url, text, engine=None):
+        """
+            :param engine: the engine to check the stat keys of the
+                included pages with, see :func:`~wiki.core.page_key`
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is not None and entry[0] == text and (
+                engine is None or all(
+                    page_key(engine, dependency) == key
+                    for dependency, key in entry[3].items())):
+            with self.lock:
+                if url in self.entries:
+                    self.entries.move_to_end(url)
+            metrics.count('wiki_render_cache_total', result='hit')
+            return entry[1]
+        metrics.count('wiki_render_cache_total', result='miss')
+        return None
+
+    def put(self, url, text, rendered, depends=(), version=None, keys=None):
+        """
+            :param depends: the urls of the pages the rendering included
+            :param int version: :attr:`version` before rendering, a
+                rendering including pages is not stored if entries were
+                dropped meanwhile, an included page could have changed
+            :param dict keys: the stat keys of the included pages, see
+                :attr:`wiki.core.RenderContext.keys`
+        """
+        depends = frozenset(depends)
+        with self.lock:
+            if depends and version is not None and version != self.version:
+                return
+            self._drop(url)
+            self.entries[url] = (text, rendered, depends, dict(keys or {}))
+            for dependency in depends:
+                self.dependents.setdefault(dependency, set()).add(url)
+            while len(self.entries) > self.size:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, url):
+        entry = self.entries.pop(url, None)
+        if entry is None:
+            return
+        for dependency in entry[2]:
+            urls = self.dependents[dependency]
+            urls.discard(url)
+            if not urls:
+                del self.dependents[dependency]
+
+    def discard(self, url):
+        """
+            Drops the entry of a page and of the pages including it.
+        """
+        with self.lock:
+            self.version += 1
+            self._drop(url)
+            # the dependencies are recorded transitively
+            dependents = list(self.dependents.get(url, ()))
+            for dependent in dependents:
+                self._drop(dependent)
+        if dependents:
+            metrics.count('wiki_render_cache_includers_dropped_total',
+                          len(dependents))
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.dependents.clear()
+
+
+class WikiIndexes(object):
+    """
+        The indexes of one content directory.
+
+        :param str root: the content directory
+        :param str snapshot: the path of the snapshot to load the
+            indexes from and save them to, if any
+        :param str changes: the path of the
+            :class:`~wiki.changelog.ChangeLog` writes are published to
+            and read from, if any
+        :param bool terms: whether to index the words of the pages for
+            :meth:`related_pages`, which needs numpy
+    """
+
+    #: seconds a refresh is considered recent enough by :meth:`complete`,
+    #: and by all queries if the whole tree has to be listed
+    max_age = 5.0
+    #: changed pages after which a new snapshot is saved
+    snapshot_changes = 1000
+
+    def __init__(self, root, snapshot=None, changes=None, terms=False):
+        self.root = root
+        self.snapshot = snapshot
+        self.changes = changelog.ChangeLog(changes) if changes else None
+        self.lock = threading.RLock()
+        self.built = False
+        self.refreshed = None
+        #: the generation of the content directory the loaded or last
+        #: saved snapshot was taken at
+        self.snapshot_tag = None
+        self._unsaved = 0
+        #: url -> :func:`~wiki.watcher.stat_key` of the indexed version
+        self.stats = {}
+        #: url -> :class:`IndexEntry` of every page
+        self.entries = {}
+        #: the entries by namespace
+        self.namespaces = NamespaceTree()
+        #: tag -> urls of the pages with that tag
+        self.tags = {}
+        #: url -> urls of the pages it links to
+        self.links = {}
+        #: url -> urls of the pages linking to it
+        self.backlinks = {}
+        self.trigrams = TrigramIndex()
+        self.completer = Completer()
+        #: the :class:`~wiki.related.TermMatrix` of the page bodies,
+        #: ``None`` if related pages are not indexed
+        self.terms = TermMatrix() if terms else None
+        self.renders = RenderCache()
+        self.watcher = Watcher(root, lock=self.lock)
+        self.watcher.subscribe(self.apply)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.stats)
+
+    def path(self, url):
+        return os.path.join(self.root, url + '.md')
+
+    def _index(self, url, key):
+        try:
+            text = read_text(self.path(url))
+        except (IOError, OSError):
+            self._remove(url)
+            return
+        self.renders.discard(url)
+        self.stats[url] = key
+        self.trigrams.add(url, text)
+        meta, body = split_meta(text)
+        self._set_entry(url, IndexEntry.create(url, meta, key))
+        self._set_links(url, links(body))
+        self.completer.add(url, meta.get('title'))
+        if self.terms is not None:
+            self.terms.add(url, body)
+
+    def _remove(self, url):
+        self.renders.discard(url)
+        if self.stats.pop(url, None) is None:
+            return
+        self.trigrams.remove(url)
+        self._set_entry(url, None)
+        self._set_links(url, ())
+        self.completer.remove(url)
+        if self.terms is not None:
+            self.terms.remove(url)
+
+    def _set_entry(self, url, entry):
+        old = self.entries.pop(url, None)
+        if old is not None:
+            self.namespaces.remove(old)
+            for tag in old.tags:
+                urls = self.tags[tag]
+                urls.discard(url)
+                if not urls:
+                    del self.tags[tag]
+        if entry is None:
+            return
+        self.entries[url] = entry
+        self.namespaces.add(entry)
+        for tag in entry.tags:
+            self.tags.setdefault(tag, set()).add(url)
+
+    def _set_links(self, url, targets):
+        targets = frozenset(targets)
+        old = self.links.pop(url, frozenset())
+        for target in old - targets:
+            urls = self.backlinks[target]
+            urls.discard(url)
+            if not urls:
+                del self.backlinks[target]
+        for target in targets - old:
+            self.backlinks.setdefault(target, set()).add(url)
+        if targets:
+            self.links[url] = targets
+
+    def _update(self, url, key):
+        if self.stats.get(url) != key:
+            self._index(url, key)
+
+    def apply(self, events):
+        """
+            Updates the indexes with a batch of
+            :class:`~wiki.watcher.Event` objects.
+        """
+        with self.lock:
+            for event in events:
+                if event.kind == Event.DELETED:
+                    self._remove(event.url)
+                elif event.kind == Event.MOVED:
+                    self._remove(event.url)
+                    self._update(event.dest, event.key)
+                else:
+                    self._update(event.url, event.key)
+            self._changed(len(events))
+
+    def _changed(self, count):
+        self._unsaved += count
+        if (self.built and self.snapshot is not None and
+                self._unsaved >= self.snapshot_changes):
+            self.save()
+
+    def dump(self):
+        """
+            Returns the indexes as a payload for
+            :func:`wiki.snapshot.write`, which has to be written before
+            the lock is released.
+        """
+        return {
+            'stats': self.stats,
+            'entries': [(entry.url, entry.title, entry.tags, entry.mtime,
+                         entry.size) for entry in self.entries.values()],
+            'tags': self.tags,
+            'links': self.links,
+            'backlinks': self.backlinks,
+            'trigrams': self.trigrams.dump(),
+            'completer': self.completer.dump(),
+            'terms': self.terms.dump() if self.terms is not None else None,
+        }
+
+    def load(self, payload):
+        """
+            Replaces the indexes with a payload returned by :meth:`dump`.
+        """
+        self.stats = payload['stats']
+        self.entries = {}
+        self.namespaces = NamespaceTree()
+        entries = [
+            IndexEntry(url, title, tuple(sys.intern(tag) for tag in tags),
+                       mtime, size)
+            for url, title, tags, mtime, size in payload['entries']]
+        # added in order, so every insertion appends
+        entries.sort(key=NamespaceTree.key)
+        for entry in entries:
+            self.entries[entry.url] = entry
+            self.namespaces.add(entry)
+        self.tags = payload['tags']
+        self.links = payload['links']
+        self.backlinks = payload['backlinks']
+        self.trigrams = TrigramIndex.load(payload['trigrams'])
+        self.completer = Completer.load(payload['completer'])
+        if self.terms is not None:
+            if payload.get('terms') is not None:
+                self.terms = TermMatrix.load(payload['terms'])
+            else:
+                # written by a process not indexing them
+                self.terms = TermMatrix()
+                for url in self.stats:
+                    try:
+                        text = read_text(self.path(url))
+                    except (IOError, OSError):
+                        continue
+                    self.terms.add(url, split_meta(text)[1])
+        self.renders.clear()
+
+    def save(self, tag=None):
+        """
+            Writes a snapshot of the indexes.
+
+            :param str tag: the generation of the content directory the
+                indexes reflect, the current one by default
+        """
+        with self.lock:
+            if self._stop.is_set():
+                # closed, maybe the content directory is being removed
+                return
+            tag = tag or snapshot.generation(self.root)
+            try:
+                snapshot.write(self.snapshot, tag, self.dump())
+            except (IOError, OSError):
+                # snapshots only speed up starting
+                return
+            self.snapshot_tag = tag
+            self._unsaved = 0
+
+    def _build(self):
+        """
+            Builds the indexes, from the snapshot and the pages that
+            changed since it was taken if there is one.
+        """
+        # taken before listing, changes made meanwhile are replayed
+        # from the next snapshot
+        tag = snapshot.generation(self.root)
+        loaded = None
+        if self.snapshot is not None:
+            loaded = snapshot.read(self.snapshot)
+        if loaded is None:
+            for url, key in self.watcher.start().items():
+                self._index(url, key)
+            changed = len(self.stats)
+        else:
+            self.snapshot_tag, payload = loaded
+            self.load(payload)
+            events = diff(self.stats, self.watcher.start())
+            self.apply(events)
+            changed = len(events)
+            metrics.count('wiki_index_snapshot_replayed_total', changed)
+        metrics.count('wiki_index_snapshot_total',
+                      result='missing' if loaded is None else 'loaded')
+        self.built = True
+        if self.snapshot is not None and changed:
+            self.save(tag)
+
+    def refresh(self, max_age=None):
+        """
+            Builds the indexes or brings them up to date with the files
+            in the content directory.
+
+            :param float max_age: skip the check if the last one is not
+                older than that many seconds, :attr:`max_age` if the
+                watcher has to list the whole tree
+        """
+        self.sync()
+        with self.lock, metrics.timer('index'):
+            now = metrics.clock()
+            if max_age is None and self.built and self.watcher.inotify is None:
+                max_age = self.max_age
+            if (max_age is not None and self.refreshed is not None and
+                    now - self.refreshed <= max_age):
+                return
+            self.refreshed = now
+            if self.built:
+                self.watcher.poll()
+                return
+            self._build()
+
+    def watch(self, interval=2.0, debounce=0.2, max_delay=2.0):
+        """
+            Builds the indexes and keeps them up to date in a background
+            thread, see :meth:`wiki.watcher.Watcher.run`. Does nothing
+            if the thread is already running.
+        """
+        # not the index lock, which is held during the initial build
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._watch, args=(interval, debounce, max_delay),
+                name='wiki-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _watch(self, interval, debounce, max_delay):
+        self.refresh()
+        self.watcher.run(self._stop, interval, debounce, max_delay)
+
+    def close(self):
+        """
+            Stops watching.
+        """
+        self._stop.set()
+        self.watcher.close()
+
+    def sync(self):
+        """
+            Applies the writes other processes published to the change
+            log since the last call. Costs a single ``stat`` if there
+            are none.
+        """
+        if self.changes is None:
+            return
+        records = self.changes.read()
+        if not records and records is not None:
+            return
+        with self.lock:
+            if not self.built:
+                return
+            if records is None:
+                # the log was started over, compare everything
+                self.watcher.poll()
+                return
+            for url in set(url for _, _, url in records):
+                try:
+                    key = stat_key(os.stat(self.path(url)))
+                except OSError:
+                    self._remove(url)
+                else:
+                    # writes of this process are indexed already
+                    self._update(url, key)
+            metrics.count('wiki_changelog_applied_total', len(records))
+
+    def _publish(self, kind, url):
+        if self.changes is None:
+            return
+        try:
+            self.changes.append(kind, [url])
+        except (IOError, OSError):
+            # the other processes find out through their watchers
+            pass
+
+    def page_saved(self, url):
+        """
+            Updates the indexes after a page was written and tells the
+            other processes.
+        """
+        with self.lock:
+            if self.built:
+                try:
+                    key = stat_key(os.stat(self.path(url)))
+                except OSError:
+                    self._remove(url)
+                else:
+                    self._index(url, key)
+                self._changed(1)
+            else:
+                self.renders.discard(url)
+        self._publish(changelog.SAVED, url)
+
+    def page_removed(self, url):
+        """
+            Updates the indexes after a page was deleted and tells the
+            other processes.
+        """
+        with self.lock:
+            self._remove(url)
+            self._changed(1)
+        self._publish(changelog.REMOVED, url)
+
+    def candidates(self, pattern, flags=0):
+        """
+            Selects the pages that can match an expression. The
+            expression is analyzed without holding the lock, which is
+            only taken to look up the trigrams.
+
+            :param str pattern: the regular expression, it does not
+                have to be valid
+            :param int flags: the :mod:`re` flags
+            :returns: the sorted candidate urls or ``None`` if all
+                pages have to be scanned
+            :rtype: list
+        """
+        query = regex_query(pattern, flags)
+        if query is ALL:
+            return None
+        self.refresh()
+        with self.lock:
+            candidates = query.evaluate(self.trigrams.lookup)
+        if candidates is None:
+            return None
+        return sorted(candidates)
+
+    def complete(self, query, limit=10):
+        """
+            Completes page titles and urls.
+
+            :returns: ``(url, title, kind)`` tuples
+            :rtype: list
+        """
+        self.refresh(self.max_age)
+        with self.lock:
+            return self.completer.complete(query, limit)
+
+    def get_entries(self, urls=None):
+        """
+            :param list urls: the pages to return, all by default,
+                unknown ones are skipped
+            :returns: the :class:`IndexEntry` objects of the pages
+            :rtype: list
+        """
+        self.refresh()
+        with self.lock:
+            if urls is None:
+                return list(self.entries.values())
+            return [self.entries[url] for url in urls if url in self.entries]
+
+    def namespace(self, prefix):
+        """
+            Lists a namespace.
+
+            :param str prefix: ``''`` for the root, ``'a/b'`` otherwise
+
+            :returns: the ``(name, page count)`` of the sub namespaces
+                sorted by name and the entries of the pages sorted by
+                title, or ``None`` if there are no pages in the
+                namespace
+            :rtype: tuple
+        """
+        self.refresh()
+        with self.lock:
+            namespace = self.namespaces.get(prefix)
+            if namespace is None:
+                return None
+            return ([(name, namespace.children[name].count)
+                     for name in namespace.names], list(namespace.entries))
+
+    def get_tags(self):
+        """
+            :returns: tag -> urls of the tagged pages
+            :rtype: dict
+        """
+        self.refresh()
+        with self.lock:
+            return dict((tag, sorted(urls)) for tag, urls in self.tags.items())
+
+    def tagged(self, tag):
+        """
+            :returns: the sorted urls of the pages with the given tag
+            :rtype: list
+        """
+        self.refresh()
+        with self.lock:
+            return sorted(self.tags.get(tag, ()))
+
+    def related_pages(self, url, limit=5):
+        """
+            :returns: the :class:`IndexEntry` and score of the pages
+                most similar to ``url``, see
+                :meth:`wiki.related.TermMatrix.similar`, or ``None`` if
+                related pages are not indexed
+            :rtype: list
+        """
+        if self.terms is None:
+            return None
+        self.refresh(self.max_age)
+        with self.lock:
+            return [(self.entries[similar], score) for similar, score
+                    in self.terms.similar(url, limit)
+                    if similar in self.entries]
+
+    def duplicates(self, threshold=0.9):
+        """
+            :returns: the ``(url, url, score)`` of all pairs of nearly
+                identical pages, see
+                :meth:`wiki.related.TermMatrix.duplicates`, or ``None``
+                if related pages are not indexed
+            :rtype: list
+        """
+        if self.terms is None:
+            return None
+        self.refresh()
+        with self.lock:
+            return self.terms.duplicates(threshold)
+
+    def backlinks_of(self, url):
+        """
+            :returns: the sorted urls of the pages linking to ``url``
+            :rtype: list
+        """
+        self.refresh()
+        with self.lock:
+            return sorted(self.backlinks.get(url, ()))
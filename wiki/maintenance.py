@@ -0,0 +1,271 @@
+"""
+    Repository maintenance
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Every save of a git backed wiki is a commit of its own, so loose
+    objects pile up over the years and ``git log <page>`` (the page
+    history) and ``git grep`` (search) get slower. :class:`Maintenance`
+    keeps the repository in shape:
+
+    ``repack``
+        packs loose objects, all packs into one once there are too
+        many of them
+    ``multi-pack-index``
+        indexes all packs at once, so objects are found with a single
+        lookup
+    ``commit-graph``
+        writes the commit graph with changed-path Bloom filters, which
+        lets ``git log <page>`` skip commits not touching the page
+        without reading their trees
+    ``gc``
+        ``git gc --auto``, expiring reflogs and pruning garbage if git
+        thinks it is due
+    ``pack-refs``
+        packs the refs
+
+    Git writes objects, packs and graphs atomically, so the first three
+    steps run while the wiki keeps committing. Only the steps updating
+    refs take the ``git-lock`` of :class:`~wiki.wikigit.WikiGit`.
+
+    Maintenance is run by ``wiki maintenance`` or in the background of
+    the web application, every ``MAINTENANCE_INTERVAL`` seconds.
+"""
+import os
+import threading
+import time
+
+import fasteners
+import git
+
+from wiki import metrics
+from wiki import named_locks
+from wiki.snapshot import state_path
+from wiki.wikigit import TimedGit
+
+
+class Step(object):
+    """
+        The outcome of one maintenance step.
+    """
+
+    __slots__ = ('name', 'seconds', 'error')
+
+    def __init__(self, name, seconds, error=None):
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self):
+        return u'<Step: {0}>'.format(self.name)
+
+
+class Report(object):
+    """
+        What a maintenance run did.
+
+        :param dict before: the object counts before the run, see
+            :meth:`Maintenance.count_objects`
+    """
+
+    def __init__(self, before):
+        self.before = before
+        self.after = None
+        #: :class:`Step` objects of the steps run
+        self.steps = []
+        #: seconds the ``git-lock`` was held
+        self.locked = 0.0
+
+    @property
+    def seconds(self):
+        return sum(step.seconds for step in self.steps)
+
+    @property
+    def failed(self):
+        return [step for step in self.steps if step.error]
+
+    def format(self):
+        """
+            :returns: a human readable summary
+            :rtype: str
+        """
+        lines = []
+        for step in self.steps:
+            lines.append(u'{0:<18} {1:8.3f}s{2}'.format(
+                step.name, step.seconds,
+                u'  failed: ' + step.error if step.error else u''))
+        lines.append(u'{0:<18} {1:8.3f}s'.format(u'git-lock held',
+                                                 self.locked))
+        for key in ('count', 'size', 'in-pack', 'packs', 'size-pack'):
+            unit = u' KiB' if key.startswith('size') else u''
+            lines.append(u'{0:<18} {1:>8}{3} -> {2}{3}'.format(
+                key, self.before.get(key, 0),
+                (self.after or {}).get(key, 0), unit))
+        return u'\n'.join(lines)
+
+
+class Maintenance(object):
+    """
+        Maintenance of the repository of a content directory.
+
+        :param int loose_objects: loose objects are packed once there
+            are that many of them
+        :param int packs: all packs are packed into one once there are
+            that many of them
+    """
+
+    def __init__(self, root, loose_objects=100, packs=10):
+        self.root = root
+        self.loose_objects = loose_objects
+        self.packs = packs
+        self.git = TimedGit(git.Git(root))
+        # the lock WikiGit commits under
+        named_locks.set_lock('git-lock', os.path.join(root, 'wikigit.flock'))
+
+    def count_objects(self):
+        """
+            ``git count-objects -v`` as a dict of numbers, sizes are in
+            KiB.
+
+            :rtype: dict
+        """
+        counts = {}
+        for line in self.git.count_objects('-v').splitlines():
+            key, _, value = line.partition(':')
+            try:
+                counts[key.strip()] = int(value)
+            except ValueError:
+                continue
+        return counts
+
+    def _step(self, report, name, *args):
+        start = metrics.clock()
+        error = None
+        try:
+            self.git.execute(['git'] + list(args))
+        except git.exc.GitCommandError as e:
+            # like "  stderr: 'fatal: ...'"
+            error = (e.stderr or u'').strip()
+            if error.startswith(u"stderr: '"):
+                error = error[len(u"stderr: '"):-1]
+            error = error or str(e)
+        seconds = metrics.clock() - start
+        metrics.count('wiki_maintenance_steps_total', step=name,
+                      result='failed' if error else 'ok')
+        report.steps.append(Step(name, seconds, error))
+
+    def run(self, force=False):
+        """
+            Runs the maintenance steps which are due, or all of them.
+
+            :param bool force: repack even if there are only a few loose
+                objects and packs
+            :rtype: Report
+        """
+        with metrics.timer('maintenance'):
+            report = Report(self.count_objects())
+            loose = report.before.get('count', 0)
+            packs = report.before.get('packs', 0)
+            if force or packs >= self.packs:
+                self._step(report, 'repack', 'repack', '-a', '-d', '-l',
+                           '-q')
+            elif loose >= self.loose_objects:
+                self._step(report, 'repack', 'repack', '-d', '-l', '-q')
+            self._step(report, 'multi-pack-index', 'multi-pack-index',
+                       'write')
+            self._step(report, 'commit-graph', 'commit-graph', 'write',
+                       '--reachable', '--changed-paths')
+            self._locked(report)
+            report.after = self.count_objects()
+        return report
+
+    @named_locks.interprocess_lock('git-lock')
+    def _locked(self, report):
+        start = metrics.clock()
+        # gc must not detach, it would outlive the lock
+        self._step(report, 'gc', '-c', 'gc.autoDetach=false', 'gc',
+                   '--auto', '--quiet')
+        self._step(report, 'pack-refs', 'pack-refs', '--all')
+        report.locked = metrics.clock() - start
+
+
+def stamp_path(root):
+    """
+        The file whose modification time records the last maintenance.
+    """
+    return state_path(root, 'maintenance')
+
+
+def run_due(root, interval, force=False, **kwargs):
+    """
+        Runs the maintenance if the last one, by any process, is at
+        least ``interval`` seconds ago and no other process is running
+        it right now.
+
+        :param float interval: ``0`` to run it in any case
+        :param bool force: see :meth:`Maintenance.run`, other keyword
+            arguments are passed to :class:`Maintenance`
+
+        :returns: the report or ``None`` if nothing was due
+        :rtype: Report
+    """
+    stamp = stamp_path(root)
+    try:
+        if time.time() - os.stat(stamp).st_mtime < interval:
+            return None
+    except OSError:
+        pass
+    folder = os.path.dirname(stamp)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    lock = fasteners.InterProcessLock(stamp + '.lock')
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        # another process could have finished just now
+        try:
+            if time.time() - os.stat(stamp).st_mtime < interval:
+                return None
+        except OSError:
+            pass
+        report = Maintenance(root, **kwargs).run(force)
+        with open(stamp, 'w') as f:
+            f.write(report.format())
+        return report
+    finally:
+        lock.release()
+
+
+#: the running schedulers of this process by content directory
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def schedule(root, interval):
+    """
+        Runs :func:`run_due` in a background thread of this process
+        every now and then. Does nothing if the thread is already
+        running.
+
+        :param float interval: seconds between maintenance runs
+    """
+    with _schedulers_lock:
+        thread = _schedulers.get(root)
+        if thread is not None and thread.is_alive():
+            return
+        thread = _schedulers[root] = threading.Thread(
+            target=_schedule, args=(root, interval),
+            name='wiki-maintenance')
+        thread.daemon = True
+        thread.start()
+
+
+def _schedule(root, interval):
+    # checking is a stat, the run itself is rare
+    check = max(1.0, min(interval / 10.0, 600.0))
+    while True:
+        try:
+            run_due(root, interval)
+        except Exception:
+            metrics.count('wiki_maintenance_steps_total', step='run',
+                          result='failed')
+        time.sleep(check)
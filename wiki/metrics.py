@@ -0,0 +1,249 @@
+"""
+    Metrics
+    ~~~~~~~
+
+    Lightweight instrumentation for the wiki. Code paths are wrapped
+    with :func:`timer` (or decorated with :func:`timed`) and events are
+    counted with :func:`count`. Every measurement goes into two places:
+
+    * the process wide :data:`REGISTRY`, which aggregates histograms and
+      counters and renders them in the Prometheus text format, and
+    * the timings of the current request (if one was started with
+      :func:`start_request`), which are reported back to the client in
+      a ``Server-Timing`` header.
+
+    Metrics are kept per process, so with several workers every worker
+    reports its own numbers.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: help texts of the exported metric families
+HELP = {
+    'wiki_operation_duration_seconds':
+        'Time spent in instrumented wiki operations.',
+    'wiki_request_duration_seconds':
+        'Time spent handling requests.',
+    'wiki_git_subprocesses_total':
+        'Number of git subprocesses started.',
+    'wiki_requests_total':
+        'Number of handled requests.',
+}
+
+
+class Histogram(object):
+    """
+        A cumulative histogram with fixed buckets.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Registry(object):
+    """
+        Thread safe store of all histograms and counters of a process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = OrderedDict()
+        self.counters = OrderedDict()
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """
+            Renders all metrics in the Prometheus text exposition
+            format.
+
+            :rtype: str
+        """
+        lines = []
+        with self.lock:
+            families = OrderedDict()
+            for (name, labels), histogram in self.histograms.items():
+                families.setdefault((name, 'histogram'), []).append(
+                    (labels, histogram))
+            for (name, labels), value in self.counters.items():
+                families.setdefault((name, 'counter'), []).append(
+                    (labels, value))
+            for (name, kind), samples in sorted(families.items()):
+                if name in HELP:
+                    lines.append('# HELP {0} {1}'.format(name, HELP[name]))
+                lines.append('# TYPE {0} {1}'.format(name, kind))
+                for labels, sample in samples:
+                    if kind == 'counter':
+                        lines.append('{0}{1} {2}'.format(
+                            name, _format_labels(labels),
+                            _format_value(sample)))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(sample.buckets, sample.counts):
+                        cumulative += count
+                        lines.append('{0}_bucket{1} {2}'.format(
+                            name, _format_labels(labels, [('le', bound)]),
+                            cumulative))
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        name, _format_labels(labels, [('le', '+Inf')]),
+                        sample.count))
+                    lines.append('{0}_sum{1} {2}'.format(
+                        name, _format_labels(labels),
+                        _format_value(sample.sum)))
+                    lines.append('{0}_count{1} {2}'.format(
+                        name, _format_labels(labels), sample.count))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+_local = threading.local()
+
+
+def start_request():
+    """
+        Starts collecting the timings of the current request (thread).
+    """
+    _local.timings = OrderedDict()
+    _local.started = clock()
+
+
+def finish_request():
+    """
+        Stops collecting timings for the current request.
+
+        :returns: the total request duration and an ordered mapping of
+            operation name to ``(seconds, calls)``
+        :rtype: tuple
+    """
+    timings = getattr(_local, 'timings', None)
+    started = getattr(_local, 'started', None)
+    _local.timings = None
+    _local.started = None
+    if timings is None:
+        return None, OrderedDict()
+    return clock() - started, timings
+
+
+def record(name, seconds):
+    """
+        Records the duration of one call of an instrumented operation.
+
+        :param str name: the operation name.
+        :param float seconds: how long it took.
+    """
+    REGISTRY.observe('wiki_operation_duration_seconds', seconds,
+                     operation=name)
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        total, calls = timings.get(name, (0.0, 0))
+        timings[name] = (total + seconds, calls + 1)
+
+
+def count(name, amount=1, **labels):
+    """
+        Increments a counter.
+    """
+    REGISTRY.inc(name, amount, **labels)
+
+
+@contextmanager
+def timer(name):
+    """
+        Context manager timing the wrapped block as operation ``name``.
+    """
+    start = clock()
+    try:
+        yield
+    finally:
+        record(name, clock() - start)
+
+
+def timed(name):
+    """
+        Decorator timing every call of the decorated function as
+        operation ``name``.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(total, timings):
+    """
+        Formats request timings as a ``Server-Timing`` header value.
+
+        :param float total: the total request duration in seconds.
+        :param dict timings: operation name to ``(seconds, calls)``.
+
+        :rtype: str
+    """
+    entries = [
+        '{0};dur={1:.2f};desc="{2} call{3}"'.format(
+            name, seconds * 1000, calls, '' if calls == 1 else 's')
+        for name, (seconds, calls) in timings.items()
+    ]
+    if total is not None:
+        entries.append('total;dur={0:.2f}'.format(total * 1000))
+    return ', '.join(entries)
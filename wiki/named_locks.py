@@ -12,10 +12,19 @@ that, something like that can be used:
         ...
 
 Where name stands for some str name.
+
+Locks guarding single pages are striped, see StripedLock.
 """
+from contextlib import contextmanager
+import os
+import threading
+import zlib
+
 import fasteners
 from functools import wraps
 
+from wiki import metrics
+
 LOCKS = {}
 
 
@@ -31,7 +40,73 @@ def interprocess_lock(name):
     def lock_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            with _get_lock(name):
+            lock = _get_lock(name)
+            # only the time spent waiting for the lock is recorded
+            with metrics.timer('lock'):
+                lock.acquire()
+            try:
                 return f(*args, **kwargs)
+            finally:
+                lock.release()
         return wrapper
     return lock_decorator
+
+
+class StripedLock(object):
+    """
+    A fixed number of inter process locks (lock files in `directory`)
+    guarding any number of keys, every key maps to one of them. Keys
+    mapping to different stripes are locked in parallel, the number of
+    lock files stays bounded.
+
+    File locks do not exclude threads of the same process, so every
+    stripe has a thread lock as well. Use get_striped_lock() to share
+    them between all engines of a process.
+    """
+
+    def __init__(self, directory, stripes=64):
+        self.directory = directory
+        self.stripes = stripes
+        self._threads = [threading.Lock() for _ in range(stripes)]
+
+    def index(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.stripes
+
+    def path(self, index):
+        return os.path.join(self.directory, 'stripe-%d.lock' % index)
+
+    @contextmanager
+    def __call__(self, *keys):
+        """Hold the stripes of all `keys`, taken in a fixed order."""
+        indexes = sorted(set(self.index(key) for key in keys))
+        acquired = []
+        try:
+            # only the time spent waiting for the locks is recorded
+            with metrics.timer('lock'):
+                for index in indexes:
+                    self._threads[index].acquire()
+                    lock = fasteners.InterProcessLock(self.path(index))
+                    try:
+                        lock.acquire()
+                    except BaseException:
+                        self._threads[index].release()
+                        raise
+                    acquired.append((index, lock))
+            yield
+        finally:
+            for index, lock in reversed(acquired):
+                lock.release()
+                self._threads[index].release()
+
+
+_striped = {}
+_striped_lock = threading.Lock()
+
+
+def get_striped_lock(directory, stripes=64):
+    """Return the StripedLock of `directory` shared by this process."""
+    with _striped_lock:
+        lock = _striped.get(directory)
+        if lock is None or lock.stripes != stripes:
+            lock = _striped[directory] = StripedLock(directory, stripes)
+        return lock
@@ -0,0 +1,115 @@
+"""
+    Namespaces
+    ~~~~~~~~~~
+
+    Urls are paths, every folder of the content directory is a
+    namespace. The :class:`NamespaceTree` mirrors the folders and keeps
+    the pages and sub namespaces of every namespace sorted as pages are
+    added and removed, so listing one namespace only touches that
+    namespace and never sorts.
+"""
+from bisect import bisect_left
+from bisect import insort
+
+from wiki.core import title_key
+
+
+class Namespace(object):
+    """
+        One folder of the content directory.
+
+        :param str prefix: ``''`` for the root, ``'a/b/'`` otherwise
+    """
+
+    __slots__ = ('prefix', 'names', 'children', 'keys', 'entries', 'count')
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        #: sorted names of the sub namespaces
+        self.names = []
+        #: name -> :class:`Namespace`
+        self.children = {}
+        #: sorted ``(title key, url)`` of the pages and their
+        #: :class:`~wiki.indexes.IndexEntry` objects in the same order
+        self.keys = []
+        self.entries = []
+        #: the number of pages in this namespace and all below it
+        self.count = 0
+
+    def __repr__(self):
+        return u'<Namespace: {}>'.format(self.prefix)
+
+    @property
+    def name(self):
+        return self.prefix.rstrip(u'/').rsplit(u'/', 1)[-1]
+
+
+class NamespaceTree(object):
+    """
+        The pages of a wiki by namespace.
+    """
+
+    def __init__(self):
+        self.root = Namespace(u'')
+
+    def __len__(self):
+        return self.root.count
+
+    @staticmethod
+    def key(entry):
+        return (title_key(entry), entry.url)
+
+    def add(self, entry):
+        """
+            Adds the :class:`~wiki.indexes.IndexEntry` of a page.
+        """
+        namespace = self.root
+        namespace.count += 1
+        for name in entry.url.split(u'/')[:-1]:
+            child = namespace.children.get(name)
+            if child is None:
+                child = namespace.children[name] = Namespace(
+                    namespace.prefix + name + u'/')
+                insort(namespace.names, name)
+            namespace = child
+            namespace.count += 1
+        key = self.key(entry)
+        i = bisect_left(namespace.keys, key)
+        namespace.keys.insert(i, key)
+        namespace.entries.insert(i, entry)
+
+    def remove(self, entry):
+        """
+            Removes the :class:`~wiki.indexes.IndexEntry` of a page,
+            together with namespaces that become empty.
+        """
+        path = [self.root]
+        for name in entry.url.split(u'/')[:-1]:
+            path.append(path[-1].children[name])
+        namespace = path[-1]
+        i = bisect_left(namespace.keys, self.key(entry))
+        del namespace.keys[i]
+        del namespace.entries[i]
+        for parent, child in zip([None] + path, path):
+            child.count -= 1
+            if parent is not None and not child.count:
+                name = child.name
+                del parent.children[name]
+                del parent.names[bisect_left(parent.names, name)]
+                break
+
+    def get(self, prefix):
+        """
+            :param str prefix: ``''`` or ``'a/b'``, a trailing slash is
+                optional
+            :returns: the namespace or ``None`` if there are no pages
+                in it
+            :rtype: Namespace
+        """
+        namespace = self.root
+        prefix = prefix.strip(u'/')
+        for name in prefix.split(u'/') if prefix else ():
+            namespace = namespace.children.get(name)
+            if namespace is None:
+                return None
+        return namespace
@@ -0,0 +1,272 @@
+"""
+    Related pages
+    ~~~~~~~~~~~~~
+
+    Finds the pages about the same things as a page by comparing the
+    words of their bodies. Every page is a vector of TF-IDF weights, a
+    word counts the more the more often the page uses it and the fewer
+    other pages do, and the related pages are those whose vectors point
+    in the most similar direction (cosine similarity). Pages which are
+    nearly the same are reported as duplicates.
+
+    The word counts of all pages are kept in a :class:`TermMatrix`, a
+    sparse matrix with a row per page stored in flat :mod:`array`
+    buffers (compressed sparse rows). Changing a page appends its new
+    row and leaves the old one behind, the buffers are compacted once
+    half of them is dead. The weights depend on how many pages use a
+    word, so they are computed for all rows at once with numpy when the
+    matrix is queried after a change, not stored.
+
+    numpy is optional (``pip install wiki2[related]``), without it
+    :func:`available` is false and there are no related pages.
+"""
+from array import array
+from collections import Counter
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from wiki import metrics
+
+
+#: the words of a page, numbers and very short words are left out
+WORD_RE = re.compile(r'[^\W\d_]{3,}', re.U)
+
+#: pages at least this similar are shown as related
+MIN_SCORE = 0.05
+
+
+def available():
+    """
+        Whether numpy is installed.
+    """
+    return numpy is not None
+
+
+def count_words(text):
+    """
+        :returns: word -> the number of times the text uses it
+        :rtype: collections.Counter
+    """
+    return Counter(WORD_RE.findall(text.lower()))
+
+
+class TermMatrix(object):
+    """
+        The word counts of the pages of a wiki.
+    """
+
+    def __init__(self):
+        #: word -> column
+        self.terms = {}
+        #: the number of pages using the word of each column
+        self.df = array('I')
+        #: where the entries of each row start, and the end of the last
+        self.indptr = array('Q', [0])
+        #: the column of each entry
+        self.indices = array('I')
+        #: the count of each entry
+        self.counts = array('H')
+        #: the url of each row, ``None`` for dead rows
+        self.urls = []
+        #: url -> row
+        self.rows = {}
+        #: the number of entries of dead rows
+        self.dead = 0
+        #: increased with every change, see :meth:`weights`
+        self.version = 0
+        self._weights = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, url):
+        return url in self.rows
+
+    def add(self, url, text):
+        """
+            Adds or replaces the row of a page.
+
+            :param str text: the body of the page
+        """
+        self.remove(url)
+        words = count_words(text)
+        if not words:
+            return
+        columns = array('I')
+        for word in words:
+            column = self.terms.get(word)
+            if column is None:
+                column = self.terms[word] = len(self.df)
+                self.df.append(0)
+            self.df[column] += 1
+            columns.append(column)
+        self.rows[url] = len(self.urls)
+        self.urls.append(url)
+        self.indices.extend(columns)
+        self.counts.extend(min(count, 0xffff) for count in words.values())
+        self.indptr.append(len(self.indices))
+        self.version += 1
+
+    def remove(self, url):
+        row = self.rows.pop(url, None)
+        if row is None:
+            return
+        start, end = self.indptr[row], self.indptr[row + 1]
+        for column in self.indices[start:end]:
+            self.df[column] -= 1
+        self.urls[row] = None
+        self.dead += end - start
+        self.version += 1
+        if self.dead > len(self.indices) // 2:
+            self.compact()
+
+    def compact(self):
+        """
+            Drops the dead rows.
+        """
+        indptr = array('Q', [0])
+        indices = array('I')
+        counts = array('H')
+        urls = []
+        for row, url in enumerate(self.urls):
+            if url is None:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            indices.extend(self.indices[start:end])
+            counts.extend(self.counts[start:end])
+            indptr.append(len(indices))
+            self.rows[url] = len(urls)
+            urls.append(url)
+        self.indptr, self.indices, self.counts = indptr, indices, counts
+        self.urls = urls
+        self.dead = 0
+        self.version += 1
+
+    def dump(self):
+        """
+            Returns the matrix as types :mod:`marshal` supports.
+        """
+        if self.dead:
+            self.compact()
+        terms = [None] * len(self.df)
+        for word, column in self.terms.items():
+            terms[column] = word
+        return {
+            'terms': terms,
+            'df': self.df.tobytes(),
+            'indptr': self.indptr.tobytes(),
+            'indices': self.indices.tobytes(),
+            'counts': self.counts.tobytes(),
+            'urls': self.urls,
+        }
+
+    @classmethod
+    def load(cls, payload):
+        """
+            Creates a matrix from a payload returned by :meth:`dump`.
+        """
+        matrix = cls()
+        matrix.terms = dict((word, column) for column, word
+                            in enumerate(payload['terms']))
+        for name in ('df', 'indptr', 'indices', 'counts'):
+            buffer = array(getattr(matrix, name).typecode)
+            buffer.frombytes(payload[name])
+            setattr(matrix, name, buffer)
+        matrix.urls = list(payload['urls'])
+        matrix.rows = dict((url, row) for row, url in enumerate(matrix.urls))
+        return matrix
+
+    def weights(self):
+        """
+            The unit length TF-IDF vectors of all rows.
+
+            :returns: the columns, weights and row starts of all entries
+                and whether each row is alive, as numpy arrays
+            :rtype: tuple
+        """
+        if self._weights is not None and self._weights[0] == self.version:
+            return self._weights[1]
+        # copies, the buffers must not be exported while they grow
+        indices = numpy.array(self.indices, dtype=numpy.uint32)
+        counts = numpy.array(self.counts, dtype=numpy.float32)
+        df = numpy.array(self.df, dtype=numpy.float32)
+        indptr = numpy.array(self.indptr, dtype=numpy.int64)
+        # words used by every page say nothing about a page
+        idf = numpy.log((1.0 + len(self.rows)) / (1.0 + df))
+        weights = (1.0 + numpy.log(counts)) * idf[indices]
+        norms = numpy.sqrt(_row_sums(weights * weights, indptr))
+        norms[norms == 0.0] = 1.0
+        weights /= numpy.repeat(norms, numpy.diff(indptr))
+        alive = numpy.array([url is not None for url in self.urls],
+                            dtype=bool)
+        result = (indices, weights, indptr, alive)
+        self._weights = (self.version, result)
+        return result
+
+    def _scores(self, row, first=0):
+        indices, weights, indptr, alive = self.weights()
+        start, end = indptr[row], indptr[row + 1]
+        query = numpy.zeros(len(self.df), dtype=numpy.float32)
+        query[indices[start:end]] = weights[start:end]
+        offset = indptr[first]
+        products = weights[offset:] * query[indices[offset:]]
+        scores = _row_sums(products, indptr[first:] - offset)
+        scores[~alive[first:]] = 0.0
+        return scores
+
+    def similar(self, url, limit=5, min_score=MIN_SCORE):
+        """
+            The pages most similar to a page.
+
+            :returns: ``(url, score)`` tuples, the most similar first
+            :rtype: list
+        """
+        row = self.rows.get(url)
+        if row is None or limit <= 0:
+            return []
+        with metrics.timer('related'):
+            scores = self._scores(row)
+            scores[row] = 0.0
+            candidates = numpy.flatnonzero(scores >= min_score)
+            if len(candidates) > limit:
+                candidates = candidates[numpy.argpartition(
+                    -scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[numpy.argsort(-scores[candidates],
+                                                  kind='stable')]
+        return [(self.urls[index], float(scores[index]))
+                for index in candidates]
+
+    def duplicates(self, threshold=0.9):
+        """
+            All pairs of pages at least ``threshold`` similar, compares
+            every page with all pages after it.
+
+            :returns: ``(url, url, score)`` tuples, the most similar
+                first
+            :rtype: list
+        """
+        pairs = []
+        with metrics.timer('related'):
+            for row, url in enumerate(self.urls):
+                if url is None:
+                    continue
+                scores = self._scores(row, row + 1)
+                for index in numpy.flatnonzero(scores >= threshold):
+                    pairs.append((url, self.urls[row + 1 + index],
+                                  float(scores[index])))
+        pairs.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+        return pairs
+
+
+def _row_sums(values, indptr):
+    """
+        Sums the entries of every row, empty rows included, which
+        :func:`numpy.add.reduceat` gets wrong.
+    """
+    sums = numpy.zeros(len(values) + 1, dtype=numpy.float64)
+    numpy.cumsum(values, dtype=numpy.float64, out=sums[1:])
+    return (sums[indptr[1:]] - sums[indptr[:-1]]).astype(numpy.float32)
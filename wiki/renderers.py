@@ -0,0 +1,154 @@
+"""
+    Renderers
+    ~~~~~~~~~
+
+    The markdown engines :class:`~wiki.core.Processor` can render the
+    body of a page with. Metadata, preprocessors and postprocessors
+    (like :func:`~wiki.core.wikilink`) are handled by the processor and
+    work the same with every renderer.
+
+    ``markdown``
+        Python-Markdown with the ``codehilite``, ``fenced_code`` and
+        ``tables`` extensions, the default.
+
+    ``commonmark``
+        `markdown-it-py <https://github.com/executablebooks/markdown-it-py>`_,
+        a faster CommonMark engine, with tables enabled. Code blocks
+        are highlighted by ``codehilite`` (and its cache, see
+        :mod:`wiki.highlight`), so they look the same with both
+        renderers. Requires ``pip install markdown-it-py``.
+
+    The renderer is selected by ``MARKDOWN_RENDERER`` in ``config.py``.
+"""
+import markdown
+from markdown.extensions.codehilite import CodeHilite
+
+try:
+    from markdown_it import MarkdownIt
+except ImportError:
+    MarkdownIt = None
+
+
+#: the renderer used if none is configured
+DEFAULT = 'markdown'
+
+
+class RendererError(Exception):
+    pass
+
+
+class Renderer(object):
+    """
+        Renders markdown to html. A renderer is used by one thread at
+        a time.
+    """
+
+    #: the name selecting the renderer
+    name = None
+    #: whether :func:`~wiki.core.split_blocks` splits documents into
+    #: blocks this renderer renders independently, see
+    #: :meth:`~wiki.core.Processor.process_blocks`
+    blocks = False
+    #: the number of spaces a tab expands to
+    tab_length = 4
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def convert(self, text):
+        """
+            Renders a markdown document without metadata.
+
+            :rtype: str
+        """
+        raise NotImplementedError
+
+
+class MarkdownRenderer(Renderer):
+    """
+        Python-Markdown.
+    """
+
+    name = 'markdown'
+    blocks = True
+    extensions = ['codehilite', 'fenced_code', 'tables']
+
+    def __init__(self):
+        self.md = markdown.Markdown(self.extensions)
+        self.tab_length = self.md.tab_length
+
+    def convert(self, text):
+        # references and stashed html must not leak into the next
+        # document
+        self.md.reset()
+        return self.md.convert(text)
+
+
+def _hilite(renderer, tokens, idx, options, env):
+    """
+        Renders fenced and indented code like ``codehilite`` does.
+    """
+    token = tokens[idx]
+    lang = token.info.split()[0] if token.info.strip() else None
+    return CodeHilite(token.content, lang=lang).hilite() + u'\n'
+
+
+def _align(state):
+    """
+        Aligns table cells with the ``align`` attribute, like the
+        ``tables`` extension does.
+    """
+    for token in state.tokens:
+        if token.type in ('th_open', 'td_open') and token.attrs:
+            style = token.attrs.pop('style', u'')
+            if style.startswith(u'text-align:'):
+                token.attrs['align'] = style[len(u'text-align:'):]
+
+
+class CommonMarkRenderer(Renderer):
+    """
+        markdown-it-py.
+    """
+
+    name = 'commonmark'
+
+    @classmethod
+    def available(cls):
+        return MarkdownIt is not None
+
+    def __init__(self):
+        self.md = MarkdownIt('commonmark').enable('table')
+        self.md.add_render_rule('fence', _hilite)
+        self.md.add_render_rule('code_block', _hilite)
+        self.md.core.ruler.push('align', _align)
+
+    def convert(self, text):
+        return self.md.render(text).strip()
+
+
+#: name -> renderer class
+RENDERERS = dict((cls.name, cls) for cls in (
+    MarkdownRenderer, CommonMarkRenderer))
+
+
+def get_renderer(name=None):
+    """
+        Creates a renderer.
+
+        :param str name: a key of :data:`RENDERERS`, defaults to
+            :data:`DEFAULT`
+
+        :raises RendererError: if the renderer does not exist or its
+            engine is not installed
+        :rtype: Renderer
+    """
+    cls = RENDERERS.get(name or DEFAULT)
+    if cls is None:
+        raise RendererError(
+            u'Unknown markdown renderer {0!r}, choose one of {1}.'.format(
+                name, u', '.join(sorted(RENDERERS))))
+    if not cls.available():
+        raise RendererError(u'The markdown renderer {0!r} is not '
+                            u'installed.'.format(name))
+    return cls()
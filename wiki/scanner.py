@@ -0,0 +1,144 @@
+"""
+    Raw file scanner
+    ~~~~~~~~~~~~~~~~
+
+    Searches the raw ``.md`` files of a content directory without
+    creating :class:`~wiki.core.Page` objects or rendering markdown.
+    Files are read in one large read (memory-mapped if they are big),
+    rejected early if the expression does not match anywhere and only
+    then split into header and body. The work is spread over a thread
+    or process pool in chunks, and stops as soon as enough pages
+    matched.
+"""
+import codecs
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import mmap
+import multiprocessing
+import os
+import threading
+
+from wiki import metrics
+from wiki.core import match_page
+
+
+#: files of at least this size are memory-mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def read_text(path):
+    """
+        Reads a whole file as utf-8 text with a single read, or through
+        a memory map for big files.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            data = f.read()
+            return data.decode('utf-8', 'replace')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return codecs.utf_8_decode(mapped, 'replace', True)[0]
+        finally:
+            mapped.close()
+
+
+def scan_chunk(root, urls, regex, attrs, stop=None):
+    """
+        Searches the pages of one chunk.
+
+        :param str root: the content directory
+        :param list urls: the page urls to search
+        :param regex: the compiled search expression
+        :param attrs: which parts of the pages to search in
+        :param stop: an optional :class:`threading.Event`, scanning
+            stops once it is set
+
+        :returns: the matching pages
+        :rtype: list of :class:`~wiki.core.SearchResult`
+    """
+    results = []
+    for url in urls:
+        if stop is not None and stop.is_set():
+            break
+        try:
+            text = read_text(os.path.join(root, url + '.md'))
+        except (IOError, OSError):
+            # removed while scanning
+            continue
+        if not regex.search(text):
+            continue
+        result = match_page(url, text, regex, attrs)
+        if result:
+            results.append(result)
+    return results
+
+
+class Scanner(object):
+    """
+        Scans pages in parallel.
+
+        :param str root: the content directory
+        :param int workers: the size of the pool, by default depending
+            on the number of CPUs
+        :param bool processes: use processes instead of threads, this
+            pays off for expensive expressions on many CPUs. Threads
+            are used anyway in daemonic processes, like the workers of
+            :mod:`wiki.workers`, which can not start processes.
+        :param int chunk_size: the number of pages per job
+    """
+
+    def __init__(self, root, workers=None, processes=False, chunk_size=64):
+        self.root = root
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 2)
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+    def scan(self, urls, regex, attrs=('title', 'tags', 'body'), limit=None):
+        """
+            Searches the given pages.
+
+            :param list urls: the page urls to search
+            :param regex: the compiled search expression
+            :param attrs: which parts of the pages to search in
+            :param int limit: stop once that many pages matched
+
+            :returns: the matching pages, in no particular order
+            :rtype: list of :class:`~wiki.core.SearchResult`
+        """
+        chunks = [urls[i:i + self.chunk_size]
+                  for i in range(0, len(urls), self.chunk_size)]
+        if len(chunks) <= 1 or self.workers <= 1:
+            with metrics.timer('scan'):
+                matched = []
+                for chunk in chunks:
+                    matched.extend(scan_chunk(self.root, chunk, regex, attrs))
+                    if limit and len(matched) >= limit:
+                        break
+                return matched[:limit] if limit else matched
+        if self.processes and not multiprocessing.current_process().daemon:
+            executor = ProcessPoolExecutor(self.workers)
+            stop = None
+        else:
+            executor = ThreadPoolExecutor(self.workers)
+            stop = threading.Event()
+        matched = []
+        with metrics.timer('scan'):
+            try:
+                futures = [
+                    executor.submit(scan_chunk, self.root, chunk, regex,
+                                    attrs, stop)
+                    for chunk in chunks
+                ]
+                for future in as_completed(futures):
+                    matched.extend(future.result())
+                    if limit and len(matched) >= limit:
+                        if stop is not None:
+                            stop.set()
+                        for pending in futures:
+                            pending.cancel()
+                        break
+            finally:
+                executor.shutdown(wait=True)
+        return matched[:limit] if limit else matched
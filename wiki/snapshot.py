@@ -0,0 +1,161 @@
+"""
+    Index snapshots
+    ~~~~~~~~~~~~~~~
+
+    Building the indexes of a content directory means reading and
+    parsing every page, which every new process has to do. A snapshot
+    stores the built indexes in a single file, so processes started
+    later only map it into memory, let :mod:`marshal` decode it (in C,
+    without any per page work in python) and read the pages that
+    changed since it was written.
+
+    The file starts with a fixed header: :data:`MAGIC`, the format
+    :data:`VERSION`, the python marshal version and the length of the
+    tag, followed by the tag and the marshalled indexes. Snapshots of
+    another format or python version are ignored and rebuilt. The tag
+    records the :func:`generation` of the content directory the
+    snapshot was taken at.
+"""
+import gc
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+
+from wiki import metrics
+
+
+MAGIC = b'WIKIIDX\0'
+
+#: incremented whenever the layout of the payload changes
+VERSION = 1
+
+_HEADER = struct.Struct('<8sHHI')
+
+
+def state_path(root, name):
+    """
+        Where the wiki keeps its own files for a content directory:
+        inside the git directory of git backed wikis, so they are never
+        committed, in a ``.wiki`` folder otherwise.
+    """
+    git = os.path.join(root, '.git')
+    if os.path.isdir(git):
+        return os.path.join(git, 'wiki', name)
+    return os.path.join(root, '.wiki', name)
+
+
+def default_path(root):
+    """
+        Where the snapshot of a content directory is kept.
+    """
+    return state_path(root, 'indexes')
+
+
+def generation(root):
+    """
+        Identifies the state of a content directory without listing
+        it: the sha of the git ``HEAD`` if there is one, the
+        modification time of the directory otherwise.
+
+        :rtype: str
+    """
+    git = os.path.join(root, '.git')
+    try:
+        with open(os.path.join(git, 'HEAD')) as f:
+            head = f.read().strip()
+        if head.startswith('ref: '):
+            ref = head[5:]
+            try:
+                with open(os.path.join(git, ref)) as f:
+                    return f.read().strip()
+            except (IOError, OSError):
+                return _packed_ref(git, ref)
+        return head
+    except (IOError, OSError):
+        pass
+    try:
+        return 'mtime:{0}'.format(os.stat(root).st_mtime_ns)
+    except OSError:
+        return ''
+
+
+def _packed_ref(git, ref):
+    try:
+        with open(os.path.join(git, 'packed-refs')) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except (IOError, OSError):
+        pass
+    return ''
+
+
+def write(path, tag, payload):
+    """
+        Writes a snapshot atomically, readers see the old or the new
+        one but never a partial file.
+
+        :param str tag: the :func:`generation` of the content directory
+        :param payload: the indexes, only types :mod:`marshal` supports
+    """
+    with metrics.timer('snapshot'):
+        tag = tag.encode('utf-8')
+        data = marshal.dumps(payload)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, VERSION, marshal.version,
+                                     len(tag)))
+                f.write(tag)
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+
+def read(path):
+    """
+        Reads a snapshot.
+
+        :returns: the tag and the payload, or ``None`` if there is no
+            usable snapshot
+        :rtype: tuple
+    """
+    with metrics.timer('snapshot'):
+        try:
+            with open(path, 'rb') as f, mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _decode(data)
+        except (IOError, OSError, ValueError, EOFError, TypeError):
+            # missing, empty or corrupt
+            return None
+
+
+def _decode(data):
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, marshal_version, length = _HEADER.unpack_from(data)
+    if (magic != MAGIC or version != VERSION or
+            marshal_version != marshal.version):
+        return None
+    start = _HEADER.size + length
+    tag = data[_HEADER.size:start].decode('utf-8')
+    # views have to be released before the map is closed
+    with memoryview(data) as view, view[start:] as body:
+        # the millions of new containers would trigger the cyclic
+        # garbage collector over and over, none of them is garbage
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            payload = marshal.loads(body)
+        finally:
+            if enabled:
+                gc.enable()
+    return tag, payload
@@ -0,0 +1,388 @@
+"""
+    Trigram index
+    ~~~~~~~~~~~~~
+
+    An inverted index from every three character substring (trigram) of
+    the lower cased raw page text to the pages containing it, as used by
+    classic code search engines.
+
+    A regular expression is translated into a query of AND and OR
+    combined trigrams every matching text has to contain. Evaluating
+    that query against the index gives a (usually small) set of
+    candidate pages, only those have to be read and matched for real.
+    If no trigram can be derived from an expression (``.*``, ``\\w+``,
+    ...) the query matches everything and all pages have to be scanned.
+"""
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+
+#: maximum number of alternative strings tracked for one literal run
+MAX_STRINGS = 64
+
+#: maximum size of a character class that is expanded into literals
+MAX_CLASS = 8
+
+#: longer expressions are not analyzed
+MAX_PATTERN = 1000
+
+#: maximum number of regex items analyzed for one expression
+MAX_NODES = 1000
+
+#: maximum nesting of groups, repetitions and branches analyzed
+MAX_DEPTH = 32
+
+_REPEATS = tuple(getattr(sre_constants, name) for name in (
+    'MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_constants, name))
+
+
+def trigrams(text):
+    """
+        Returns all trigrams of the given (already lower cased) text.
+
+        :rtype: set
+    """
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class Query(object):
+    """
+        A trigram query: either matches everything (``ALL``), a single
+        trigram (``GRAM``) or combines other queries with ``AND`` or
+        ``OR``.
+    """
+
+    ALL = 'all'
+    GRAM = 'gram'
+    AND = 'and'
+    OR = 'or'
+
+    def __init__(self, op, gram=None, subs=()):
+        self.op = op
+        self.gram = gram
+        self.subs = tuple(subs)
+
+    def __repr__(self):
+        if self.op == self.ALL:
+            return u'ALL'
+        if self.op == self.GRAM:
+            return repr(self.gram)
+        return u'{0}({1})'.format(
+            self.op.upper(), u', '.join(repr(sub) for sub in self.subs))
+
+    def __eq__(self, other):
+        # AND and OR are commutative, the order of subqueries is ignored
+        return (isinstance(other, Query) and self.op == other.op and
+                self.gram == other.gram and
+                frozenset(self.subs) == frozenset(other.subs))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.op, self.gram, frozenset(self.subs)))
+
+    @classmethod
+    def and_(cls, *queries):
+        subs = []
+        for query in queries:
+            if query.op == cls.ALL:
+                continue
+            for sub in (query.subs if query.op == cls.AND else (query,)):
+                if sub not in subs:
+                    subs.append(sub)
+        if not subs:
+            return ALL
+        if len(subs) == 1:
+            return subs[0]
+        return cls(cls.AND, subs=subs)
+
+    @classmethod
+    def or_(cls, *queries):
+        subs = []
+        for query in queries:
+            if query.op == cls.ALL:
+                return ALL
+            for sub in (query.subs if query.op == cls.OR else (query,)):
+                if sub not in subs:
+                    subs.append(sub)
+        if not subs:
+            return ALL
+        if len(subs) == 1:
+            return subs[0]
+        return cls(cls.OR, subs=subs)
+
+    def evaluate(self, lookup):
+        """
+            Evaluates the query.
+
+            :param function lookup: returns the set of pages containing
+                the given trigram (or an empty set).
+
+            :returns: the candidate pages or ``None`` if all pages are
+                candidates
+            :rtype: set
+        """
+        if self.op == self.ALL:
+            return None
+        if self.op == self.GRAM:
+            return set(lookup(self.gram))
+        results = [sub.evaluate(lookup) for sub in self.subs]
+        if self.op == self.OR:
+            if any(result is None for result in results):
+                return None
+            return set().union(*results)
+        results = sorted((r for r in results if r is not None), key=len)
+        if not results:
+            return None
+        candidates = results[0]
+        for result in results[1:]:
+            if not candidates:
+                break
+            candidates &= result
+        return candidates
+
+
+ALL = Query(Query.ALL)
+
+
+def strings_query(strings):
+    """
+        A query matching texts that contain one of the given strings.
+    """
+    alternatives = []
+    for string in sorted(strings):
+        if len(string) < 3:
+            return ALL
+        alternatives.append(Query.and_(*[
+            Query(Query.GRAM, gram=string[i:i + 3])
+            for i in range(len(string) - 2)
+        ]))
+    return Query.or_(*alternatives)
+
+
+def _class_strings(items):
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            chars.add(chr(av).lower())
+        elif op == sre_constants.RANGE and av[1] - av[0] < MAX_CLASS:
+            chars.update(chr(c).lower() for c in range(av[0], av[1] + 1))
+        else:
+            # negations, categories and big ranges
+            return None
+    return chars if len(chars) <= MAX_CLASS else None
+
+
+class _TooComplex(Exception):
+    pass
+
+
+class _Budget(object):
+    """
+        Limits the work spent on analyzing one expression.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.depth = 0
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise _TooComplex()
+
+    def leave(self):
+        self.depth -= 1
+
+    def node(self):
+        self.nodes += 1
+        if self.nodes > MAX_NODES:
+            raise _TooComplex()
+
+
+def _item(op, av, budget):
+    """
+        Analyzes a single regex item, every sub pattern is analyzed
+        once.
+
+        :returns: the query and the set of strings the item always
+            matches exactly, or ``None`` if there are too many or
+            infinitely many
+        :rtype: tuple
+    """
+    if op == sre_constants.LITERAL:
+        return ALL, set([chr(av).lower()])
+    if op == sre_constants.AT:
+        # anchors do not consume any text
+        return ALL, set([u''])
+    if op == sre_constants.IN:
+        return ALL, _class_strings(av)
+    if op == sre_constants.SUBPATTERN:
+        return _analyze(av[-1], budget)
+    if op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+        return _analyze(av, budget)[0], None
+    if op == sre_constants.BRANCH:
+        results = [_analyze(branch, budget) for branch in av[1]]
+        strings = set()
+        for _, exact in results:
+            if exact is None:
+                strings = None
+                break
+            strings |= exact
+        if strings is not None and len(strings) <= MAX_STRINGS:
+            return ALL, strings
+        return Query.or_(*[query for query, _ in results]), None
+    if op in _REPEATS:
+        query, exact = _analyze(av[2], budget)
+        if exact is not None and av[1] <= 3:
+            # small bounded repetitions like x? or x{2,3}
+            strings = set([u''])
+            result = set([u'']) if av[0] == 0 else set()
+            for count in range(1, av[1] + 1):
+                strings = set(a + b for a in strings for b in exact)
+                if count >= av[0]:
+                    result |= strings
+                if len(result) > MAX_STRINGS:
+                    break
+            else:
+                return ALL, result
+        return (query if av[0] >= 1 else ALL), None
+    if op == sre_constants.ASSERT:
+        return _analyze(av[1], budget)[0], None
+    return ALL, None
+
+
+def _analyze(items, budget):
+    """
+        Analyzes a parsed sequence of regex items.
+
+        :returns: the query and the set of strings the whole sequence
+            matches exactly (or ``None``)
+        :rtype: tuple
+        :raises _TooComplex: if the budget is exceeded
+    """
+    budget.enter()
+    query = ALL
+    run = set([u''])
+    exact = True
+    for op, av in items:
+        budget.node()
+        item_query, strings = _item(op, av, budget)
+        if strings is not None:
+            if len(run) * len(strings) <= MAX_STRINGS:
+                run = set(a + b for a in run for b in strings)
+            else:
+                query = Query.and_(query, strings_query(run))
+                run = strings
+                exact = False
+            continue
+        exact = False
+        query = Query.and_(query, strings_query(run), item_query)
+        run = set([u''])
+    query = Query.and_(query, strings_query(run))
+    budget.leave()
+    return query, (run if exact else None)
+
+
+def regex_query(pattern, flags=0):
+    """
+        Translates a regular expression into a trigram query. Overly
+        long or complex expressions (see :data:`MAX_PATTERN`,
+        :data:`MAX_NODES` and :data:`MAX_DEPTH`) match everything.
+
+        :param str pattern: the regular expression
+        :param int flags: the :mod:`re` flags
+
+        :rtype: Query
+    """
+    if len(pattern) > MAX_PATTERN:
+        return ALL
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+        return _analyze(list(parsed), _Budget())[0]
+    except Exception:
+        # invalid, too complex or nested too deeply to parse
+        return ALL
+
+
+class TrigramIndex(object):
+    """
+        Maps trigrams to the urls of the pages containing them.
+
+        The trigrams of every page are kept as one string of
+        concatenated trigrams, which is compact and, like postings
+        loaded by :meth:`load`, is stored in a snapshot without hashing
+        every element.
+    """
+
+    def __init__(self):
+        #: trigram -> urls, a set or a tuple if it was not changed
+        #: since :meth:`load`
+        self.postings = {}
+        #: url -> concatenated trigrams of the page
+        self.docs = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, url, text):
+        """
+            Indexes (or re-indexes) the raw text of a page.
+        """
+        self.remove(url)
+        grams = trigrams(text.lower())
+        self.docs[url] = u''.join(grams)
+        for gram in grams:
+            urls = self.postings.get(gram)
+            if urls is None:
+                urls = self.postings[gram] = set()
+            elif not isinstance(urls, set):
+                urls = self.postings[gram] = set(urls)
+            urls.add(url)
+
+    def remove(self, url):
+        packed = self.docs.pop(url, None)
+        if packed is None:
+            return
+        for i in range(0, len(packed), 3):
+            gram = packed[i:i + 3]
+            urls = self.postings[gram]
+            if not isinstance(urls, set):
+                urls = self.postings[gram] = set(urls)
+            urls.discard(url)
+            if not urls:
+                del self.postings[gram]
+
+    def dump(self):
+        """
+            Returns the index as plain tuples and strings, see
+            :meth:`load`.
+        """
+        return (dict((gram, tuple(urls))
+                     for gram, urls in self.postings.items()), self.docs)
+
+    @classmethod
+    def load(cls, state):
+        index = cls()
+        index.postings, index.docs = state
+        return index
+
+    def lookup(self, gram):
+        return self.postings.get(gram, ())
+
+    def candidates(self, regex):
+        """
+            Selects the pages that can match a compiled expression.
+
+            :returns: the candidate urls or ``None`` if every page is a
+                candidate
+            :rtype: set
+        """
+        query = regex_query(regex.pattern, regex.flags)
+        return query.evaluate(self.lookup)
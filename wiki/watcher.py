@@ -0,0 +1,448 @@
+"""
+    Change detection
+    ~~~~~~~~~~~~~~~~
+
+    Detects pages that were added, changed, removed or moved in a
+    content directory by other programs (external editors, the cli,
+    sync tools) and publishes them as :class:`Event` objects.
+
+    The watcher keeps a snapshot of the inode, modification time and
+    size of every page, grouped by folder. On Linux, inotify reports
+    which folders changed, so only those are listed again and compared
+    against the snapshot; everywhere else (or if inotify is not
+    available) the whole tree is compared. Removals and additions of
+    the same inode in one batch are reported as moves.
+
+    :meth:`Watcher.run` watches in the background and debounces bursts
+    of activity, like a sync client writing hundreds of files, into a
+    single batch of events.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+
+from wiki import metrics
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+#: the events watched on every folder
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+
+def stat_key(stat):
+    """
+        The part of a stat result that identifies a version of a file.
+    """
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def scan_folder(folder, prefix):
+    """
+        Lists one folder. Hidden sub folders, like ``.git`` and the
+        ``.wiki`` state folder, are left out.
+
+        :returns: ``{url: key}`` of the pages and the names of the sub
+            folders, or ``None`` if the folder does not exist
+        :rtype: tuple
+    """
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return None, []
+    pages = {}
+    folders = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    folders.append(entry.name)
+            elif entry.name.endswith('.md'):
+                pages[prefix + entry.name[:-3]] = stat_key(entry.stat())
+        except OSError:
+            # removed while listing
+            continue
+    return pages, folders
+
+
+class Event(object):
+    """
+        A change of a page.
+
+        :param str kind: one of :attr:`CREATED`, :attr:`MODIFIED`,
+            :attr:`DELETED` or :attr:`MOVED`
+        :param str url: the url of the page, the old one for moves
+        :param tuple key: the :func:`stat_key` of the new version
+        :param str dest: the new url of moved pages
+    """
+
+    CREATED = 'created'
+    MODIFIED = 'modified'
+    DELETED = 'deleted'
+    MOVED = 'moved'
+
+    def __init__(self, kind, url, key=None, dest=None):
+        self.kind = kind
+        self.url = url
+        self.key = key
+        self.dest = dest
+
+    def __repr__(self):
+        if self.dest is not None:
+            return u'<Event: {} {} -> {}>'.format(
+                self.kind, self.url, self.dest)
+        return u'<Event: {} {}>'.format(self.kind, self.url)
+
+    def __eq__(self, other):
+        return (isinstance(other, Event) and self.kind == other.kind and
+                self.url == other.url and self.dest == other.dest)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self.url, self.dest))
+
+
+def diff(old, new):
+    """
+        Compares two ``{url: key}`` snapshots.
+
+        :rtype: list of :class:`Event`
+    """
+    events = []
+    created = {}
+    for url, key in new.items():
+        previous = old.get(url)
+        if previous is None:
+            created[url] = key
+        elif previous != key:
+            events.append(Event(Event.MODIFIED, url, key))
+    # a removed page whose inode shows up under another url was moved
+    inodes = dict((key[0], url) for url, key in created.items())
+    for url, key in old.items():
+        if url in new:
+            continue
+        dest = inodes.pop(key[0], None)
+        if dest is not None:
+            events.append(Event(Event.MOVED, url, created.pop(dest), dest))
+        else:
+            events.append(Event(Event.DELETED, url))
+    for url, key in created.items():
+        events.append(Event(Event.CREATED, url, key))
+    return events
+
+
+class Inotify(object):
+    """
+        A minimal ctypes binding of the Linux inotify api.
+
+        :raises OSError: if inotify is not available
+    """
+
+    def __init__(self):
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._check(
+            libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0)))
+
+    def _check(self, result):
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        return self._check(self._libc.inotify_add_watch(
+            self.fd, os.fsencode(path), mask))
+
+    def read(self):
+        """
+            Reads the pending events without blocking.
+
+            :returns: ``(wd, mask, cookie, name)`` tuples
+            :rtype: list
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, cookie, os.fsdecode(name)))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Watcher(object):
+    """
+        Watches a content directory.
+
+        :param str root: the content directory
+        :param bool use_inotify: use inotify where it is available
+        :param lock: a lock serializing all operations, the subscribers
+            are called while holding it
+    """
+
+    def __init__(self, root, use_inotify=True, lock=None):
+        self.root = root
+        self.use_inotify = use_inotify
+        self.lock = lock or threading.RLock()
+        self.inotify = None
+        #: folder prefix (``''`` or ``'a/b/'``) -> {url: key}
+        self.folders = {}
+        self.subscribers = []
+        self._watches = {}
+        self._dirty = set()
+        self._rescan = False
+        self.started = False
+        self.closed = False
+
+    def subscribe(self, callback):
+        """
+            Calls ``callback(events)`` with every non empty batch of
+            events.
+        """
+        self.subscribers.append(callback)
+
+    def snapshot(self):
+        """
+            Returns the ``{url: key}`` snapshot of all pages.
+        """
+        pages = {}
+        for folder in self.folders.values():
+            pages.update(folder)
+        return pages
+
+    def start(self):
+        """
+            Takes the initial snapshot and starts watching.
+
+            :returns: the ``{url: key}`` snapshot
+        """
+        with self.lock:
+            if self.use_inotify and self.inotify is None:
+                try:
+                    self.inotify = Inotify()
+                except (OSError, AttributeError):
+                    self.inotify = None
+            self.folders = self._scan(u'', True)
+            self.started = True
+            return self.snapshot()
+
+    def _watch(self, prefix):
+        if self.inotify is None:
+            return
+        try:
+            wd = self.inotify.add_watch(os.path.join(self.root, prefix))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            # out of watches, everything is compared from now on
+            self._stop_inotify()
+            return
+        self._watches[wd] = prefix
+
+    def _stop_inotify(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+            self._watches.clear()
+
+    def _scan(self, prefix, recursive):
+        """
+            Lists the folder with the given prefix, watching it before
+            so no change can get lost in between.
+
+            :returns: ``{prefix: {url: key}}`` of the listed folders
+        """
+        folders = {}
+        stack = [prefix]
+        while stack:
+            current = stack.pop()
+            self._watch(current)
+            pages, names = scan_folder(
+                os.path.join(self.root, current), current)
+            if pages is None:
+                continue
+            folders[current] = pages
+            if recursive:
+                stack.extend(current + name + u'/' for name in names)
+        return folders
+
+    def drain(self):
+        """
+            Reads the pending inotify events without processing them.
+
+            :returns: the number of events read
+        """
+        with self.lock:
+            if self.inotify is None:
+                return 0
+            raw = self.inotify.read()
+            for wd, mask, cookie, name in raw:
+                if mask & IN_Q_OVERFLOW:
+                    self._rescan = True
+                    continue
+                prefix = self._watches.get(wd)
+                if prefix is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._watches[wd]
+                    if prefix == u'':
+                        self.closed = True
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    continue
+                if mask & IN_ISDIR:
+                    # folders are listed again with all of their pages
+                    self._dirty.add((prefix + name + u'/', True))
+                elif name.endswith('.md'):
+                    self._dirty.add((prefix, False))
+            return len(raw)
+
+    def wait(self, timeout):
+        """
+            Waits until inotify reports activity, without reading it.
+
+            :returns: whether there is activity to :meth:`drain`
+            :rtype: bool
+        """
+        inotify = self.inotify
+        if inotify is None or inotify.fd is None:
+            return False
+        try:
+            return bool(select.select([inotify.fd], [], [], timeout)[0])
+        except (OSError, ValueError):
+            # closed by another thread
+            return False
+
+    def poll(self):
+        """
+            Detects the changes since the last call and publishes them
+            to the subscribers.
+
+            :rtype: list of :class:`Event`
+        """
+        with self.lock:
+            if not self.started:
+                self.start()
+                return []
+            self.drain()
+            if self.inotify is None or self._rescan:
+                old = self.snapshot()
+                self.folders = self._scan(u'', True)
+                new = self.snapshot()
+                self._dirty.clear()
+                self._rescan = False
+                if not os.path.isdir(self.root):
+                    self.closed = True
+            else:
+                old, new = self._update()
+            events = diff(old, new)
+            for event in events:
+                metrics.count('wiki_content_events_total', kind=event.kind)
+            if events:
+                for callback in self.subscribers:
+                    callback(events)
+            return events
+
+    def _update(self):
+        """
+            Lists the folders inotify reported changes for again.
+
+            :returns: the old and new ``{url: key}`` of the affected
+                folders
+        """
+        dirty, self._dirty = self._dirty, set()
+        old = {}
+        new = {}
+        for prefix, recursive in sorted(dirty):
+            if recursive:
+                affected = [name for name in self.folders
+                            if name.startswith(prefix)]
+            else:
+                affected = [prefix] if prefix in self.folders else []
+            for name in affected:
+                pages = self.folders.pop(name)
+                old.update(pages)
+            folders = self._scan(prefix, recursive)
+            for pages in folders.values():
+                new.update(pages)
+            self.folders.update(folders)
+        # a page can be listed in new as well as in old if its folder
+        # was reported twice, only the latest state counts
+        for url in list(old):
+            if old[url] == new.get(url):
+                del old[url]
+                del new[url]
+        return old, new
+
+    def run(self, stop, interval=2.0, debounce=0.2, max_delay=2.0):
+        """
+            Watches until ``stop`` is set, publishing changes in the
+            background.
+
+            :param stop: a :class:`threading.Event`
+            :param float interval: seconds between full comparisons if
+                inotify is not available
+            :param float debounce: activity is collected until there
+                was none for that many seconds
+            :param float max_delay: but never longer than that
+        """
+        if not self.started:
+            self.start()
+        while not stop.is_set() and not self.closed:
+            if self.inotify is None:
+                stop.wait(interval)
+                if not stop.is_set():
+                    self.poll()
+                continue
+            if not self.wait(interval):
+                continue
+            deadline = metrics.clock() + max_delay
+            while not stop.is_set():
+                self.drain()
+                remaining = deadline - metrics.clock()
+                if remaining <= 0 or not self.wait(min(debounce, remaining)):
+                    break
+            self.poll()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self._stop_inotify()
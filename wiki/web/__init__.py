@@ -1,15 +1,30 @@
+from collections import OrderedDict
 import os
 import re
+import threading
+import uuid
 
 from flask import current_app
 from flask import Flask
 from flask import g
+from flask import request
+from flask import session
 from flask_login import LoginManager
+from jinja2 import Template
 from werkzeug.local import LocalProxy
 
+from wiki import highlight
+from wiki import indexes
+from wiki import maintenance
+from wiki import metrics
+from wiki import snapshot
 from wiki.core import Wiki
+from wiki.drafts import DraftStore
+from wiki.renderers import get_renderer
+from wiki.renderers import RendererError
 from wiki.wikigit import WikiGit
 from wiki.web.user import UserManager
+from wiki.workers import WorkerPool
 
 
 class WikiError(Exception):
@@ -20,6 +35,8 @@ def get_wiki():
     wiki = getattr(g, '_wiki', None)
     if wiki is None:
         wiki = g._wiki = ENGINE(current_app.config['CONTENT_DIR'])
+        wiki.search_processes = current_app.config.get('SCAN_PROCESSES',
+                                                       False)
     return wiki
 
 current_wiki = LocalProxy(get_wiki)
@@ -32,6 +49,172 @@ def get_users():
 
 current_users = LocalProxy(get_users)
 
+_workers_lock = threading.Lock()
+
+
+def get_workers():
+    """
+    Return the worker pool of the current application. The pool is
+    created on first use in every process, so it is never shared with
+    forked server processes.
+    """
+    with _workers_lock:
+        pool = current_app.extensions.get('wiki_workers')
+        if pool is None or pool.pid != os.getpid():
+            pool = current_app.extensions['wiki_workers'] = WorkerPool(
+                current_app.config.get('WORKER_POOL_SIZE', 2),
+                initializer=_worker_app,
+                initargs=(current_app.config['CONTENT_DIR'],),
+                preload=['wiki.web'])
+    return pool
+
+
+class PreviewCache(object):
+    """
+    The html of rendered markdown blocks of every editing session, see
+    :meth:`wiki.core.Processor.process_blocks`. The number of sessions
+    and the number of blocks per session are bounded, the least
+    recently used ones are dropped first.
+    """
+
+    def __init__(self, sessions=64, blocks=256):
+        self.sessions = sessions
+        self.blocks = blocks
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def known(self, sid):
+        """Return a copy of the known blocks of a session."""
+        with self._lock:
+            return dict(self._cache.get(sid, ()))
+
+    def update(self, sid, rendered, used=()):
+        """
+        Add newly rendered blocks and mark the known blocks in ``used``
+        as recently used.
+        """
+        metrics.count('wiki_preview_blocks_total', len(rendered),
+                      result='miss')
+        with self._lock:
+            blocks = self._cache.get(sid)
+            if blocks is None:
+                blocks = self._cache[sid] = OrderedDict()
+            self._cache.move_to_end(sid)
+            hits = 0
+            for key in used:
+                if key in blocks:
+                    blocks.move_to_end(key)
+                    hits += 1
+            blocks.update(rendered)
+            while len(blocks) > self.blocks:
+                blocks.popitem(last=False)
+            while len(self._cache) > self.sessions:
+                self._cache.popitem(last=False)
+        metrics.count('wiki_preview_blocks_total', hits, result='hit')
+
+
+def get_previews():
+    """Return the preview cache of the current application."""
+    with _workers_lock:
+        previews = current_app.extensions.get('wiki_previews')
+        if previews is None:
+            previews = current_app.extensions['wiki_previews'] = \
+                PreviewCache(
+                    current_app.config.get('PREVIEW_CACHE_SESSIONS', 64),
+                    current_app.config.get('PREVIEW_CACHE_BLOCKS', 256))
+    return previews
+
+
+def get_drafts():
+    """
+    Return the draft store of the current application, see
+    :mod:`wiki.drafts`. Created anew in forked processes, which do not
+    inherit the timers writing pending drafts.
+    """
+    with _workers_lock:
+        drafts = current_app.extensions.get('wiki_drafts')
+        if drafts is None or drafts.pid != os.getpid():
+            config = current_app.config
+            drafts = current_app.extensions['wiki_drafts'] = DraftStore(
+                config.get('DRAFT_DIR') or snapshot.state_path(
+                    config['CONTENT_DIR'], 'drafts'),
+                config.get('DRAFT_INTERVAL', 5.0),
+                config.get('DRAFT_MAX_SIZE', 256 * 1024),
+                config.get('DRAFT_MAX_COUNT', 50),
+                config.get('DRAFT_MAX_AGE', 30 * 24 * 3600))
+    return drafts
+
+
+def get_draft_user():
+    """
+    Return whose drafts are used: the logged in user or, for anonymous
+    editors, the browser session. ``None`` if there is no session to
+    tell editors apart, drafts are not kept then.
+    """
+    if 'user_id' in session:
+        return u'user:{0}'.format(session['user_id'])
+    sid = get_session_id()
+    if sid is None:
+        return None
+    return u'session:{0}'.format(sid)
+
+
+def get_session_id():
+    """
+    Return an id of the browser session, kept in the session cookie.
+    ``None`` if the application has no secret key, so there are no
+    sessions; anything else, like the remote address, would be shared
+    by all users behind the same proxy.
+    """
+    if not current_app.secret_key:
+        return None
+    sid = session.get('sid')
+    if sid is None:
+        sid = session['sid'] = uuid.uuid4().hex
+    return sid
+
+
+#: applications created inside worker processes, by content directory
+_worker_apps = {}
+
+
+def _worker_app(directory):
+    """
+    Return the application of a worker process, created when the worker
+    starts. Jobs get what they need from the indexes as arguments, so
+    a worker started after its predecessor was killed takes jobs right
+    away instead of building the indexes first.
+    """
+    app = _worker_apps.get(directory)
+    if app is None:
+        app = _worker_apps[directory] = create_app(directory)
+        app.config['WATCH_CONTENT'] = False
+    return app
+
+
+def _run_in_app(directory, script_root, func, args):
+    """Run a job inside a worker process with an application context."""
+    app = _worker_app(directory)
+    with app.test_request_context(
+            '/', base_url='http://localhost' + script_root):
+        return func(*args)
+
+
+def run_bounded(timeout, func, *args):
+    """
+    Run ``func(*args)`` in the worker pool and give up after ``timeout``
+    seconds. The function runs inside a request context of the same
+    wiki, so ``current_wiki`` and ``url_for`` can be used.
+
+    :raises wiki.workers.WorkerError: on timeouts or if all workers are
+        busy.
+    """
+    pool = get_workers()
+    if pool.size <= 0:
+        return func(*args)
+    return pool.run(timeout, _run_in_app, current_app.config['CONTENT_DIR'],
+                    request.script_root, func, args)
+
 
 def create_app(directory):
     app = Flask(__name__)
@@ -45,14 +228,86 @@ def create_app(directory):
         msg = "You need to place a config.py in your content directory."
         raise WikiError(msg)
 
+    highlight.configure(app.config.get('HIGHLIGHT_CACHE_SIZE', 1024),
+                        app.config.get('HIGHLIGHT_CACHE_DIR'))
+
+    indexes.configure(app.config.get('INDEX_SNAPSHOT', True),
+                      app.config.get('INDEX_CHANGE_LOG', True),
+                      bool(app.config.get('RELATED_PAGES', 5)))
+
+    try:
+        get_renderer(app.config.get('MARKDOWN_RENDERER'))
+    except RendererError as e:
+        raise WikiError(str(e))
+
     loginmanager.init_app(app)
 
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(start_timing)
+    app.before_request(watch_content)
+    app.before_request(schedule_maintenance)
+    app.after_request(add_server_timing)
+
     from wiki.web.routes import bp
     app.register_blueprint(bp)
 
     return app
 
 
+class TimedTemplate(Template):
+    """Template which records its rendering time."""
+
+    def render(self, *args, **kwargs):
+        with metrics.timer('template'):
+            return super(TimedTemplate, self).render(*args, **kwargs)
+
+
+def start_timing():
+    metrics.start_request()
+
+
+def watch_content():
+    """
+    Keep the indexes of the content directory up to date in the
+    background, unless ``WATCH_CONTENT`` is disabled. Started on the
+    first request, so worker processes and the cli never watch.
+    """
+    if current_app.config.get('WATCH_CONTENT', True):
+        current_wiki.indexes.watch(
+            current_app.config.get('WATCH_INTERVAL', 2.0),
+            current_app.config.get('WATCH_DEBOUNCE', 0.2))
+
+
+def schedule_maintenance():
+    """
+    Maintain the git repository in the background every
+    ``MAINTENANCE_INTERVAL`` seconds, if it is set. Every process
+    schedules it, the first one to find it due runs it.
+    """
+    interval = current_app.config.get('MAINTENANCE_INTERVAL')
+    if interval and current_app.config.get('USE_GIT'):
+        maintenance.schedule(current_app.config['CONTENT_DIR'], interval)
+
+
+def add_server_timing(response):
+    """
+    Report the timings of the request in a ``Server-Timing`` header and
+    add the request to the aggregated metrics.
+    """
+    total, timings = metrics.finish_request()
+    if total is None:
+        return response
+    endpoint = request.endpoint or 'none'
+    metrics.REGISTRY.observe(
+        'wiki_request_duration_seconds', total, endpoint=endpoint)
+    metrics.count('wiki_requests_total', endpoint=endpoint,
+                  status=response.status_code)
+    if current_app.config.get('SERVER_TIMING', True):
+        response.headers['Server-Timing'] = metrics.server_timing(
+            total, timings)
+    return response
+
+
 loginmanager = LoginManager()
 loginmanager.login_view = 'wiki.user_login'
 
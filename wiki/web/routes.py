@@ -2,26 +2,51 @@
     Routes
     ~~~~~~
 """
+from flask import abort
 from flask import Blueprint
+from flask import current_app
 from flask import flash
+from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import url_for
+from flask import Response
 from flask import session
 from flask_login import current_user
 from flask_login import login_required
 from flask_login import login_user
 from flask_login import logout_user
 
+import hashlib
+import re
+
+from wiki import history as githistory
+from wiki import metrics
+from wiki import snapshot
+from wiki.core import ANY
+from wiki.core import clean_url
+from wiki.core import ConflictError
+from wiki.core import META_KEY_RE
 from wiki.core import Processor
+from wiki.core import render_context
+from wiki.core import split_meta
+from wiki.drafts import DraftTooLarge
 from wiki.web.forms import EditorForm
 from wiki.web.forms import LoginForm
 from wiki.web.forms import SearchForm
 from wiki.web.forms import URLForm
 from wiki.web import current_wiki
 from wiki.web import current_users
+from wiki.web import get_app_routes_leading_elements
+from wiki.web import get_draft_user
+from wiki.web import get_drafts
+from wiki.web import get_previews
+from wiki.web import get_session_id
+from wiki.web import run_bounded
 from wiki.web.user import protect
+from wiki.workers import DeadlineExceeded
+from wiki.workers import WorkerError
 
 
 bp = Blueprint('wiki', __name__)
@@ -37,17 +62,26 @@ def home():
 
 
 @bp.route('/index/')
+@bp.route('/index/<path:prefix>/')
 @protect
-def index():
-    pages = current_wiki.index()
-    return render_template('index.html', pages=pages)
+def index(prefix=u''):
+    listing = current_wiki.namespace(prefix)
+    if listing is None:
+        abort(404)
+    namespaces, pages = listing
+    return render_template('index.html', prefix=prefix,
+                           namespaces=namespaces, pages=pages)
 
 
 @bp.route('/<path:url>/')
 @protect
 def display(url):
     page = current_wiki.get_or_404(url)
-    return render_template('page.html', page=page)
+    related = None
+    limit = current_app.config.get('RELATED_PAGES', 5)
+    if limit:
+        related = current_wiki.related(url, limit)
+    return render_template('page.html', page=page, related=related)
 
 
 @bp.route('/create/', methods=['GET', 'POST'])
@@ -65,24 +99,62 @@ def create():
 def edit(url):
     page = current_wiki.get(url)
     form = EditorForm(obj=page)
+    # autosaved drafts, see api_draft
+    draft_user = get_draft_user()
+    draft_url = api_url(url) if draft_user is not None else None
     if form.validate_on_submit():
         if not page:
             page = current_wiki.get_bare(url)
         form.populate_obj(page)
         author = session['user_id'] if 'user_id' in session else 'anonymouse'
         page.save(current_wiki, author=author)
+        if draft_url is not None:
+            get_drafts().discard(draft_user, draft_url)
         flash('"%s" was saved.' % page.title, 'success')
         return redirect(url_for('wiki.display', url=url))
-    return render_template('editor.html', form=form, page=page)
+    draft = None
+    if draft_url is not None:
+        draft = get_drafts().get(draft_user, draft_url)
+    return render_template('editor.html', form=form, page=page,
+                           draft_url=draft_url, draft=draft,
+                           token=current_wiki.tokens([url]).get(url))
+
+
+def render_preview(body, known):
+    """
+    Preview job, runs in a worker process. Includes are expanded here
+    too, so they cannot hold up the server. Only the blocks missing in
+    ``known`` are rendered, they are returned along with the html and
+    the keys of all blocks of the preview.
+    """
+    blocks = dict(known)
+    with render_context(current_wiki):
+        processor = Processor(body)
+        html, _, _ = processor.process_blocks(blocks)
+    rendered = dict((key, value) for key, value in blocks.items()
+                    if key not in known)
+    return html, rendered, processor.block_keys()
 
 
 @bp.route('/preview/', methods=['POST'])
 @protect
 def preview():
-    data = {}
-    processor = Processor(request.form['body'])
-    data['html'], data['body'], data['meta'] = processor.process()
-    return data['html']
+    body = request.form['body']
+    previews = get_previews()
+    # blocks are only cached per session
+    sid = get_session_id()
+    known = previews.known(sid) if sid is not None else {}
+    try:
+        html, rendered, keys = run_bounded(
+            current_app.config.get('PREVIEW_TIMEOUT', 5),
+            render_preview, body, known)
+    except DeadlineExceeded:
+        return 'Rendering the preview took too long.', 503
+    except WorkerError:
+        return 'The preview is not available right now.', 503
+    if sid is not None:
+        previews.update(sid, rendered, keys)
+    return html
 
 
 @bp.route('/move/<path:url>/', methods=['GET', 'POST'])
@@ -120,17 +192,200 @@ def tag(name):
     return render_template('tag.html', pages=tagged, tag=name)
 
 
+def run_search(term, ignore_case, limit, candidates):
+    """
+    Search job, runs in a worker process. The candidates are selected
+    by the caller, workers do not build the indexes.
+    """
+    return current_wiki.search(term, ignore_case, limit=limit,
+                               candidates=candidates)
+
+
 @bp.route('/search/', methods=['GET', 'POST'])
 @protect
 def search():
     form = SearchForm()
     if form.validate_on_submit():
-        results = current_wiki.search(form.term.data, form.ignore_case.data)
+        try:
+            candidates = current_wiki.candidates(
+                form.term.data, form.ignore_case.data)
+            results = run_bounded(
+                current_app.config.get('SEARCH_TIMEOUT', 10), run_search,
+                form.term.data, form.ignore_case.data,
+                current_app.config.get('SEARCH_LIMIT', 100), candidates)
+        except re.error as e:
+            form.term.errors.append('Invalid regular expression: %s' % e)
+            return render_template('search.html', form=form, search=None)
+        except DeadlineExceeded:
+            form.term.errors.append('The search took too long and was '
+                                    'cancelled, try a simpler expression.')
+            return render_template(
+                'search.html', form=form, search=None), 503
+        except WorkerError:
+            form.term.errors.append('Too many searches are running, '
+                                    'please try again later.')
+            return render_template(
+                'search.html', form=form, search=None), 503
         return render_template('search.html', form=form,
                                results=results, search=form.term.data)
     return render_template('search.html', form=form, search=None)
 
 
+@bp.route('/api/complete')
+@protect
+def complete():
+    query = request.args.get('q', u'')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    results = current_wiki.complete(query, limit)
+    return jsonify(query=query, results=[
+        {'url': url, 'title': title, 'match': kind}
+        for url, title, kind in results
+    ])
+
+
+def api_url(url):
+    """
+    Clean an url given to the api, ``None`` if no page can have it.
+    """
+    url = clean_url(url)
+    parts = url.split('/')
+    if (not url or any(part in ('', '.', '..') for part in parts) or
+            parts[0] in get_app_routes_leading_elements()):
+        return None
+    return url
+
+
+def api_error(message, status=400, **kwargs):
+    response = jsonify(error=message, **kwargs)
+    response.status_code = status
+    return response
+
+
+@bp.route('/api/pages')
+@protect
+def api_pages():
+    """
+    Read many pages at once: ``?urls=a,b`` or ``?urls=a&urls=b``.
+    """
+    urls = [api_url(url) for value in request.args.getlist('urls')
+            for url in value.split(',') if url.strip()]
+    if None in urls:
+        return api_error('Invalid url.')
+    if len(urls) > current_app.config.get('API_BATCH_SIZE', 100):
+        return api_error('Too many pages.')
+    pages = current_wiki.load_many(urls)
+    metrics.count('wiki_api_pages_total', len(pages), operation='read')
+    result = []
+    for url, (content, token) in pages.items():
+        meta, body = split_meta(content)
+        result.append({'url': url, 'token': token, 'meta': meta,
+                       'body': body})
+    return jsonify(pages=result,
+                   missing=[url for url in urls if url not in pages])
+
+
+@bp.route('/api/pages:batch', methods=['POST'])
+@protect
+def api_pages_batch():
+    """
+    Write many pages at once, all or none of them. Git backed wikis
+    commit them together. The body is json::
+
+        {"pages": [{"url": "a", "body": "text", "meta": {"title": "A"},
+                    "token": "<token read before or null if new>"}]}
+
+    Pages without a ``token`` are overwritten unconditionally. Only json
+    requests are accepted, which browsers do not send cross site.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('pages'), list):
+        return api_error('Expected a json object with a list of pages.')
+    if len(data['pages']) > current_app.config.get('API_BATCH_SIZE', 100):
+        return api_error('Too many pages.')
+    pages = []
+    for page in data['pages']:
+        if not isinstance(page, dict) or not isinstance(
+                page.get('url'), str):
+            return api_error('Every page needs an url.')
+        url = api_url(page['url'])
+        if url is None:
+            return api_error('Invalid url {0}.'.format(page['url']),
+                             url=page['url'])
+        body = page.get('body', u'')
+        meta = page.get('meta')
+        if meta is None:
+            meta = {}
+        if not isinstance(body, str) or not isinstance(meta, dict) or any(
+                not isinstance(value, str) for value in meta.values()):
+            return api_error('Invalid body or meta of {0}.'.format(url),
+                             url=url)
+        # a line break or colon would end the header or add keys
+        if any(not META_KEY_RE.match(key) or u'\n' in value
+               or u'\r' in value for key, value in meta.items()):
+            return api_error('Invalid meta of {0}.'.format(url), url=url)
+        if url in (p[0] for p in pages):
+            return api_error('{0} is given twice.'.format(url), url=url)
+        pages.append((url, body, meta, page.get('token', ANY)))
+    if not pages:
+        return api_error('No pages given.')
+    author = session['user_id'] if 'user_id' in session else 'anonymouse'
+    try:
+        tokens = current_wiki.save_many(pages, author=author)
+    except ConflictError as e:
+        metrics.count('wiki_api_conflicts_total', len(e.conflicts))
+        return api_error('Pages changed since they were read.', 409,
+                         conflicts=[{'url': url, 'token': token}
+                                    for url, token in sorted(
+                                        e.conflicts.items())])
+    metrics.count('wiki_api_pages_total', len(pages), operation='write')
+    return jsonify(pages=[{'url': url, 'token': tokens.get(url)}
+                          for url, _, _, _ in pages])
+
+
+@bp.route('/api/drafts/<path:url>', methods=['GET', 'PUT', 'DELETE'])
+@protect
+def api_draft(url):
+    """
+    The autosaved draft of a page by the current user, kept outside the
+    repository until the page is saved. ``PUT`` takes json::
+
+        {"title": "A", "body": "text", "tags": "a, b",
+         "token": "<token of the page the edit started from>"}
+
+    Like the batch api, only json requests are accepted. Without a
+    ``SECRET_KEY`` there are no sessions and no drafts.
+    """
+    user = get_draft_user()
+    if user is None:
+        return api_error('Drafts are not available.', 404)
+    url = api_url(url)
+    if url is None:
+        return api_error('Invalid url.')
+    drafts = get_drafts()
+    if request.method == 'GET':
+        draft = drafts.get(user, url)
+        if draft is None:
+            return api_error('No draft of {0}.'.format(url), 404)
+        return jsonify(draft)
+    if request.method == 'DELETE':
+        drafts.discard(user, url)
+        return '', 204
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_error('Expected a json object.')
+    draft = {}
+    for key in ('title', 'body', 'tags', 'token'):
+        value = data.get(key)
+        if value is not None and not isinstance(value, str):
+            return api_error('Invalid {0}.'.format(key))
+        draft[key] = value
+    try:
+        drafts.put(user, url, draft)
+    except DraftTooLarge as e:
+        return api_error(str(e), 413)
+    return jsonify(url=url)
+
+
 @bp.route('/user/login/', methods=['GET', 'POST'])
 def user_login():
     form = LoginForm()
@@ -187,6 +442,102 @@ def history_page(url):
         'history.html', url=url, history=history, commit=commit_object)
 
 
+@bp.route('/changes/')
+@protect
+def changes():
+    if not current_app.config.get('USE_GIT'):
+        abort(404)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        changes, cursor = current_wiki.changes(
+            request.args.get('start'), limit=limit)
+    except ValueError:
+        abort(400)
+    return render_template('changes.html', changes=changes, cursor=cursor,
+                           limit=limit)
+
+
+@bp.route('/blame/<path:url>/')
+@protect
+def blame(url):
+    if not current_app.config.get('USE_GIT'):
+        abort(404)
+    sections = current_wiki.blame(url)
+    if sections is None:
+        abort(404)
+    section = request.args.get('section', type=int)
+    if section is not None:
+        # expanding a collapsed section
+        if not 0 <= section < len(sections):
+            abort(404)
+        return render_template('blame_section.html', url=url,
+                               section=sections[section])
+    # only the first sections are rendered right away, the others when
+    # they are expanded
+    budget = current_app.config.get('BLAME_EXPAND_LINES', 200)
+    expanded = lines = 0
+    for section in sections:
+        if expanded and lines + section.count > budget:
+            break
+        expanded += 1
+        lines += section.count
+    return render_template('blame.html', url=url, sections=sections,
+                           expanded=expanded)
+
+
+def feed_etag(prefix):
+    """
+    The entity tag of a feed, which only changes with `HEAD`. Reading
+    `HEAD` does not need git, nor the wiki engine.
+    """
+    head = snapshot.generation(current_app.config['CONTENT_DIR'])
+    return hashlib.sha1(u'{0}\0{1}'.format(head, prefix)
+                        .encode('utf-8')).hexdigest()
+
+
+@bp.route('/feed.atom')
+@bp.route('/index/<path:prefix>/feed.atom')
+@protect
+def feed(prefix=u''):
+    if not current_app.config.get('USE_GIT'):
+        abort(404)
+    prefix = prefix.strip(u'/')
+    etag = feed_etag(prefix)
+    if request.if_none_match.contains(etag):
+        metrics.count('wiki_feed_requests_total', result='not_modified')
+        response = Response(status=304)
+    else:
+        metrics.count('wiki_feed_requests_total', result='full')
+        response = Response(
+            render_feed(etag, prefix), mimetype='application/atom+xml')
+    response.set_etag(etag)
+    # readers have to revalidate, which is cheap
+    response.cache_control.no_cache = True
+    return response
+
+
+def render_feed(etag, prefix):
+    key = ('feed', current_app.config['CONTENT_DIR'], etag, request.url_root)
+    data = githistory.CACHE.get(key)
+    if data is None:
+        changes = current_wiki.changes(
+            limit=current_app.config.get('FEED_SIZE', 50),
+            prefix=prefix or None)[0]
+        data = render_template(
+            'feed.xml', prefix=prefix, changes=changes).encode('utf-8')
+        githistory.CACHE.put(key, data)
+    return data
+
+
+@bp.route('/metrics')
+@protect
+def metrics_endpoint():
+    """Aggregated metrics of this process in Prometheus text format."""
+    if not current_app.config.get('METRICS', True):
+        abort(404)
+    return Response(metrics.REGISTRY.render(),
+                    mimetype='text/plain; version=0.0.4')
+
 
 """
     Error Handlers
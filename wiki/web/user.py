@@ -156,7 +156,13 @@ def check_hashed_password(password, salted_hash):
 def protect(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        if current_app.config.get('PRIVATE') and not current_user.is_authenticated():
-            return current_app.login_manager.unauthorized()
+        if current_app.config.get('PRIVATE'):
+            # a method of our users, a property of flask-login's
+            # anonymous user
+            authenticated = current_user.is_authenticated
+            if callable(authenticated):
+                authenticated = authenticated()
+            if not authenticated:
+                return current_app.login_manager.unauthorized()
         return f(*args, **kwargs)
     return wrapper
@@ -2,13 +2,47 @@
     Wiki core using Git as storage
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
+from wiki.core import blob_sha
 from wiki.core import Wiki
 from wiki.core import highlite_diff
-from wiki.core import Page
+from wiki.core import INDEXED
+from wiki.core import SearchResult
+from wiki import history as githistory
+from wiki import metrics
 from wiki import named_locks
+from wiki import snapshot
+from collections import OrderedDict
+from functools import wraps
 import datetime
 import git
 import os
+import re
+
+
+#: commit cursors accepted by :meth:`WikiGit.changes`
+SHA = re.compile(r'^[0-9a-f]{4,40}$')
+
+
+class TimedGit(object):
+    """
+    Proxy around a :class:`git.cmd.Git` object which times every git
+    command and counts the started subprocesses.
+    """
+
+    def __init__(self, git_cmd):
+        self._git = git_cmd
+
+    def __getattr__(self, name):
+        attr = getattr(self._git, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def command(*args, **kwargs):
+            metrics.count('wiki_git_subprocesses_total', command=name)
+            with metrics.timer('git'):
+                return attr(*args, **kwargs)
+        return command
 
 
 class WikiGit(Wiki):
@@ -35,7 +69,7 @@ class WikiGit(Wiki):
 
     def __init__(self, root):
         super(WikiGit, self).__init__(root)
-        self.repo = git.Repo(root).git
+        self.repo = TimedGit(git.Repo(root).git)
         named_locks.set_lock('git-lock', os.path.join(root, 'wikigit.flock'))
 
     @named_locks.interprocess_lock('git-lock')
@@ -73,11 +107,39 @@ class WikiGit(Wiki):
         author += ' <' + author + '>'
         self.repo.commit(m="changed", author=author)
 
+    @named_locks.interprocess_lock('git-lock')
+    def load_many(self, urls):
+        """Load many pages under a single lock."""
+        return super(WikiGit, self).load_many(urls)
+
+    @named_locks.interprocess_lock('git-lock')
+    def save_many(self, pages, author=None):
+        """
+        Save many pages in a single commit, see
+        :meth:`wiki.core.Wiki.save_many`.
+        """
+        self._write_many(pages)
+        self.repo.add('--', *[url + '.md' for url, _, _, _ in pages])
+        author = author or 'anonymouse'
+        author += ' <' + author + '>'
+        try:
+            self.repo.commit(
+                m="changed %d page%s" % (
+                    len(pages), '' if len(pages) == 1 else 's'),
+                author=author)
+        except git.exc.GitCommandError as e:
+            # nothing changed
+            if e.status != 1:
+                raise
+        return self.tokens(url for url, _, _, _ in pages)
+
     @named_locks.interprocess_lock('git-lock')
     def move(self, url, newurl):
         """Rename url's file inside a repository."""
         self.repo.mv(url + '.md', newurl + '.md')
         self.repo.commit(m="file moved")
+        self.indexes.page_removed(url)
+        self.indexes.page_saved(newurl)
 
     @named_locks.interprocess_lock('git-lock')
     def delete(self, url):
@@ -86,6 +148,7 @@ class WikiGit(Wiki):
             return False
         self.repo.rm(url + '.md')
         self.repo.commit(m="file deleted")
+        self.indexes.page_removed(url)
         return True
 
     def get_or_404(self, url):
@@ -102,6 +165,98 @@ class WikiGit(Wiki):
                 format=self.Commit.log_formatter).split('\n')
         ][offset:limit]
 
+    def head(self):
+        """
+        The sha of `HEAD`, read from the git directory without starting
+        git, empty if there are no commits yet.
+        """
+        return snapshot.generation(self.root)
+
+    def changes(self, start=None, limit=50, prefix=None):
+        """
+        Recent changes of all pages, newest first, paginated by commit.
+
+        :param str start: the sha of the first commit to list, a
+            cursor returned by a previous call, defaults to `HEAD`
+        :param int limit: the number of commits to list
+        :param str prefix: only list changes of pages in this namespace
+
+        :raises ValueError: if `start` is no sha
+        :returns: the :class:`~wiki.history.Change` objects and the
+            cursor of the next page, ``None`` on the last page
+        :rtype: tuple
+        """
+        if start is not None and not SHA.match(start):
+            raise ValueError(u'Invalid commit {0!r}'.format(start))
+        key = ('changes', self.root, self.head(), start, limit, prefix)
+        result = githistory.CACHE.get(key)
+        if result is None:
+            result = self._changes(start, limit, prefix)
+            githistory.CACHE.put(key, result)
+        return result
+
+    def _changes(self, start, limit, prefix):
+        pathspec = (prefix.strip('/') + '/' if prefix else '') + '*.md'
+        proc = self.repo.log(
+            start or 'HEAD', '-M', '--name-status',
+            '--format=' + githistory.LOG_FORMAT, '--', pathspec,
+            as_process=True)
+        changes = []
+        # one commit more than listed tells where the next page starts
+        for change in githistory.parse_log(proc.stdout):
+            changes.append(change)
+            if len(changes) > limit:
+                break
+        stopped = len(changes) > limit
+        try:
+            if stopped:
+                proc.kill()
+            proc.wait()
+        except git.exc.GitCommandError:
+            if not stopped:
+                # no commits yet or an unknown start
+                return [], None
+        if stopped:
+            return changes[:limit], changes[limit].sha
+        return changes, None
+
+    def blame(self, url):
+        """
+        Who last changed every line of a page.
+
+        Blame only depends on the content and the path of a file (as
+        long as history is not rewritten), so results are cached by the
+        blob sha of the file, which is computed like `git hash-object`
+        does without starting git.
+
+        :returns: the :class:`~wiki.history.BlameSection` objects of the
+            page, ``None`` if git does not know the page
+        :rtype: list
+        """
+        try:
+            with open(self.path(url), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        key = ('blame', self.root, blob_sha(data), url)
+        sections = githistory.CACHE.get(key)
+        if sections is not None:
+            return sections
+        proc = self.repo.blame('--porcelain', '--', url + '.md',
+                               as_process=True)
+        sections = githistory.blame_sections(
+            githistory.parse_blame(proc.stdout))
+        try:
+            proc.wait()
+        except git.exc.GitCommandError:
+            # not committed yet
+            return None
+        # lines which are not committed yet are blamed on a commit later
+        if all(hunk.commit.committed
+               for section in sections for hunk in section.hunks):
+            githistory.CACHE.put(key, sections)
+        return sections
+
     def show(self, commit):
         # TODO catch git.exc.GitCommandError and raise 404 or 500
         data = self.repo.show(
@@ -110,11 +265,78 @@ class WikiGit(Wiki):
         ).split('\0')
         return self.Commit(data[0], data[1], data[2], data[3].strip())
 
-    def search(self, term, ignore_case=True):
+    def candidates(self, term, ignore_case=True):
+        """
+        Select the pages to scan, see :meth:`wiki.core.Wiki.candidates`.
+        ``None`` if the trigram index does not narrow them down to less
+        than half of the pages, `git grep` beats scanning that many.
+        """
+        # expressions python can not parse match all pages
+        urls = self.indexes.candidates(
+            term, re.IGNORECASE if ignore_case else 0)
+        if urls is not None and len(urls) * 2 <= len(self.indexes):
+            return urls
+        return None
+
+    def search(self, term, ignore_case=True, attrs=['title', 'tags', 'body'],
+               limit=None, candidates=INDEXED):
+        """
+        Search pages. If the trigram index narrows the candidates down to
+        less than half of the pages, only those are scanned. Otherwise
+        `git grep` is used, its output is streamed and parsed per line
+        and it is stopped as soon as `limit` pages matched. Falls back
+        to scanning the files if `git grep` fails.
+        """
+        if candidates is INDEXED:
+            candidates = self.candidates(term, ignore_case)
         try:
-            results = self.repo.grep(term, G=True, i=ignore_case).split('\n')
-            # split filename:match for file names only (matched text can be
-            # used to output in the future).
-            return [Page(self, r.split(':')[0][:-3]) for r in results]
-        except git.exc.GitCommandError:
-            return super(WikiGit, self).search(term)
+            regex = re.compile(term, re.IGNORECASE if ignore_case else 0)
+        except re.error:
+            # extended regex syntax of git differs slightly, matches
+            # just will not be highlighted then
+            regex = None
+        if regex is not None and candidates is not None:
+            return self.scan(candidates, regex, attrs, limit)
+        proc = self.repo.grep(
+            '-n', '--null', '-I', '-E', '-e', term, '--', '*.md',
+            i=ignore_case, as_process=True)
+        results = OrderedDict()
+        # url -> the metadata and the number of header lines
+        headers = {}
+        stopped = False
+        for line in proc.stdout:
+            path, lineno, text = line.rstrip(b'\n').split(b'\0', 2)
+            url = path.decode('utf-8')[:-3]
+            if url not in headers:
+                headers[url] = self.load_header(url)
+            meta, header = headers[url]
+            lineno = int(lineno)
+            text = text.decode('utf-8', 'replace')
+            if lineno <= header:
+                # only values of the searched metadata keys count
+                key, _, text = text.partition(':')
+                if key.strip().lower() not in attrs:
+                    continue
+                if regex is not None and not regex.search(text):
+                    continue
+            elif 'body' not in attrs:
+                continue
+            if url not in results:
+                if limit and len(results) >= limit:
+                    stopped = True
+                    break
+                results[url] = SearchResult(url, meta.get('title'))
+            results[url].add_match(lineno, text, regex)
+        try:
+            if stopped:
+                proc.kill()
+            proc.wait()
+        except git.exc.GitCommandError as e:
+            if e.status == 1:
+                # nothing matched
+                return []
+            if not stopped:
+                return super(WikiGit, self).search(
+                    term, ignore_case, attrs, limit, None)
+        matched = [result for result in results.values() if result.count]
+        return sorted(matched, key=lambda x: x.title.lower())
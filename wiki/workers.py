@@ -0,0 +1,206 @@
+"""
+    Bounded workers
+    ~~~~~~~~~~~~~~~
+
+    A small pool of worker processes used to run untrusted work, like
+    user supplied regular expressions or markdown documents, with a
+    deadline. Python can not interrupt a running regular expression, so
+    instead of a thread the work is sent to a separate process, which
+    is killed (and lazily replaced) if it does not answer in time.
+
+    The pool size is also the concurrency limit: if no worker becomes
+    free before the deadline, :class:`PoolBusy` is raised instead of
+    queueing more work.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+
+from wiki import metrics
+
+
+class WorkerError(Exception):
+    """Base class of all errors raised by the pool."""
+
+
+class DeadlineExceeded(WorkerError):
+    """The work did not finish in time and was cancelled."""
+
+
+class PoolBusy(WorkerError):
+    """No worker became available before the deadline."""
+
+
+def _serve(conn, initializer=None, initargs=()):
+    """
+        Main loop of a worker process: receives ``(func, args,
+        kwargs)`` tuples and sends back ``(ok, result or exception)``.
+    """
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception:
+            # the jobs fail with the actual error
+            pass
+    while True:
+        try:
+            func, args, kwargs = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            result = (True, func(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # the result or exception could not be pickled
+            conn.send((False, WorkerError(repr(e))))
+
+
+class Worker(object):
+    """
+        A single worker process and the pipe to talk to it.
+    """
+
+    def __init__(self, context, initializer=None, initargs=()):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve, args=(child, initializer, initargs))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        self.conn.close()
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive() and hasattr(self.process, 'kill'):
+            self.process.kill()
+            self.process.join()
+
+
+class WorkerPool(object):
+    """
+        A fixed size pool of worker processes.
+
+        :param int size: the number of workers and therefore the number
+            of jobs running at the same time. ``0`` disables the pool,
+            jobs are then run in the calling thread without a deadline.
+        :param str start_method: the multiprocessing start method,
+            ``forkserver`` is used where available so workers do not
+            inherit the state of a threaded web server.
+        :param function initializer: run in every new worker before it
+            takes jobs, with ``initargs``
+        :param list preload: modules the fork server imports once, so
+            new workers do not have to
+    """
+
+    def __init__(self, size=2, start_method=None, initializer=None,
+                 initargs=(), preload=()):
+        if start_method is None and hasattr(multiprocessing, 'get_context'):
+            methods = multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if 'forkserver' in methods else None
+        if start_method and hasattr(multiprocessing, 'get_context'):
+            self.context = multiprocessing.get_context(start_method)
+        else:
+            self.context = multiprocessing
+        if preload and start_method == 'forkserver':
+            # only takes effect if the fork server is not running yet
+            self.context.set_forkserver_preload(list(preload))
+        self.size = size
+        self.initializer = initializer
+        self.initargs = initargs
+        self.pid = os.getpid()
+        self._idle = []
+        self._busy = 0
+        self._cond = threading.Condition()
+        atexit.register(self.close)
+
+    def _acquire(self, deadline):
+        with self._cond:
+            while self._busy >= self.size:
+                remaining = deadline - metrics.clock()
+                if remaining <= 0:
+                    metrics.count('wiki_worker_rejections_total')
+                    raise PoolBusy('All %d workers are busy.' % self.size)
+                self._cond.wait(remaining)
+            self._busy += 1
+            worker = self._idle.pop() if self._idle else None
+        if worker is None or not worker.is_alive():
+            try:
+                worker = self._start()
+            except Exception:
+                self._release(None)
+                raise
+        return worker
+
+    def _start(self):
+        return Worker(self.context, self.initializer, self.initargs)
+
+    def _release(self, worker):
+        with self._cond:
+            self._busy -= 1
+            if worker is not None:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def run(self, timeout, func, *args, **kwargs):
+        """
+            Runs ``func(*args, **kwargs)`` in a worker process.
+
+            ``func``, its arguments and its result have to be picklable,
+            so ``func`` must be a module level function. Exceptions
+            raised by ``func`` are raised again in the caller.
+
+            :param float timeout: seconds until the deadline, including
+                the time spent waiting for a free worker.
+
+            :raises DeadlineExceeded: if the deadline passed, the
+                worker is killed in that case.
+            :raises PoolBusy: if no worker became free in time.
+        """
+        if self.size <= 0:
+            return func(*args, **kwargs)
+        deadline = metrics.clock() + timeout
+        worker = self._acquire(deadline)
+        try:
+            with metrics.timer('worker'):
+                worker.conn.send((func, args, kwargs))
+                if not worker.conn.poll(max(deadline - metrics.clock(), 0)):
+                    metrics.count('wiki_worker_timeouts_total')
+                    worker.kill()
+                    # started right away, so it is ready for the next job
+                    try:
+                        worker = self._start()
+                    except Exception:
+                        worker = None
+                    raise DeadlineExceeded(
+                        'No result within %.1f seconds.' % timeout)
+                ok, result = worker.conn.recv()
+        except (EOFError, IOError, OSError):
+            # the worker died, it is replaced on next use
+            if worker is not None:
+                worker.kill()
+                worker = None
+            raise WorkerError('The worker process died.')
+        finally:
+            self._release(worker)
+        if not ok:
+            raise result
+        return result
+
+    def close(self):
+        """
+            Stops all idle workers.
+        """
+        if os.getpid() != self.pid:
+            return
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.kill()